@@ -0,0 +1,147 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Concurrent collection of the power states of many AMT nodes
+"""
+import os
+import time
+
+import eventlet
+from eventlet import tpool
+from ironic.common import exception as ironic_exception
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import importutils
+
+from ironic_staging_drivers.amt import common as amt_common
+from ironic_staging_drivers.amt import power as amt_power
+from ironic_staging_drivers.amt import resource_uris
+from ironic_staging_drivers.common import exception
+from ironic_staging_drivers.common.i18n import _
+from ironic_staging_drivers.common.i18n import _LE
+from ironic_staging_drivers.common.i18n import _LW
+
+pywsman = importutils.try_import('pywsman')
+
+opts = [
+    cfg.IntOpt('collector_workers',
+               default=32,
+               min=1,
+               help=_('Maximum number of AMT nodes whose power state is '
+                      'fetched at the same time by the power state '
+                      'collector. It is capped at the size of the eventlet '
+                      'thread pool, set by the EVENTLET_THREADPOOL_SIZE '
+                      'environment variable.')),
+    cfg.IntOpt('collector_timeout',
+               default=30,
+               min=1,
+               help=_('Time (in seconds) after which the power state '
+                      'collector gives up fetching the power state of a '
+                      'node.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='amt_driver')
+
+LOG = logging.getLogger(__name__)
+
+# Default size of the eventlet thread pool
+TPOOL_SIZE = 20
+
+
+def _get_power_state(node):
+    """Fetch the power state of a node whose AMT interface is awake.
+
+    The blocking pywsman call is run in a native thread, so that the other
+    nodes are handled meanwhile. A green timeout can't interrupt it, so the
+    call is made with a client of its own, whose transport gives up after
+    [amt_driver]collector_timeout seconds. The cached client of the node is
+    left to the other operations.
+    """
+    driver_info = amt_common.parse_driver_info(node)
+    timeout = CONF.amt_driver.collector_timeout
+    client = amt_common.Client(address=driver_info['address'],
+                               protocol=driver_info['protocol'],
+                               username=driver_info['username'],
+                               password=driver_info['password'],
+                               timeout=timeout)
+    client.check_circuit()
+    namespace = resource_uris.CIM_AssociatedPowerManagementService
+    start = time.time()
+    doc = tpool.execute(client.client.get, pywsman.ClientOptions(),
+                        namespace)
+    if doc is None and time.time() - start >= timeout:
+        amt_common.AMT_CIRCUIT_BREAKER.record_failure(client.endpoint)
+        raise exception.AMTTimeout(node=node.uuid, timeout=timeout)
+    return amt_power.parse_power_state(
+        client.parse_get_response(doc, namespace))
+
+
+def _collect(node):
+    try:
+        return _get_power_state(node)
+    except (exception.AMTFailure, exception.AMTConnectFailure,
+            exception.AMTTimeout) as e:
+        LOG.warning(_LW("Failed to get power state for node %(node_id)s "
+                        "with error: %(error)s."),
+                    {'node_id': node.uuid, 'error': e})
+        return e
+    except Exception as e:
+        # Any error is kept as the result of the node, so that the node is
+        # not missing from the result
+        LOG.exception(_LE("Unexpected error while getting power state for "
+                          "node %(node_id)s: %(error)s"),
+                      {'node_id': node.uuid, 'error': e})
+        return e
+
+
+def get_power_states(nodes):
+    """Get the power states of many AMT nodes at once.
+
+    The AMT interfaces are woken all at once first, then the power states
+    are fetched by at most [amt_driver]collector_workers workers, but no
+    more than the threads of the eventlet thread pool, each node being
+    given up after [amt_driver]collector_timeout seconds. A slow or
+    unreachable node doesn't delay the others.
+
+    :param nodes: a list of Ironic node objects.
+    :returns: a dict mapping node UUIDs to either one of the
+        ironic.common.states POWER_OFF, POWER_ON or ERROR, or the exception
+        raised when fetching the power state of the node.
+    """
+    result = {}
+    valid = []
+    for node in nodes:
+        try:
+            amt_common.parse_driver_info(node)
+        except (ironic_exception.InvalidParameterValue,
+                ironic_exception.MissingParameterValue) as e:
+            LOG.warning(_LW("Can't get power state of node %(node_id)s: "
+                            "%(error)s"), {'node_id': node.uuid, 'error': e})
+            result[node.uuid] = e
+        else:
+            valid.append(node)
+
+    asleep = amt_common.awake_amt_interfaces(valid)
+    for node in asleep:
+        result[node.uuid] = exception.AMTConnectFailure()
+    asleep = set(node.uuid for node in asleep)
+    awake = [node for node in valid if node.uuid not in asleep]
+
+    # Each worker holds a native thread while waiting for its node
+    tpool_size = int(os.environ.get('EVENTLET_THREADPOOL_SIZE', TPOOL_SIZE))
+    pool = eventlet.GreenPool(min(CONF.amt_driver.collector_workers,
+                                  tpool_size))
+    for node, state in zip(awake, pool.imap(_collect, awake)):
+        result[node.uuid] = state
+    return result
@@ -13,21 +13,28 @@
 """
 Common functionalities for AMT Driver
 """
+import collections
+import hashlib
+import os
+import threading
 import time
 from xml.etree import ElementTree
 
 from ironic.common import boot_devices
 from ironic.common import exception as ironic_exception
-from ironic.common import utils as ironic_utils
-from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import fileutils
 from oslo_utils import importutils
 import six
 
+from ironic_staging_drivers.amt import resource_uris
+from ironic_staging_drivers.amt import wake
 from ironic_staging_drivers.common import exception
 from ironic_staging_drivers.common.i18n import _
 from ironic_staging_drivers.common.i18n import _LE
+from ironic_staging_drivers.common.i18n import _LW
+from ironic_staging_drivers.common import utils
 
 pywsman = importutils.try_import('pywsman')
 
@@ -62,6 +69,44 @@ opts = [
                       'sleep after 60 seconds of inactivity by default. '
                       'IdleTimeout=0 means AMT will not go to sleep at all. '
                       'Setting awake_interval=0 will disable awake call.')),
+    cfg.StrOpt('awake_cache_dir',
+               help=_('Directory where the time of the last awake call to '
+                      'each AMT interface is recorded, as the modification '
+                      'time of an empty file named after the node UUID. '
+                      'When set, all the conductor workers sharing this '
+                      'directory skip the interfaces woken by each other. '
+                      'By default the times are only kept in memory, by '
+                      'each worker.')),
+    cfg.IntOpt('client_cache_ttl',
+               default=300,
+               min=0,
+               help=_('Time (in seconds) an idle AMT client is kept for '
+                      'reuse by the next call to the same node, so that '
+                      'its connection to the AMT endpoint can be kept '
+                      'alive. Setting client_cache_ttl=0 disables the '
+                      'cache.')),
+    cfg.IntOpt('wsman_timeout',
+               default=60,
+               min=0,
+               help=_('Time (in seconds) after which a WS-Management call '
+                      'to an AMT endpoint is given up, including the time '
+                      'to connect to the endpoint. Setting wsman_timeout=0 '
+                      'keeps the default of the openwsman library.')),
+    cfg.IntOpt('circuit_breaker_threshold',
+               default=3,
+               min=0,
+               help=_('Number of consecutive connection failures to an AMT '
+                      'endpoint after which the calls to this endpoint fail '
+                      'immediately, for circuit_breaker_cooldown seconds. '
+                      'Setting circuit_breaker_threshold=0 disables the '
+                      'circuit breaker.')),
+    cfg.IntOpt('circuit_breaker_cooldown',
+               default=60,
+               min=1,
+               help=_('Time (in seconds) during which the calls to an AMT '
+                      'endpoint fail immediately once its circuit breaker '
+                      'is open. The next call after this time is tried, '
+                      'and opens the circuit breaker again on failure.')),
 ]
 
 CONF = cfg.CONF
@@ -87,8 +132,249 @@ AMT_PROTOCOL_PORT_MAP = {
 # ReturnValue constants
 RET_SUCCESS = '0'
 
-# A dict cache last awake call to AMT Interface
-AMT_AWAKE_CACHE = {}
+# Maximum number of instances returned by an optimized enumeration
+ENUMERATION_MAX_ELEMENTS = 64
+
+# Maximum number of last awake times kept in memory
+AWAKE_CACHE_SIZE = 4096
+
+
+class AwakeCache(object):
+    """Times of the last awake calls to the AMT interfaces.
+
+    The times are kept in a bounded in-memory cache, and also in
+    [amt_driver]awake_cache_dir when set, so that all the conductor workers
+    of a host share them. Times older than [amt_driver]awake_interval are
+    dropped.
+    """
+
+    def __init__(self, size=AWAKE_CACHE_SIZE):
+        self._size = size
+        # node uuid -> last awake time, least recently updated first
+        self._times = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, uuid):
+        return os.path.join(CONF.amt_driver.awake_cache_dir, uuid)
+
+    def _get_shared(self, uuid, now, interval):
+        path = self._path(uuid)
+        try:
+            last_awake = os.stat(path).st_mtime
+        except OSError:
+            return 0
+        if now - last_awake <= interval:
+            return last_awake
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return 0
+
+    def _set_shared(self, uuid, when):
+        path = self._path(uuid)
+        try:
+            fileutils.ensure_tree(CONF.amt_driver.awake_cache_dir)
+            with open(path, 'a'):
+                os.utime(path, (when, when))
+        except (IOError, OSError) as e:
+            LOG.warning(_LW('Unable to record the awake time of node '
+                            '%(node_id)s in %(path)s: %(error)s'),
+                        {'node_id': uuid, 'path': path, 'error': e})
+
+    def get(self, uuid):
+        """Get the time of the last awake call to a node's AMT interface.
+
+        :param uuid: the node UUID.
+        :returns: the time of the last awake call, 0 if the interface was
+            not woken during the last awake_interval.
+        """
+        now = time.time()
+        interval = CONF.amt_driver.awake_interval
+        with self._lock:
+            last_awake = self._times.get(uuid, 0)
+            if last_awake and now - last_awake > interval:
+                del self._times[uuid]
+                last_awake = 0
+        if not last_awake and CONF.amt_driver.awake_cache_dir:
+            last_awake = self._get_shared(uuid, now, interval)
+            if last_awake:
+                self._set_local(uuid, last_awake)
+        return last_awake
+
+    def _set_local(self, uuid, when):
+        with self._lock:
+            self._times.pop(uuid, None)
+            self._times[uuid] = when
+            while len(self._times) > self._size:
+                self._times.popitem(last=False)
+
+    def set(self, uuid, when):
+        """Record the time of an awake call to a node's AMT interface.
+
+        :param uuid: the node UUID.
+        :param when: the time of the awake call.
+        """
+        self._set_local(uuid, when)
+        if CONF.amt_driver.awake_cache_dir:
+            self._set_shared(uuid, when)
+
+    def clear(self):
+        """Forget the in-memory times."""
+        with self._lock:
+            self._times.clear()
+
+
+AMT_AWAKE_CACHE = AwakeCache()
+
+
+def _endpoint(address, protocol):
+    """Get the key of an AMT endpoint, as an (address, port) tuple."""
+    if isinstance(address, six.binary_type):
+        address = address.decode('utf-8')
+    if isinstance(protocol, six.binary_type):
+        protocol = protocol.decode('utf-8')
+    port = AMT_PROTOCOL_PORT_MAP.get(protocol, AMT_PROTOCOL_PORT_MAP['http'])
+    return address, port
+
+
+class CircuitBreaker(object):
+    """Per-endpoint circuit breaker for the AMT calls.
+
+    After [amt_driver]circuit_breaker_threshold consecutive connection
+    failures to an endpoint, the breaker of this endpoint opens and the calls
+    to it fail immediately for [amt_driver]circuit_breaker_cooldown seconds,
+    so that unreachable nodes don't tie up the conductor. The first call
+    after the cool-down is tried, and either closes the breaker or opens it
+    again.
+    """
+
+    def __init__(self):
+        # (address, port) -> [consecutive failures, time the breaker is open
+        # until]
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, endpoint):
+        """Whether the calls to an endpoint should fail immediately.
+
+        :param endpoint: an (address, port) tuple.
+        """
+        if not CONF.amt_driver.circuit_breaker_threshold:
+            return False
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            return entry is not None and entry[1] > time.time()
+
+    def check(self, endpoint):
+        """Fail immediately if the breaker of an endpoint is open.
+
+        :param endpoint: an (address, port) tuple.
+        :raises: AMTConnectFailure if the breaker is open.
+        """
+        if self.is_open(endpoint):
+            LOG.debug('Circuit breaker of AMT endpoint %(address)s:%(port)s '
+                      'is open, failing immediately.',
+                      {'address': endpoint[0], 'port': endpoint[1]})
+            raise exception.AMTConnectFailure()
+
+    def record_failure(self, endpoint):
+        """Record a connection failure to an endpoint.
+
+        :param endpoint: an (address, port) tuple.
+        """
+        threshold = CONF.amt_driver.circuit_breaker_threshold
+        if not threshold:
+            return
+        cooldown = CONF.amt_driver.circuit_breaker_cooldown
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, [0, 0])
+            entry[0] += 1
+            if entry[0] < threshold:
+                return
+            entry[1] = time.time() + cooldown
+        LOG.warning(_LW('AMT endpoint %(address)s:%(port)s failed '
+                        '%(failures)d times in a row, failing the calls to '
+                        'it for %(cooldown)d seconds.'),
+                    {'address': endpoint[0], 'port': endpoint[1],
+                     'failures': entry[0], 'cooldown': cooldown})
+
+    def record_success(self, endpoint):
+        """Record a successful call to an endpoint, closing its breaker.
+
+        :param endpoint: an (address, port) tuple.
+        """
+        with self._lock:
+            self._endpoints.pop(endpoint, None)
+
+    def clear(self):
+        """Close all the breakers."""
+        with self._lock:
+            self._endpoints.clear()
+
+
+AMT_CIRCUIT_BREAKER = CircuitBreaker()
+
+
+def _build_tag(namespace, item):
+    return '{%(namespace)s}%(item)s' % {'namespace': namespace,
+                                        'item': item}
+
+
+# Tags of the elements looked up in the AMT responses, precomputed for the
+# known namespaces, and completed on demand for the others
+_TAGS = dict(((namespace, item), _build_tag(namespace, item))
+             for namespace, item in (
+                 (_SOAP_ENVELOPE, 'Fault'),
+                 (resource_uris.CIM_AssociatedPowerManagementService,
+                  'PowerState'),
+                 (resource_uris.CIM_PowerManagementService, 'ReturnValue'),
+                 (resource_uris.CIM_BootConfigSetting, 'ReturnValue'),
+                 (resource_uris.CIM_BootSourceSetting, 'ReturnValue'),
+                 (resource_uris.CIM_BootService, 'ReturnValue')))
+
+
+class WSManResponse(object):
+    """AMT response, parsed once for all the lookups."""
+
+    def __init__(self, doc):
+        """Parse the response.
+
+        :param doc: the XmlDoc object returned by pywsman.
+        :raises: AMTConnectFailure if there is no response.
+        """
+        if doc is None:
+            raise exception.AMTConnectFailure()
+        self.doc = doc
+        self.tree = ElementTree.fromstring(doc.root().string())
+
+    def find(self, namespace, item):
+        """Find the first element with namespace and item.
+
+        :param namespace: the namespace of the element.
+        :param item: the element name.
+        :returns: the element object or None
+        """
+        key = (namespace, item)
+        tag = _TAGS.get(key)
+        if tag is None:
+            tag = _TAGS[key] = _build_tag(namespace, item)
+        # The root is the SOAP envelope, only its descendants are looked up
+        for element in self.tree.iter(tag):
+            if element is not self.tree:
+                return element
+        return None
+
+    def findall(self, namespace, item):
+        """Find all the elements with namespace and item.
+
+        :param namespace: the namespace of the elements.
+        :param item: the element name.
+        :returns: a list of the element objects, in document order.
+        """
+        tag = _build_tag(namespace, item)
+        return [element for element in self.tree.iter(tag)
+                if element is not self.tree]
 
 
 class Client(object):
@@ -96,28 +382,86 @@ class Client(object):
 
     Create a pywsman client to connect to the target server
     """
-    def __init__(self, address, protocol, username, password):
+    def __init__(self, address, protocol, username, password, timeout=None):
+        self.endpoint = _endpoint(address, protocol)
         port = AMT_PROTOCOL_PORT_MAP[protocol]
         path = '/wsman'
         if isinstance(protocol, six.text_type):
             protocol = protocol.encode()
         self.client = pywsman.Client(address, port, path, protocol,
                                      username, password)
+        if timeout is None:
+            timeout = CONF.amt_driver.wsman_timeout
+        if timeout:
+            # openwsman only has a timeout for the whole transfer, which
+            # includes connecting to the endpoint
+            self.client.transport().set_timeout(timeout)
+
+    def check_circuit(self):
+        """Fail immediately if the endpoint is known to be unreachable.
+
+        :raises: AMTConnectFailure if the circuit breaker of the endpoint
+            is open.
+        """
+        AMT_CIRCUIT_BREAKER.check(self.endpoint)
+
+    def _parse_response(self, doc):
+        if doc is None:
+            _CLIENT_CACHE.discard(self)
+            AMT_CIRCUIT_BREAKER.record_failure(self.endpoint)
+            raise exception.AMTConnectFailure()
+        AMT_CIRCUIT_BREAKER.record_success(self.endpoint)
+        return WSManResponse(doc)
 
     def wsman_get(self, resource_uri, options=None):
         """Get target server info
 
         :param options: client options
         :param resource_uri: a URI to an XML schema
-        :returns: XmlDoc object
+        :returns: WSManResponse object
         :raises: AMTFailure if get unexpected response.
-        :raises: AMTConnectFailure if unable to connect to the server.
+        :raises: AMTConnectFailure if unable to connect to the server, or
+            if its circuit breaker is open.
         """
+        self.check_circuit()
         if options is None:
             options = pywsman.ClientOptions()
         doc = self.client.get(options, resource_uri)
+        return self.parse_get_response(doc, resource_uri)
+
+    def wsman_enumerate(self, resource_uri, options=None):
+        """Enumerate the instances of a class on target server
+
+        The enumeration is optimized, so that the instances come with the
+        enumeration response and a single request is made.
+
+        :param resource_uri: a URI to an XML schema
+        :param options: client options
+        :returns: WSManResponse object
+        :raises: AMTFailure if get unexpected response.
+        :raises: AMTConnectFailure if unable to connect to the server, or
+            if its circuit breaker is open.
+        """
+        self.check_circuit()
+        if options is None:
+            options = pywsman.ClientOptions()
+        options.set_flags(pywsman.FLAG_ENUMERATION_OPTIMIZATION)
+        options.set_max_elements(ENUMERATION_MAX_ELEMENTS)
+        doc = self.client.enumerate(options, None, resource_uri)
+        return self.parse_get_response(doc, resource_uri)
+
+    def parse_get_response(self, doc, resource_uri):
+        """Parse and check the response of a get call
+
+        :param doc: the XmlDoc object returned by pywsman.
+        :param resource_uri: the URI passed to the get call.
+        :returns: WSManResponse object
+        :raises: AMTFailure if get unexpected response.
+        :raises: AMTConnectFailure if unable to connect to the server.
+        """
+        doc = self._parse_response(doc)
         item = 'Fault'
-        fault = xml_find(doc, _SOAP_ENVELOPE, item)
+        fault = doc.find(_SOAP_ENVELOPE, item)
         if fault is not None:
             LOG.error(_LE('Call to AMT with URI %(uri)s failed: '
                           'got Fault %(fault)s'),
@@ -132,16 +476,19 @@ class Client(object):
         :param resource_uri: a URI to an XML schema
         :param method: invoke method
         :param data: a XmlDoc as invoke input
-        :returns: XmlDoc object
+        :returns: WSManResponse object
         :raises: AMTFailure if get unexpected response.
-        :raises: AMTConnectFailure if unable to connect to the server.
+        :raises: AMTConnectFailure if unable to connect to the server, or
+            if its circuit breaker is open.
         """
+        self.check_circuit()
         if data is None:
             doc = self.client.invoke(options, resource_uri, method)
         else:
             doc = self.client.invoke(options, resource_uri, method, data)
+        doc = self._parse_response(doc)
         item = "ReturnValue"
-        return_value = xml_find(doc, resource_uri, item).text
+        return_value = doc.find(resource_uri, item).text
         if return_value != RET_SUCCESS:
             LOG.error(_LE("Call to AMT with URI %(uri)s and "
                           "method %(method)s failed: return value "
@@ -152,6 +499,7 @@ class Client(object):
         return doc
 
 
+@utils.cache_driver_info(defaults=lambda: CONF.amt_driver.protocol)
 def parse_driver_info(node):
     """Parses and creates AMT driver info
 
@@ -190,67 +538,195 @@ def parse_driver_info(node):
     return d_info
 
 
+def _client_key(driver_info):
+    """Key identifying the endpoint and credentials of a client."""
+    password = driver_info['password']
+    if isinstance(password, six.text_type):
+        password = password.encode()
+    return (driver_info['uuid'], driver_info['address'],
+            driver_info['protocol'], driver_info['username'],
+            hashlib.sha256(password).hexdigest())
+
+
+class _ClientCache(object):
+    """Per node cache of AMT clients.
+
+    A cached client is replaced when the endpoint or the credentials of its
+    node change, and dropped when it fails to connect or when it has been
+    idle for longer than [amt_driver]client_cache_ttl.
+    """
+
+    def __init__(self):
+        # node uuid -> [client key, client, last used]
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _pop_idle(self, now, ttl):
+        idle = [uuid for uuid, (key, client, last_used)
+                in self._clients.items() if now - last_used > ttl]
+        for uuid in idle:
+            del self._clients[uuid]
+
+    def get(self, driver_info):
+        """Get a client for the node, creating it if needed.
+
+        :param driver_info: the node's driver info, as returned by
+            parse_driver_info.
+        :returns: a Client object.
+        """
+        ttl = CONF.amt_driver.client_cache_ttl
+        key = _client_key(driver_info)
+        uuid = driver_info['uuid']
+        now = time.time()
+        with self._lock:
+            self._pop_idle(now, ttl)
+            entry = self._clients.get(uuid)
+            if entry is not None and entry[0] == key:
+                entry[2] = now
+                return entry[1]
+
+        client = Client(address=driver_info['address'],
+                        protocol=driver_info['protocol'],
+                        username=driver_info['username'],
+                        password=driver_info['password'])
+        if ttl:
+            with self._lock:
+                self._clients[uuid] = [key, client, now]
+        return client
+
+    def discard(self, client):
+        """Drop a client from the cache."""
+        with self._lock:
+            for uuid, entry in list(self._clients.items()):
+                if entry[1] is client:
+                    del self._clients[uuid]
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+_CLIENT_CACHE = _ClientCache()
+
+
 def get_wsman_client(node):
     """Return a AMT Client object
 
+    Clients are cached per node and reused by the next calls.
+
     :param node: an Ironic node object.
     :returns: a Client object
     :raises: MissingParameterValue if any required parameters are missing.
     :raises: InvalidParameterValue if any parameters have invalid values.
     """
     driver_info = parse_driver_info(node)
-    client = Client(address=driver_info['address'],
-                    protocol=driver_info['protocol'],
-                    username=driver_info['username'],
-                    password=driver_info['password'])
-    return client
+    return _CLIENT_CACHE.get(driver_info)
+
+
+def request_template(builder):
+    """Decorator caching the request bodies built by builder.
+
+    The WS-Man request bodies only depend on a few values, like the power
+    state code or the boot source, so each body is built once per process
+    and set of arguments, and then reused. pywsman copies the body into
+    each request, so a cached body is never modified.
+
+    :param builder: a function building a XmlDoc from hashable arguments.
+    :returns: the caching function. The uncached builder is available as
+        its __wrapped__ attribute.
+    """
+    docs = {}
+
+    @six.wraps(builder)
+    def wrapper(*args):
+        doc = docs.get(args)
+        if doc is None:
+            doc = docs.setdefault(args, builder(*args))
+        return doc
+
+    wrapper.cache_clear = docs.clear
+    return wrapper
 
 
 def xml_find(doc, namespace, item):
     """Find the first element with namespace and item, in the XML doc
 
-    :param doc: a doc object.
+    :param doc: a WSManResponse object, or a doc object which is parsed for
+        this lookup only.
     :param namespace: the namespace of the element.
     :param item: the element name.
     :returns: the element object or None
     :raises: AMTConnectFailure if unable to connect to the server.
     """
-    if doc is None:
-        raise exception.AMTConnectFailure()
-    tree = ElementTree.fromstring(doc.root().string())
-    query = ('.//{%(namespace)s}%(item)s' % {'namespace': namespace,
-                                             'item': item})
-    return tree.find(query)
+    if not isinstance(doc, WSManResponse):
+        doc = WSManResponse(doc)
+    return doc.find(namespace, item)
 
 
-def awake_amt_interface(node):
-    """Wake up AMT interface.
+def _node_endpoint(node):
+    return _endpoint(node.driver_info['amt_address'],
+                     node.driver_info.get('amt_protocol',
+                                          CONF.amt_driver.protocol))
 
-    AMT interface goes to sleep after a period of time if the host is off.
-    This method will ping AMT interface to wake it up. Because there is
-    no guarantee that the AMT address in driver_info is correct, only
-    ping the IP five times which is enough to wake it up.
 
-    :param node: an Ironic node object.
-    :raises: AMTConnectFailure if unable to connect to the server.
+def awake_amt_interfaces(nodes):
+    """Wake up the AMT interfaces of many nodes at once.
+
+    AMT interface goes to sleep after a period of time if the host is off.
+    This method sends a few ICMP echo requests, or TCP connection requests
+    when ICMP sockets are not available, to the AMT interfaces which were
+    not woken during the last awake_interval, and waits for their first
+    answer. The interfaces whose circuit breaker is open are not woken, and
+    count as failed.
+
+    :param nodes: a list of Ironic node objects.
+    :returns: the list of the nodes whose AMT interface did not answer.
     """
     awake_interval = CONF.amt_driver.awake_interval
     if awake_interval == 0:
-        return
+        return []
 
     now = time.time()
-    last_awake = AMT_AWAKE_CACHE.get(node.uuid, 0)
-    if now - last_awake > awake_interval:
-        cmd_args = ['ping', '-i', 0.2, '-c', 5,
-                    node.driver_info['amt_address']]
-        try:
-            ironic_utils.execute(*cmd_args)
-        except processutils.ProcessExecutionError as err:
-            LOG.error(_LE('Unable to awake AMT interface on node '
-                          '%(node_id)s. Error: %(error)s'),
-                      {'node_id': node.uuid, 'error': err})
-            raise exception.AMTConnectFailure()
+    to_wake = []
+    failed = []
+    for node in nodes:
+        if now - AMT_AWAKE_CACHE.get(node.uuid) <= awake_interval:
+            continue
+        if AMT_CIRCUIT_BREAKER.is_open(_node_endpoint(node)):
+            LOG.debug('Not waking AMT interface on node %(node_id)s, its '
+                      'circuit breaker is open.', {'node_id': node.uuid})
+            failed.append(node)
         else:
+            to_wake.append(node)
+    if not to_wake:
+        return failed
+
+    targets = {}
+    for node in to_wake:
+        address, port = _node_endpoint(node)
+        targets[address] = port
+    awake = wake.wake_interfaces(targets)
+
+    for node in to_wake:
+        address = node.driver_info['amt_address']
+        if address in awake:
             LOG.debug(('Successfully awakened AMT interface on node '
                        '%(node_id)s.'), {'node_id': node.uuid})
-            AMT_AWAKE_CACHE[node.uuid] = now
+            AMT_AWAKE_CACHE.set(node.uuid, now)
+        else:
+            LOG.error(_LE('Unable to awake AMT interface on node '
+                          '%(node_id)s. No answer from %(address)s.'),
+                      {'node_id': node.uuid, 'address': address})
+            AMT_CIRCUIT_BREAKER.record_failure(_node_endpoint(node))
+            failed.append(node)
+    return failed
+
+
+def awake_amt_interface(node):
+    """Wake up AMT interface.
+
+    :param node: an Ironic node object.
+    :raises: AMTConnectFailure if unable to connect to the server.
+    """
+    if awake_amt_interfaces([node]):
+        raise exception.AMTConnectFailure()
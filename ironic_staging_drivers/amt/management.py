@@ -29,6 +29,7 @@ from ironic_staging_drivers.common import exception
 from ironic_staging_drivers.common.i18n import _
 from ironic_staging_drivers.common.i18n import _LE
 from ironic_staging_drivers.common.i18n import _LI
+from ironic_staging_drivers.common.i18n import _LW
 
 pywsman = importutils.try_import('pywsman')
 
@@ -39,7 +40,10 @@ _ADDRESS = 'http://schemas.xmlsoap.org/ws/2004/08/addressing'
 _ANONYMOUS = 'http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous'
 _WSMAN = 'http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd'
 
+_BOOT_CONFIG_ID = 'Intel(r) AMT: Boot Configuration 0'
 
+
+@amt_common.request_template
 def _generate_change_boot_order_input(device):
     """Generate Xmldoc as change_boot_order input.
 
@@ -81,7 +85,7 @@ def _set_boot_device_order(node, boot_device):
     method = 'ChangeBootOrder'
 
     options = pywsman.ClientOptions()
-    options.add_selector('InstanceID', 'Intel(r) AMT: Boot Configuration 0')
+    options.add_selector('InstanceID', _BOOT_CONFIG_ID)
 
     try:
         client.wsman_invoke(options, resource_uris.CIM_BootConfigSetting,
@@ -98,6 +102,7 @@ def _set_boot_device_order(node, boot_device):
                  {'boot_device': boot_device, 'node_id': node.uuid})
 
 
+@amt_common.request_template
 def _generate_enable_boot_config_input():
     """Generate Xmldoc as enable_boot_config input.
 
@@ -150,6 +155,73 @@ def _enable_boot_config(node):
                  {'node_id': node.uuid})
 
 
+def _reference_id(element, namespace, item):
+    """Get the InstanceID selector of a reference property of an instance.
+
+    :param element: the instance element.
+    :param namespace: the namespace of the instance.
+    :param item: the name of the reference property.
+    :returns: the InstanceID, or None if it is not found.
+    """
+    reference = element.find('{%s}%s' % (namespace, item))
+    if reference is None:
+        return None
+    for selector in reference.iter('{%s}Selector' % _WSMAN):
+        if selector.get('Name') == 'InstanceID':
+            return selector.text
+    return None
+
+
+def _get_next_boot_source(node):
+    """Get the boot source used by the next boot of AMT Client.
+
+    The boot order of the AMT boot configuration is read with a single
+    enumeration of its CIM_OrderedComponent associations, which link it to
+    the CIM_BootSourceSetting instances.
+
+    :param node: a node object
+    :returns: the InstanceID of the CIM_BootSourceSetting assigned the first
+        sequence, or None if the boot order is empty.
+    :raises: AMTFailure
+    :raises: AMTConnectFailure
+    """
+    amt_common.awake_amt_interface(node)
+    client = amt_common.get_wsman_client(node)
+    namespace = resource_uris.CIM_OrderedComponent
+    doc = client.wsman_enumerate(namespace)
+    for component in doc.findall(namespace, 'CIM_OrderedComponent'):
+        sequence = component.find('{%s}AssignedSequence' % namespace)
+        if (sequence is not None and sequence.text == '1' and
+                _reference_id(component, namespace,
+                              'GroupComponent') == _BOOT_CONFIG_ID):
+            return _reference_id(component, namespace, 'PartComponent')
+    return None
+
+
+def _is_boot_device_pending(node, boot_device):
+    """Whether the next boot of AMT Client already uses a boot device.
+
+    It is the case when the last boot configuration applied to the node
+    was for boot_device, and the AMT firmware still has its boot source
+    first in the boot order, that is it was not used by a boot yet.
+
+    :param node: a node object
+    :param boot_device: the boot device
+    :returns: True if the boot configuration does not need to be applied.
+    """
+    applied = node.driver_internal_info.get('amt_applied_boot_device')
+    if applied != boot_device:
+        return False
+    try:
+        source = _get_next_boot_source(node)
+    except (exception.AMTFailure, exception.AMTConnectFailure) as e:
+        LOG.warning(_LW("Failed to get the boot order of node %(node_id)s, "
+                        "applying the boot configuration: %(error)s"),
+                    {'node_id': node.uuid, 'error': e})
+        return False
+    return source == amt_common.BOOT_DEVICES_MAPPING[boot_device]
+
+
 class AMTManagement(base.ManagementInterface):
 
     def get_properties(self):
@@ -230,6 +302,10 @@ class AMTManagement(base.ManagementInterface):
     def ensure_next_boot_device(self, node, boot_device):
         """Set next boot device (one time only) of AMT Client.
 
+        The boot configuration is not sent again when the last one applied
+        to the node is still pending in the AMT firmware for the same boot
+        device.
+
         :param node: a node object
         :param boot_device: the boot device
         :raises: AMTFailure
@@ -243,8 +319,20 @@ class AMTManagement(base.ManagementInterface):
             node.driver_internal_info = driver_internal_info
             node.save()
 
+        if _is_boot_device_pending(node, boot_device):
+            LOG.debug('Boot device %(boot_device)s is already set for the '
+                      'next boot of node %(node_id)s',
+                      {'boot_device': boot_device, 'node_id': node.uuid})
+            return
+
         _set_boot_device_order(node, boot_device)
         _enable_boot_config(node)
+        # Only recorded once both calls are acknowledged
+        driver_internal_info = node.driver_internal_info
+        if driver_internal_info.get('amt_applied_boot_device') != boot_device:
+            driver_internal_info['amt_applied_boot_device'] = boot_device
+            node.driver_internal_info = driver_internal_info
+            node.save()
 
     def get_sensors_data(self, task):
         raise NotImplementedError()
@@ -15,6 +15,7 @@
 AMT Power Driver
 """
 import copy
+import time
 
 from ironic.common import exception as ironic_exception
 from ironic.common import states
@@ -44,7 +45,24 @@ opts = [
     cfg.IntOpt('action_wait',
                default=10,
                help=_('Amount of time (in seconds) to wait, before retrying '
-                      'an AMT operation'))
+                      'an AMT operation')),
+    cfg.IntOpt('action_wait_min',
+               default=1,
+               min=1,
+               help=_('Amount of time (in seconds) to wait, before checking '
+                      'the result of an AMT operation for the first time. '
+                      'The time between the following checks doubles, up '
+                      'to action_wait.')),
+    cfg.StrOpt('reboot_method',
+               default='power_off_on',
+               choices=['power_off_on', 'power_cycle'],
+               help=_('How to reboot the nodes. "power_off_on" powers the '
+                      'node off, waits for it to be off, then powers it on. '
+                      '"power_cycle" sends a single power cycle request and '
+                      'waits for the node to be on again, falling back to '
+                      '"power_off_on" when the request is rejected by the '
+                      'AMT firmware or the node is not seen off and then on '
+                      'again.')),
 ]
 
 CONF = cfg.CONF
@@ -55,9 +73,12 @@ LOG = logging.getLogger(__name__)
 AMT_POWER_MAP = {
     states.POWER_ON: '2',
     states.POWER_OFF: '8',
+    # Power Cycle (Off Soft), only used to request a change
+    states.REBOOT: '5',
 }
 
 
+@amt_common.request_template
 def _generate_power_action_input(action):
     """Generate Xmldoc as set_power_state input.
 
@@ -139,14 +160,32 @@ def _power_status(node):
                               "with error: %(error)s."),
                           {'node_id': node.uuid, 'error': e})
 
+    return parse_power_state(doc)
+
+
+def parse_power_state(doc):
+    """Get the power state from a CIM_AssociatedPowerManagementService.
+
+    :param doc: the response to the get call.
+    :returns: one of ironic.common.states POWER_OFF, POWER_ON or ERROR.
+    :raises: AMTConnectFailure if there is no response.
+    """
+    namespace = resource_uris.CIM_AssociatedPowerManagementService
     item = "PowerState"
     power_state = amt_common.xml_find(doc, namespace, item).text
-    for state in AMT_POWER_MAP:
+    for state in (states.POWER_ON, states.POWER_OFF):
         if power_state == AMT_POWER_MAP[state]:
             return state
     return states.ERROR
 
 
+def _ensure_boot_device(task):
+    node = task.node
+    boot_device = node.driver_internal_info.get('amt_boot_device')
+    if boot_device and boot_device != amt_common.DEFAULT_BOOT_DEVICE:
+        task.driver.management.ensure_next_boot_device(node, boot_device)
+
+
 def _set_and_wait(task, target_state):
     """Helper function for DynamicLoopingCall.
 
@@ -162,44 +201,54 @@ def _set_and_wait(task, target_state):
     :raises: InvalidParameterValue
     """
     node = task.node
-    driver = task.driver
     if target_state not in (states.POWER_ON, states.POWER_OFF):
         raise ironic_exception.InvalidParameterValue(_(
             'Unsupported target_state: %s') % target_state)
     elif target_state == states.POWER_ON:
-        boot_device = node.driver_internal_info.get('amt_boot_device')
-        if boot_device and boot_device != amt_common.DEFAULT_BOOT_DEVICE:
-            driver.management.ensure_next_boot_device(node, boot_device)
+        _ensure_boot_device(task)
 
     def _wait(status):
         status['power'] = _power_status(node)
         if status['power'] == target_state:
             raise loopingcall.LoopingCallDone()
 
-        if status['iter'] >= CONF.amt_driver.max_attempts:
-            status['power'] = states.ERROR
-            LOG.warning(_LW("AMT failed to set power state %(state)s after "
-                            "%(tries)s retries on node %(node_id)s."),
-                        {'state': target_state, 'tries': status['iter'],
-                         'node_id': node.uuid})
-            raise loopingcall.LoopingCallDone()
-
-        try:
-            _set_power_state(node, target_state)
-        except Exception:
-            # Log failures but keep trying
-            LOG.warning(_LW("AMT set power state %(state)s for node %(node)s "
-                            "- Attempt %(attempt)s times of %(max_attempt)s "
-                            "failed."),
-                        {'state': target_state, 'node': node.uuid,
-                         'attempt': status['iter'] + 1,
-                         'max_attempt': CONF.amt_driver.max_attempts})
-        status['iter'] += 1
-
-    status = {'power': None, 'iter': 0}
-
-    timer = loopingcall.FixedIntervalLoopingCall(_wait, status)
-    timer.start(interval=CONF.amt_driver.action_wait).wait()
+        action_wait = CONF.amt_driver.action_wait
+        if time.time() >= status['retry_at']:
+            if status['iter'] >= CONF.amt_driver.max_attempts:
+                status['power'] = states.ERROR
+                LOG.warning(_LW("AMT failed to set power state %(state)s "
+                                "after %(tries)s retries on node "
+                                "%(node_id)s."),
+                            {'state': target_state, 'tries': status['iter'],
+                             'node_id': node.uuid})
+                raise loopingcall.LoopingCallDone()
+
+            try:
+                _set_power_state(node, target_state)
+            except Exception:
+                # Log failures but keep trying
+                LOG.warning(_LW("AMT set power state %(state)s for node "
+                                "%(node)s - Attempt %(attempt)s times of "
+                                "%(max_attempt)s failed."),
+                            {'state': target_state, 'node': node.uuid,
+                             'attempt': status['iter'] + 1,
+                             'max_attempt': CONF.amt_driver.max_attempts})
+            status['iter'] += 1
+            status['retry_at'] = time.time() + action_wait
+            status['interval'] = min(CONF.amt_driver.action_wait_min,
+                                     action_wait)
+        else:
+            status['interval'] = min(status['interval'] * 2, action_wait)
+
+        # Check again at the latest when the attempt times out
+        return max(0, min(status['interval'],
+                          status['retry_at'] - time.time()))
+
+    # Each attempt sets the power state, then checks it with an increasing
+    # interval, until action_wait has passed and the next attempt starts
+    status = {'power': None, 'iter': 0, 'retry_at': 0, 'interval': 0}
+    timer = loopingcall.DynamicLoopingCall(_wait, status)
+    timer.start().wait()
 
     if status['power'] != target_state:
         raise ironic_exception.PowerStateFailure(pstate=target_state)
@@ -207,6 +256,44 @@ def _set_and_wait(task, target_state):
     return status['power']
 
 
+def _wait_for_power_cycle(node):
+    """Wait for a node to be on again after a power cycle request.
+
+    The node is still on right after the request, so seeing it on only
+    proves the reboot once it was seen off. The power state is never set.
+
+    :param node: a node object.
+    :returns: True if the node was seen off and then on again, False if
+        it is not the case after max_attempts times action_wait.
+    :raises: AMTFailure.
+    :raises: AMTConnectFailure.
+    """
+    action_wait = CONF.amt_driver.action_wait
+    deadline = time.time() + action_wait * CONF.amt_driver.max_attempts
+
+    def _wait(status):
+        power = _power_status(node)
+        now = time.time()
+        if power == states.POWER_OFF:
+            status['seen_off'] = True
+        elif power == states.POWER_ON and status['seen_off']:
+            status['done'] = True
+            raise loopingcall.LoopingCallDone()
+        if now >= deadline:
+            raise loopingcall.LoopingCallDone()
+
+        interval = status['interval']
+        status['interval'] = min(interval * 2, action_wait)
+        return max(0, min(interval, deadline - now))
+
+    initial_delay = min(CONF.amt_driver.action_wait_min, action_wait)
+    status = {'seen_off': False, 'done': False,
+              'interval': min(initial_delay * 2, action_wait)}
+    timer = loopingcall.DynamicLoopingCall(_wait, status)
+    timer.start(initial_delay=initial_delay).wait()
+    return status['done']
+
+
 class AMTPower(base.PowerInterface):
     """AMT Power interface.
 
@@ -258,11 +345,35 @@ class AMTPower(base.PowerInterface):
     def reboot(self, task):
         """Cycle the power of the node
 
+        Depending on [amt_driver]reboot_method, either sends a single power
+        cycle request and waits for the node to be on again, or powers the
+        node off and then on.
+
         :param task: a TaskManager instance contains the target node.
         :raises: PowerStateFailure if failed to reboot.
         :raises: AMTFailure.
         :raises: AMTConnectFailure.
         :raises: InvalidParameterValue
         """
+        if CONF.amt_driver.reboot_method == 'power_cycle':
+            node = task.node
+            if _power_status(node) != states.POWER_ON:
+                _set_and_wait(task, states.POWER_ON)
+                return
+
+            _ensure_boot_device(task)
+            try:
+                _set_power_state(node, states.REBOOT)
+            except exception.AMTFailure:
+                LOG.warning(_LW("AMT power cycle of node %s failed, "
+                                "powering it off and on instead."),
+                            node.uuid)
+            else:
+                if _wait_for_power_cycle(node):
+                    return
+                LOG.warning(_LW("AMT node %s is not on after a power cycle, "
+                                "powering it off and on instead."),
+                            node.uuid)
+
         _set_and_wait(task, states.POWER_OFF)
         _set_and_wait(task, states.POWER_ON)
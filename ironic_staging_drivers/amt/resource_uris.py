@@ -33,3 +33,6 @@ CIM_BootSourceSetting = ('http://schemas.dmtf.org/wbem/wscim/'
 
 CIM_BootService = ('http://schemas.dmtf.org/wbem/wscim/'
                    '1/cim-schema/2/CIM_BootService')
+
+CIM_OrderedComponent = ('http://schemas.dmtf.org/wbem/wscim/'
+                        '1/cim-schema/2/CIM_OrderedComponent')
@@ -0,0 +1,255 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+In-process waking of AMT interfaces
+
+AMT interfaces go to sleep after a period of inactivity, and wake up on the
+first packet they receive. The interfaces are woken with ICMP echo requests
+when the conductor is allowed to open ICMP sockets, either raw sockets for
+privileged users or datagram sockets for the users of the
+net.ipv4.ping_group_range sysctl, and with TCP connections to the AMT port
+otherwise. Many interfaces are woken at once from a single select loop,
+and each one is done on its first answer.
+"""
+import collections
+import errno
+import itertools
+import os
+import select
+import socket
+import struct
+import time
+
+from oslo_log import log as logging
+import six
+
+LOG = logging.getLogger(__name__)
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+_ICMP_HEADER = struct.Struct('!BBHHH')
+_ECHO_PAYLOAD = b'ironic-amt-wake'
+
+# Number of echo requests sent to each interface, and interval between them
+ECHO_COUNT = 5
+ECHO_INTERVAL = 0.2
+# Time (in seconds) to wait for the interfaces to answer
+WAKE_TIMEOUT = 2.0
+# Maximum number of TCP connections opened at once
+MAX_CONNECTIONS = 256
+
+_CONNECT_PENDING = (errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK)
+# A refused connection means the interface answered
+_CONNECT_AWAKE = (0, errno.ECONNREFUSED)
+
+_idents = itertools.count(os.getpid())
+
+
+def _checksum(data):
+    """Compute the internet checksum of data."""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _echo_request(ident, seq):
+    """Build an ICMP echo request."""
+    header = _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = _checksum(header + _ECHO_PAYLOAD)
+    header = _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, ident, seq)
+    return header + _ECHO_PAYLOAD
+
+
+def _parse_echo_reply(data, raw):
+    """Get the identifier of an ICMP echo reply.
+
+    :param data: the received packet.
+    :param raw: whether the packet was received by a raw socket, and so
+        starts with the IP header.
+    :returns: the identifier of the reply, None if it is not an echo reply.
+    """
+    if raw:
+        if not data:
+            return None
+        data = data[(six.indexbytes(data, 0) & 0x0f) * 4:]
+    if len(data) < _ICMP_HEADER.size:
+        return None
+    icmp_type, code, checksum, ident, seq = _ICMP_HEADER.unpack(
+        data[:_ICMP_HEADER.size])
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return ident
+
+
+def _open_icmp_socket():
+    """Open a non-blocking ICMP socket.
+
+    :returns: a tuple with the socket, or None if the process is not allowed
+        to open ICMP sockets, and whether the socket is a raw one.
+    """
+    for sock_type in (socket.SOCK_RAW, socket.SOCK_DGRAM):
+        try:
+            sock = socket.socket(socket.AF_INET, sock_type,
+                                 socket.IPPROTO_ICMP)
+        except socket.error:
+            continue
+        sock.setblocking(False)
+        return sock, sock_type == socket.SOCK_RAW
+    return None, False
+
+
+def _icmp_wake(sock, raw, addresses, deadline):
+    """Wake interfaces with ICMP echo requests.
+
+    :param sock: an ICMP socket.
+    :param raw: whether the socket is a raw one.
+    :param addresses: a set of IP addresses.
+    :param deadline: the time to give up waiting for answers.
+    :returns: the set of the addresses which answered.
+    """
+    # Datagram ICMP sockets get the identifier set by the kernel, and only
+    # receive the replies to their own requests
+    ident = next(_idents) & 0xffff
+    pending = set(addresses)
+    awake = set()
+    sent = 0
+    next_send = 0
+    while pending:
+        now = time.time()
+        if now >= deadline:
+            break
+        if sent < ECHO_COUNT and now >= next_send:
+            packet = _echo_request(ident, sent)
+            for address in pending:
+                try:
+                    sock.sendto(packet, (address, 0))
+                except socket.error as e:
+                    LOG.debug('Failed to send echo request to %(address)s: '
+                              '%(err)s', {'address': address, 'err': e})
+            sent += 1
+            next_send = now + ECHO_INTERVAL
+        timeout = (min(next_send, deadline) if sent < ECHO_COUNT
+                   else deadline) - now
+        readable = select.select([sock], [], [], max(timeout, 0))[0]
+        while readable:
+            try:
+                data, (address, _port) = sock.recvfrom(1024)
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    LOG.debug('Failed to receive echo reply: %s', e)
+                break
+            reply_ident = _parse_echo_reply(data, raw)
+            if reply_ident is None or address not in pending:
+                continue
+            if not raw or reply_ident == ident:
+                pending.discard(address)
+                awake.add(address)
+    return awake
+
+
+def _tcp_wake(targets, timeout):
+    """Wake interfaces by connecting to their AMT port.
+
+    At most MAX_CONNECTIONS connections are in progress at once, the next
+    target is connected to as soon as one of them is done. Each connection
+    is given the whole timeout, counted from its opening.
+
+    :param targets: a list of (IP address, port) tuples.
+    :param timeout: time (in seconds) to wait for each interface to answer.
+    :returns: the set of the addresses which answered.
+    """
+    awake = set()
+    waiting = collections.deque(targets)
+    # socket -> (IP address, deadline)
+    connecting = {}
+    try:
+        while waiting or connecting:
+            while waiting and len(connecting) < MAX_CONNECTIONS:
+                address, port = waiting.popleft()
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                err = sock.connect_ex((address, port))
+                if err in _CONNECT_PENDING:
+                    connecting[sock] = (address, time.time() + timeout)
+                    continue
+                if err in _CONNECT_AWAKE:
+                    awake.add(address)
+                sock.close()
+
+            now = time.time()
+            for sock, (address, deadline) in list(connecting.items()):
+                if deadline <= now:
+                    del connecting[sock]
+                    sock.close()
+            if not connecting:
+                continue
+
+            wait = min(deadline for address, deadline
+                       in connecting.values()) - now
+            writable = select.select([], list(connecting), [], wait)[1]
+            for sock in writable:
+                address = connecting.pop(sock)[0]
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err in _CONNECT_AWAKE:
+                    awake.add(address)
+                sock.close()
+    finally:
+        for sock in connecting:
+            sock.close()
+    return awake
+
+
+def _resolve(address):
+    try:
+        return socket.gethostbyname(address)
+    except socket.error as e:
+        LOG.debug('Failed to resolve %(address)s: %(err)s',
+                  {'address': address, 'err': e})
+        return None
+
+
+def wake_interfaces(targets, timeout=WAKE_TIMEOUT):
+    """Wake AMT interfaces.
+
+    :param targets: a dict mapping the addresses (IP addresses or host
+        names) of the interfaces to wake to their AMT port, used when ICMP
+        sockets are not available.
+    :param timeout: time (in seconds) to wait for the interfaces to answer.
+    :returns: the set of the addresses which answered.
+    """
+    start = time.time()
+    # IP address -> addresses resolving to it
+    addresses = {}
+    ports = {}
+    for address, port in targets.items():
+        ip = _resolve(address)
+        if ip is not None:
+            addresses.setdefault(ip, []).append(address)
+            ports[ip] = port
+    if not addresses:
+        return set()
+
+    sock, raw = _open_icmp_socket()
+    if sock is not None:
+        try:
+            awake_ips = _icmp_wake(sock, raw, set(addresses),
+                                   start + timeout)
+        finally:
+            sock.close()
+    else:
+        awake_ips = _tcp_wake(list(ports.items()), timeout)
+
+    return set(address for ip in awake_ips for address in addresses[ip])
@@ -31,6 +31,11 @@ class AMTFailure(exception.IronicException):
     _msg_fmt = _("AMT call failed: %(cmd)s.")
 
 
+class AMTTimeout(exception.IronicException):
+    _msg_fmt = _("AMT call to node %(node)s timed out after %(timeout)s "
+                 "seconds.")
+
+
 class LibvirtError(exception.IronicException):
     message = _("Libvirt call failed: %(err)s.")
 
@@ -13,10 +13,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import hashlib
+import json
+import threading
+
 from ironic.common import exception as ironic_exception
+import six
 
 from ironic_staging_drivers.common.i18n import _
 
+# Maximum number of nodes whose parsed driver_info is kept by each parser
+DRIVER_INFO_CACHE_SIZE = 1024
+
 
 def validate_network_port(port, port_name="Port"):
     """Validates the given port.
@@ -38,3 +47,54 @@ def validate_network_port(port, port_name="Port"):
             'numbers must be between 1 and 65535.') %
             {'port_name': port_name, 'port': port})
     return port
+
+
+def _driver_info_digest(driver_info, defaults=None):
+    data = json.dumps([driver_info or {}, defaults], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def cache_driver_info(size=DRIVER_INFO_CACHE_SIZE, defaults=None):
+    """Memoize a driver_info parser by node and driver_info revision.
+
+    The decorated function takes a node and returns a dict. Its result is
+    kept per node UUID along with a hash of the node driver_info, and
+    reused until the driver_info changes, so that the validation and the
+    I/O done by the parser are not repeated by every operation. Each call
+    gets its own copy of the result. Exceptions are not cached. At most
+    size nodes are kept, the least recently used ones being evicted first.
+    The cache of a decorated function is emptied by its cache_clear
+    attribute.
+
+    :param size: the maximum number of nodes kept.
+    :param defaults: a function returning the configuration values used by
+        the parser when they are missing from the driver_info, as a JSON
+        serializable object. A result is only reused while they are the
+        same.
+    """
+    def decorator(parser):
+        # node uuid -> (driver_info digest, parsed info), least recently
+        # used first
+        cache = collections.OrderedDict()
+        lock = threading.Lock()
+
+        @six.wraps(parser)
+        def wrapper(node):
+            digest = _driver_info_digest(
+                node.driver_info, defaults() if defaults else None)
+            with lock:
+                entry = cache.pop(node.uuid, None)
+                if entry is not None and entry[0] == digest:
+                    cache[node.uuid] = entry
+                    return dict(entry[1])
+            info = parser(node)
+            with lock:
+                cache.pop(node.uuid, None)
+                cache[node.uuid] = (digest, dict(info))
+                while len(cache) > size:
+                    cache.popitem(last=False)
+            return info
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
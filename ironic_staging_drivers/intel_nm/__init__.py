@@ -16,7 +16,6 @@ from ironic.drivers.modules import fake
 from ironic.drivers.modules import inspector
 from ironic.drivers.modules import ipmitool
 from ironic.drivers.modules import pxe
-from ironic.drivers import utils
 
 from ironic_staging_drivers.intel_nm import nm_vendor
 
@@ -54,9 +53,11 @@ class AgentAndIPMIToolIntelNMDriver(base.BaseDriver):
                         'get_nm_capabilities': self.nm_vendor,
                         'get_nm_version': self.nm_vendor,
                         'get_nm_statistics': self.nm_vendor,
-                        'reset_nm_statistics': self.nm_vendor}
+                        'get_nm_statistics_bulk': self.nm_vendor,
+                        'reset_nm_statistics': self.nm_vendor,
+                        'get_nm_telemetry': self.nm_vendor}
         self.driver_passthru_mapping = {'lookup': self.agent_vendor}
-        self.vendor = utils.MixinVendorInterface(
+        self.vendor = nm_vendor.IntelNMMixinVendorInterface(
             self.mapping,
             driver_passthru_mapping=self.driver_passthru_mapping)
         self.raid = agent.AgentRAID()
@@ -0,0 +1,665 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+In-process IPMI v2.0 (RMCP+) LAN transport for Intel Node Manager commands
+
+Raw commands are sent over RMCP+ sessions kept per BMC, bridged to the
+Node Manager with the "Send Message" command, and their response data is
+returned as bytes, without running ipmitool. The sessions are authenticated
+with RAKP-HMAC-SHA1, their messages are checked with HMAC-SHA1-96 (cipher
+suites 2 and 3) and encrypted with AES-CBC-128 (cipher suite 3, which needs
+the cryptography library).
+"""
+import functools
+import hashlib
+import hmac
+import os
+import socket
+import struct
+import threading
+import time
+
+from ironic.common import exception
+from ironic.drivers.modules import ipmitool
+from oslo_config import cfg
+from oslo_log import log
+from oslo_utils import importutils
+
+from ironic_staging_drivers.common.i18n import _
+from ironic_staging_drivers.common.i18n import _LE
+from ironic_staging_drivers.common.i18n import _LW
+
+ciphers = importutils.try_import('cryptography.hazmat.primitives.ciphers')
+backends = importutils.try_import('cryptography.hazmat.backends')
+
+opts = [
+    cfg.IntOpt('lan_cipher_suite',
+               default=3,
+               min=1,
+               max=3,
+               help=_('IPMI cipher suite of the sessions opened when '
+                      'transport is "lan": 1 for authentication only, 2 to '
+                      'also check the integrity of the messages, 3 to also '
+                      'encrypt them. Cipher suite 3 needs the cryptography '
+                      'library.')),
+    cfg.FloatOpt('lan_timeout',
+                 default=1.0,
+                 min=0.1,
+                 help=_('Time (in seconds) to wait for the answer of the BMC '
+                        'to a message, before sending it again. Used when '
+                        'transport is "lan".')),
+    cfg.IntOpt('lan_retries',
+               default=3,
+               min=0,
+               help=_('Number of times a message is sent again to the BMC '
+                      'when it is not answered. Used when transport is '
+                      '"lan".')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='intel_nm_driver')
+
+LOG = log.getLogger(__name__)
+
+RMCP_HEADER = b'\x06\x00\xff\x07'
+AUTH_TYPE_RMCPP = 0x06
+DEFAULT_PORT = 623
+
+PAYLOAD_IPMI = 0x00
+PAYLOAD_OPEN_SESSION_REQUEST = 0x10
+PAYLOAD_OPEN_SESSION_RESPONSE = 0x11
+PAYLOAD_RAKP1 = 0x12
+PAYLOAD_RAKP2 = 0x13
+PAYLOAD_RAKP3 = 0x14
+PAYLOAD_RAKP4 = 0x15
+PAYLOAD_AUTHENTICATED = 0x40
+PAYLOAD_ENCRYPTED = 0x80
+
+BMC_ADDRESS = 0x20
+CONSOLE_ADDRESS = 0x81
+NETFN_APP = 0x06
+NETFN_STORAGE = 0x0A
+CMD_SEND_MESSAGE = 0x34
+CMD_SET_SESSION_PRIVILEGE = 0x3B
+CMD_CLOSE_SESSION = 0x3C
+CMD_RESERVE_SDR_REPOSITORY = 0x22
+CMD_GET_SDR = 0x23
+# Send Message channel flag asking the BMC to route the response back
+TRACK_REQUEST = 0x40
+
+PRIVILEGE_LEVELS = {
+    'CALLBACK': 0x01,
+    'USER': 0x02,
+    'OPERATOR': 0x03,
+    'ADMINISTRATOR': 0x04,
+    'OEM': 0x05,
+}
+# Look the user up by name and privilege level
+_NAME_ONLY_LOOKUP = 0x10
+
+# Cipher suite -> (authentication, integrity, confidentiality) algorithms
+CIPHER_SUITES = {
+    1: (0x01, 0x00, 0x00),  # RAKP-HMAC-SHA1, none, none
+    2: (0x01, 0x01, 0x00),  # RAKP-HMAC-SHA1, HMAC-SHA1-96, none
+    3: (0x01, 0x01, 0x01),  # RAKP-HMAC-SHA1, HMAC-SHA1-96, AES-CBC-128
+}
+
+_SESSION_HEADER = struct.Struct('<BBIIH')
+_INTEGRITY_LENGTH = 12
+_AES_BLOCK = 16
+# BMCs usually close the sessions after 60 seconds of inactivity
+SESSION_IDLE_TIMEOUT = 30
+
+SDR_HEADER_SIZE = 5
+LAST_SDR_RECORD = 0xFFFF
+# Bytes of an SDR record read at once, small enough for all the BMCs
+_SDR_CHUNK = 16
+
+
+class _ProtocolError(Exception):
+    """A malformed or unexpected message, or a timeout."""
+
+
+def _checksum(data):
+    return -sum(bytearray(data)) & 0xff
+
+
+def _hmac(key, data, length=None):
+    digest = hmac.new(key, data, hashlib.sha1).digest()
+    return digest[:length] if length else digest
+
+
+def _aes_cbc(key, iv, data, encrypt):
+    cipher = ciphers.Cipher(ciphers.algorithms.AES(key), ciphers.modes.CBC(iv),
+                            backend=backends.default_backend())
+    context = cipher.encryptor() if encrypt else cipher.decryptor()
+    return context.update(data) + context.finalize()
+
+
+def build_ipmi_message(rs_addr, netfn, rq_addr, seq, cmd, data=b''):
+    """Build an IPMI request message.
+
+    :param rs_addr: the responder slave address.
+    :param netfn: the network function.
+    :param rq_addr: the requester address.
+    :param seq: the request sequence number.
+    :param cmd: the command.
+    :param data: the request data, as bytes.
+    :returns: the message, as bytes.
+    """
+    header = bytearray([rs_addr, netfn << 2])
+    header.append(_checksum(header))
+    body = bytearray([rq_addr, (seq & 0x3f) << 2, cmd]) + bytearray(data)
+    body.append(_checksum(body))
+    return bytes(header + body)
+
+
+def parse_ipmi_response(message):
+    """Parse an IPMI response message.
+
+    :param message: the message, as bytes.
+    :returns: a tuple with the network function, the sequence number, the
+        command, and the completion code followed by the response data, as a
+        bytearray.
+    :raises: _ProtocolError if the message is malformed.
+    """
+    message = bytearray(message)
+    if len(message) < 7:
+        raise _ProtocolError(_('malformed IPMI message'))
+    if (_checksum(message[:2]), _checksum(message[3:-1])) != (message[2],
+                                                              message[-1]):
+        raise _ProtocolError(_('malformed IPMI message'))
+    return message[1] >> 2, message[4] >> 2, message[5], message[6:-1]
+
+
+class LanSession(object):
+    """An RMCP+ session with a BMC."""
+
+    def __init__(self, address, port, username, password, priv_level,
+                 cipher_suite):
+        self._address = (address, port)
+        self._username = (username or '').encode('utf-8')
+        # The key is the password padded to 20 bytes
+        self._kuid = (password or '').encode('utf-8')[:20].ljust(20, b'\0')
+        self._priv_level = PRIVILEGE_LEVELS[priv_level]
+        self._algorithms = CIPHER_SUITES[cipher_suite]
+        self._sock = None
+        self._console_id = 0
+        self._bmc_id = 0
+        self._session_seq = 0
+        self._rq_seq = 0
+        self._k1 = None
+        self._k2 = None
+        self.lock = threading.Lock()
+        self.last_used = 0
+
+    @property
+    def active(self):
+        return self._sock is not None
+
+    # Packets
+
+    def _pack(self, payload_type, payload):
+        if not self._bmc_id:
+            header = _SESSION_HEADER.pack(AUTH_TYPE_RMCPP, payload_type, 0, 0,
+                                          len(payload))
+            return RMCP_HEADER + header + payload
+        auth, integrity, confidentiality = self._algorithms
+        if confidentiality:
+            payload_type |= PAYLOAD_ENCRYPTED
+            pad_length = (-len(payload) - 1) % _AES_BLOCK
+            pad = bytearray(range(1, pad_length + 1))
+            pad.append(pad_length)
+            iv = os.urandom(_AES_BLOCK)
+            payload = iv + _aes_cbc(self._k2[:_AES_BLOCK], iv,
+                                    payload + bytes(pad), True)
+        if integrity:
+            payload_type |= PAYLOAD_AUTHENTICATED
+        self._session_seq = (self._session_seq % 0xffffffff) + 1
+        data = _SESSION_HEADER.pack(AUTH_TYPE_RMCPP, payload_type,
+                                    self._bmc_id, self._session_seq,
+                                    len(payload)) + payload
+        if integrity:
+            pad_length = (-len(data) - 2) % 4
+            data += b'\xff' * pad_length + struct.pack('BB', pad_length, 0x07)
+            data += _hmac(self._k1, data, _INTEGRITY_LENGTH)
+        return RMCP_HEADER + data
+
+    def _unpack(self, packet):
+        data = packet[len(RMCP_HEADER):]
+        if packet[:len(RMCP_HEADER)] != RMCP_HEADER:
+            raise _ProtocolError(_('not an RMCP+ packet'))
+        if len(data) < _SESSION_HEADER.size:
+            raise _ProtocolError(_('truncated packet'))
+        auth_type, payload_type, session_id, seq, length = (
+            _SESSION_HEADER.unpack(data[:_SESSION_HEADER.size]))
+        if auth_type != AUTH_TYPE_RMCPP:
+            raise _ProtocolError(_('not an RMCP+ packet'))
+        payload = data[_SESSION_HEADER.size:_SESSION_HEADER.size + length]
+        if len(payload) != length:
+            raise _ProtocolError(_('truncated packet'))
+        if payload_type & PAYLOAD_AUTHENTICATED:
+            if self._k1 is None:
+                raise _ProtocolError(_('unexpected authenticated packet'))
+            signed = data[:-_INTEGRITY_LENGTH]
+            expected = _hmac(self._k1, signed, _INTEGRITY_LENGTH)
+            if not hmac.compare_digest(expected, data[-_INTEGRITY_LENGTH:]):
+                raise _ProtocolError(_('integrity check failed'))
+        elif self._bmc_id and self._algorithms[1] and session_id:
+            raise _ProtocolError(_('unauthenticated packet'))
+        if session_id and session_id != self._console_id:
+            raise _ProtocolError(_('packet of another session'))
+        if payload_type & PAYLOAD_ENCRYPTED:
+            if self._k2 is None or len(payload) < 2 * _AES_BLOCK:
+                raise _ProtocolError(_('unexpected encrypted packet'))
+            payload = _aes_cbc(self._k2[:_AES_BLOCK], payload[:_AES_BLOCK],
+                               payload[_AES_BLOCK:], False)
+            pad_length = bytearray(payload[-1:])[0]
+            payload = payload[:-pad_length - 1]
+        return payload_type & 0x3f, payload
+
+    def _receive(self, payload_type, match, deadline):
+        while True:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                return None
+            self._sock.settimeout(timeout)
+            try:
+                packet = self._sock.recv(1024)
+            except socket.timeout:
+                return None
+            try:
+                received_type, payload = self._unpack(packet)
+                if received_type == payload_type and match(payload):
+                    return payload
+            except _ProtocolError as e:
+                LOG.debug('Ignoring packet from BMC %(address)s: %(err)s',
+                          {'address': self._address[0], 'err': e})
+
+    def _exchange(self, payload_type, payload, response_type, match):
+        """Send a message and wait for its answer, retrying on timeout."""
+        packet = self._pack(payload_type, payload)
+        for attempt in range(CONF.intel_nm_driver.lan_retries + 1):
+            self._sock.sendto(packet, self._address)
+            response = self._receive(
+                response_type, match,
+                time.time() + CONF.intel_nm_driver.lan_timeout)
+            if response is not None:
+                return response
+        raise _ProtocolError(_('no answer from the BMC'))
+
+    # Session establishment
+
+    def _open_session(self):
+        auth, integrity, confidentiality = self._algorithms
+        tag = os.urandom(1)
+        request = b''.join([tag, b'\x00\x00\x00',
+                            struct.pack('<I', self._console_id),
+                            struct.pack('<BxxBBxxx', 0x00, 8, auth),
+                            struct.pack('<BxxBBxxx', 0x01, 8, integrity),
+                            struct.pack('<BxxBBxxx', 0x02, 8,
+                                        confidentiality)])
+        response = self._exchange(PAYLOAD_OPEN_SESSION_REQUEST, request,
+                                  PAYLOAD_OPEN_SESSION_RESPONSE,
+                                  lambda r: r[:1] == tag)
+        status = bytearray(response[1:2])[0]
+        if status:
+            raise _ProtocolError(_('session refused with status 0x%02x') %
+                                 status)
+        console_id, bmc_id = struct.unpack('<II', response[4:12])
+        if console_id != self._console_id:
+            raise _ProtocolError(_('wrong remote console session ID'))
+        return bmc_id
+
+    def _rakp(self, bmc_id):
+        role = self._priv_level | _NAME_ONLY_LOOKUP
+        user = struct.pack('BB', role, len(self._username)) + self._username
+        console_id = struct.pack('<I', self._console_id)
+        bmc_id_bytes = struct.pack('<I', bmc_id)
+
+        tag = os.urandom(1)
+        console_random = os.urandom(16)
+        request = b''.join([tag, b'\x00\x00\x00', bmc_id_bytes,
+                            console_random, struct.pack('Bxx', role),
+                            user[1:]])
+        response = self._exchange(PAYLOAD_RAKP1, request, PAYLOAD_RAKP2,
+                                  lambda r: r[:1] == tag)
+        status = bytearray(response[1:2])[0]
+        if status:
+            raise _ProtocolError(_('RAKP refused with status 0x%02x') % status)
+        bmc_random = response[8:24]
+        bmc_guid = response[24:40]
+        expected = _hmac(self._kuid, b''.join([console_id, bmc_id_bytes,
+                                               console_random, bmc_random,
+                                               bmc_guid, user]))
+        if not hmac.compare_digest(expected, response[40:60]):
+            raise _ProtocolError(_('wrong BMC key exchange code, check the '
+                                   'credentials'))
+
+        sik = _hmac(self._kuid, console_random + bmc_random + user)
+        tag = os.urandom(1)
+        request = b''.join([tag, b'\x00\x00\x00', bmc_id_bytes,
+                            _hmac(self._kuid, bmc_random + console_id + user)])
+        response = self._exchange(PAYLOAD_RAKP3, request, PAYLOAD_RAKP4,
+                                  lambda r: r[:1] == tag)
+        status = bytearray(response[1:2])[0]
+        if status:
+            raise _ProtocolError(_('RAKP refused with status 0x%02x') % status)
+        expected = _hmac(sik, console_random + bmc_id_bytes + bmc_guid,
+                         _INTEGRITY_LENGTH)
+        if not hmac.compare_digest(expected, response[8:20]):
+            raise _ProtocolError(_('wrong BMC integrity check value'))
+        self._k1 = _hmac(sik, b'\x01' * 20)
+        self._k2 = _hmac(sik, b'\x02' * 20)
+        self._bmc_id = bmc_id
+
+    def open(self):
+        """Open the session.
+
+        :raises: IPMIFailure if the session can't be established.
+        """
+        if self._algorithms[2] and ciphers is None:
+            LOG.error(_LE('IPMI cipher suite 3 requires the cryptography '
+                          'library, which is not installed.'))
+            raise exception.IPMIFailure(cmd=_('open session'))
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._console_id = struct.unpack('<I', os.urandom(4))[0] | 1
+        self._bmc_id = 0
+        self._session_seq = 0
+        self._k1 = self._k2 = None
+        try:
+            self._rakp(self._open_session())
+            content = self._request(NETFN_APP, CMD_SET_SESSION_PRIVILEGE,
+                                    struct.pack('B', self._priv_level))
+            if content[0]:
+                raise _ProtocolError(_('privilege level refused with '
+                                       'completion code 0x%02x') % content[0])
+        except (_ProtocolError, socket.error) as e:
+            LOG.warning(_LW('Failed to open an IPMI session with BMC '
+                            '%(address)s: %(err)s'),
+                        {'address': self._address[0], 'err': e})
+            self.close()
+            raise exception.IPMIFailure(cmd=_('open session'))
+        self.last_used = time.time()
+
+    def close(self):
+        """Close the session, without waiting for the BMC answer."""
+        if self._sock is None:
+            return
+        try:
+            if self._bmc_id:
+                self._rq_seq = (self._rq_seq + 1) % 64
+                message = build_ipmi_message(
+                    BMC_ADDRESS, NETFN_APP, CONSOLE_ADDRESS, self._rq_seq,
+                    CMD_CLOSE_SESSION, struct.pack('<I', self._bmc_id))
+                self._sock.sendto(self._pack(PAYLOAD_IPMI, message),
+                                  self._address)
+        except socket.error:
+            pass
+        finally:
+            self._sock.close()
+            self._sock = None
+            self._bmc_id = 0
+
+    # Requests
+
+    def _request(self, netfn, cmd, data):
+        """Send a request to the BMC.
+
+        :returns: the completion code followed by the response data.
+        """
+        self._rq_seq = seq = (self._rq_seq + 1) % 64
+        message = build_ipmi_message(BMC_ADDRESS, netfn, CONSOLE_ADDRESS,
+                                     seq, cmd, data)
+
+        def _match(payload):
+            try:
+                r_netfn, r_seq, r_cmd, content = parse_ipmi_response(payload)
+            except _ProtocolError:
+                return False
+            return r_netfn == netfn + 1 and r_seq == seq and r_cmd == cmd
+
+        response = self._exchange(PAYLOAD_IPMI, message, PAYLOAD_IPMI,
+                                  _match)
+        return parse_ipmi_response(response)[3]
+
+    def _find_embedded(self, content, seq, cmd):
+        # The bridged response follows the completion code of the Send
+        # Message command, or comes alone, depending on the BMCs
+        for offset in (0, 1):
+            try:
+                r_netfn, r_seq, r_cmd, r_content = parse_ipmi_response(
+                    content[offset:])
+            except _ProtocolError:
+                continue
+            if r_seq == seq and r_cmd == cmd:
+                return r_content
+        return None
+
+    def _bridged_request(self, channel, target, requester, netfn, cmd, data):
+        self._rq_seq = seq = (self._rq_seq + 1) % 64
+        inner = build_ipmi_message(target, netfn, requester, seq, cmd, data)
+        content = self._request(
+            NETFN_APP, CMD_SEND_MESSAGE,
+            struct.pack('B', channel | TRACK_REQUEST) + inner)
+        if content[0]:
+            return content
+        embedded = self._find_embedded(content[1:], seq, cmd)
+        if embedded is not None:
+            return embedded
+
+        # Only the Send Message command was acknowledged, the response of
+        # the target comes in another message
+        found = []
+
+        def _match(payload):
+            try:
+                r_netfn, r_seq, r_cmd, r_content = parse_ipmi_response(
+                    payload)
+            except _ProtocolError:
+                return False
+            if r_cmd != CMD_SEND_MESSAGE:
+                return False
+            embedded = self._find_embedded(r_content, seq, cmd)
+            found.append(embedded)
+            return embedded is not None
+
+        timeout = CONF.intel_nm_driver.lan_timeout * (
+            CONF.intel_nm_driver.lan_retries + 1)
+        response = self._receive(PAYLOAD_IPMI, _match, time.time() + timeout)
+        if response is None:
+            raise _ProtocolError(_('no bridged response'))
+        return found[-1]
+
+    def raw(self, netfn, cmd, data, channel=None, target=None,
+            requester=BMC_ADDRESS):
+        """Send a raw request.
+
+        :param netfn: the network function.
+        :param cmd: the command.
+        :param data: the request data, as bytes.
+        :param channel: the channel of the target, for a bridged request.
+        :param target: the slave address of the target, for a bridged
+            request.
+        :param requester: the requester address of a bridged request.
+        :returns: the response data, without the completion code, as bytes.
+        :raises: IPMIFailure on an error.
+        """
+        try:
+            if target is None:
+                content = self._request(netfn, cmd, data)
+            else:
+                content = self._bridged_request(channel, target, requester,
+                                                netfn, cmd, data)
+        except (_ProtocolError, socket.error) as e:
+            LOG.warning(_LW('IPMI request to BMC %(address)s failed: '
+                            '%(err)s'),
+                        {'address': self._address[0], 'err': e})
+            raise exception.IPMIFailure(cmd='raw 0x%02x 0x%02x' %
+                                        (netfn, cmd))
+        self.last_used = time.time()
+        if content[0]:
+            LOG.warning(_LW('IPMI request 0x%(netfn)02x 0x%(cmd)02x to BMC '
+                            '%(address)s failed with completion code '
+                            '0x%(code)02x'),
+                        {'netfn': netfn, 'cmd': cmd, 'code': content[0],
+                         'address': self._address[0]})
+            raise exception.IPMIFailure(cmd='raw 0x%02x 0x%02x' %
+                                        (netfn, cmd))
+        return bytes(content[1:])
+
+
+class _LanSessionPool(object):
+    """RMCP+ sessions, one per BMC and credentials."""
+
+    def __init__(self):
+        # (address, port, username, password digest, privilege level) ->
+        # LanSession
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _get(self, driver_info):
+        password = driver_info['password'] or ''
+        port = int(driver_info['dest_port'] or DEFAULT_PORT)
+        key = (driver_info['address'], port, driver_info['username'],
+               hashlib.sha256(password.encode('utf-8')).hexdigest(),
+               driver_info['priv_level'])
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = LanSession(
+                    driver_info['address'], port, driver_info['username'],
+                    password, driver_info['priv_level'],
+                    CONF.intel_nm_driver.lan_cipher_suite)
+        return session
+
+    def execute(self, driver_info, netfn, cmd, data):
+        """Send a raw request to a BMC, bridged to its target if any.
+
+        :param driver_info: the IPMI driver info, as returned by
+            ipmitool._parse_driver_info().
+        :param netfn: the network function.
+        :param cmd: the command.
+        :param data: the request data, as bytes.
+        :returns: the response data, as bytes.
+        :raises: IPMIFailure on an error.
+        """
+        session = self._get(driver_info)
+        bridged = {}
+        if driver_info['target_address'] is not None:
+            bridged['channel'] = int(driver_info['target_channel'], 0)
+            bridged['target'] = int(driver_info['target_address'], 0)
+            if driver_info['local_address'] is not None:
+                bridged['requester'] = int(driver_info['local_address'], 0)
+        with session.lock:
+            idle = time.time() - session.last_used
+            if session.active and idle > SESSION_IDLE_TIMEOUT:
+                session.close()
+            if not session.active:
+                session.open()
+            try:
+                return session.raw(netfn, cmd, data, **bridged)
+            except exception.IPMIFailure:
+                session.close()
+                raise
+
+    def close(self):
+        """Close all the sessions."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+
+_SESSIONS = _LanSessionPool()
+
+
+def send_raw(task, raw_bytes):
+    """Send a raw command to the node BMC over an RMCP+ session.
+
+    :param task: a TaskManager instance.
+    :param raw_bytes: the network function, command and request data, as a
+        string of hexadecimal bytes.
+    :returns: the response data, as bytes.
+    :raises: IPMIFailure on an error.
+    """
+    driver_info = ipmitool._parse_driver_info(task.node)
+    values = bytearray(int(value, 16) for value in raw_bytes.split())
+    LOG.debug('Sending node %(node)s raw bytes %(bytes)s over RMCP+',
+              {'node': task.node.uuid, 'bytes': raw_bytes})
+    return _SESSIONS.execute(driver_info, values[0], values[1],
+                             bytes(values[2:]))
+
+
+def _get_sdr(execute, reservation, record_id, offset, length):
+    request = struct.pack('<HHBB', reservation, record_id, offset, length)
+    response = execute(NETFN_STORAGE, CMD_GET_SDR, request)
+    if len(response) < 2 + length:
+        LOG.warning(_LW('Truncated SDR record %(record)s received from BMC'),
+                    {'record': record_id})
+        raise exception.IPMIFailure(cmd='Get SDR')
+    return struct.unpack('<H', response[:2])[0], response[2:2 + length]
+
+
+def _read_sdr_record(execute, reservation, record_id):
+    next_id, header = _get_sdr(execute, reservation, record_id, 0,
+                               SDR_HEADER_SIZE)
+    end = SDR_HEADER_SIZE + bytearray(header)[-1]
+    chunks = [header]
+    offset = SDR_HEADER_SIZE
+    while offset < end:
+        length = min(_SDR_CHUNK, end - offset)
+        chunks.append(_get_sdr(execute, reservation, record_id, offset,
+                               length)[1])
+        offset += length
+    return next_id, b''.join(chunks)
+
+
+def _reserve_sdr(execute):
+    response = execute(NETFN_STORAGE, CMD_RESERVE_SDR_REPOSITORY, b'')
+    return struct.unpack('<H', response[:2])[0]
+
+
+def iter_sdr(task):
+    """Read the SDR repository of the node BMC over an RMCP+ session.
+
+    The records are read one at a time, so that the caller can stop at the
+    one it looks for.
+
+    :param task: a TaskManager instance.
+    :returns: an iterator over the SDR records, each one as bytes with its
+        header, in the format of "ipmitool sdr dump".
+    :raises: IPMIFailure on an error.
+    """
+    driver_info = ipmitool._parse_driver_info(task.node)
+    # The SDR repository is read from the BMC itself
+    for name, option in ipmitool.BRIDGING_OPTIONS:
+        driver_info[name] = None
+    execute = functools.partial(_SESSIONS.execute, driver_info)
+    LOG.debug('Reading the SDR repository of node %s over RMCP+',
+              task.node.uuid)
+    reservation = _reserve_sdr(execute)
+    record_id = 0
+    while record_id != LAST_SDR_RECORD:
+        try:
+            next_id, record = _read_sdr_record(execute, reservation,
+                                               record_id)
+        except exception.IPMIFailure:
+            # The reservation is cancelled when the SDR repository changes,
+            # try again once with a new one
+            reservation = _reserve_sdr(execute)
+            next_id, record = _read_sdr_record(execute, reservation,
+                                               record_id)
+        yield record
+        record_id = next_id
@@ -0,0 +1,299 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Persistent ipmitool shell sessions for Intel Node Manager raw commands
+
+Instead of forking ipmitool and establishing a new IPMI session for every
+raw command, a long-lived "ipmitool shell" process is kept per BMC and
+target address. Each raw command is followed by an "echo" of a unique
+marker, so that the end of its output can be found. A session is closed
+after any error, and when it was not used for
+[intel_nm_driver]shell_idle_timeout seconds. A command failing in a reused
+session is sent again once in a new session, as the BMC may have closed
+the previous one.
+"""
+import hashlib
+import itertools
+import os
+import re
+import threading
+import time
+
+import eventlet
+from eventlet.green import subprocess
+from ironic.common import exception
+from ironic.drivers.modules import ipmitool
+from oslo_config import cfg
+from oslo_log import log
+
+from ironic_staging_drivers.common.i18n import _
+from ironic_staging_drivers.common.i18n import _LW
+
+opts = [
+    cfg.IntOpt('shell_idle_timeout',
+               default=30,
+               min=1,
+               help=_('Time (in seconds) after which an unused ipmitool '
+                      'shell session is closed. It should be lower than the '
+                      'session timeout of the BMCs, usually 60 seconds. '
+                      'Used when transport is "shell".')),
+    cfg.IntOpt('shell_command_timeout',
+               default=30,
+               min=1,
+               help=_('Time (in seconds) to wait for the output of a raw '
+                      'command sent to an ipmitool shell session, before '
+                      'closing the session. Used when transport is '
+                      '"shell".')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='intel_nm_driver')
+
+LOG = log.getLogger(__name__)
+
+_PROMPT = 'ipmitool> '
+# Output lines of a successful raw command
+_HEX_LINE = re.compile(r'^([0-9a-fA-F]{2}\s*)+$')
+
+_markers = itertools.count()
+
+
+def _shell_args(driver_info):
+    """Build the ipmitool arguments for a shell session.
+
+    :param driver_info: the IPMI driver info, as returned by
+        ipmitool._parse_driver_info().
+    :returns: a list of arguments. The password is passed in the
+        IPMI_PASSWORD environment variable.
+    """
+    interface = ('lanplus' if driver_info['protocol_version'] == '2.0'
+                 else 'lan')
+    args = ['ipmitool', '-I', interface, '-H', driver_info['address'],
+            '-L', driver_info['priv_level']]
+    if driver_info['dest_port']:
+        args.extend(['-p', str(driver_info['dest_port'])])
+    if driver_info['username']:
+        args.extend(['-U', driver_info['username']])
+    for name, option in ipmitool.BRIDGING_OPTIONS:
+        if driver_info[name] is not None:
+            args.extend([option, driver_info[name]])
+    args.extend(['-E', 'shell'])
+    return args
+
+
+class _ShellSession(object):
+    """A long-lived ipmitool shell process."""
+
+    def __init__(self, args, password):
+        env = dict(os.environ, IPMI_PASSWORD=password or '')
+        # Error messages are interleaved with the output, to find out which
+        # command failed
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        env=env, close_fds=True,
+                                        universal_newlines=True)
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def _read_until(self, marker, commands):
+        output = []
+        errors = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                errors.append(_('ipmitool shell exited'))
+                return output, errors
+            # ipmitool prints its prompt, and may echo the commands, when
+            # reading the next command
+            while line.startswith(_PROMPT):
+                line = line[len(_PROMPT):]
+            line = line.strip()
+            if line == marker:
+                return output, errors
+            if not line or line in commands:
+                continue
+            if _HEX_LINE.match(line):
+                output.append(line)
+            else:
+                errors.append(line)
+
+    def execute(self, command, timeout):
+        """Execute a raw command.
+
+        :param command: the raw command bytes, as a string.
+        :param timeout: time (in seconds) to wait for the output.
+        :returns: the output of the command.
+        :raises: IPMIFailure on an error or a timeout.
+        """
+        marker = '__ironic_nm_%d__' % next(_markers)
+        commands = ('raw %s' % command, 'echo %s' % marker)
+        self.last_used = time.time()
+        try:
+            self.process.stdin.write('\n'.join(commands) + '\n')
+            self.process.stdin.flush()
+        except (IOError, OSError, ValueError) as e:
+            LOG.warning(_LW('Failed to send raw command %(cmd)s to ipmitool '
+                            'shell: %(err)s'), {'cmd': command, 'err': e})
+            raise exception.IPMIFailure(cmd=command)
+        result = None
+        with eventlet.Timeout(timeout, False):
+            result = self._read_until(marker, commands)
+        if result is None:
+            LOG.warning(_LW('Timed out after %(timeout)s seconds waiting for '
+                            'the output of raw command %(cmd)s in ipmitool '
+                            'shell.'), {'cmd': command, 'timeout': timeout})
+            raise exception.IPMIFailure(cmd=command)
+        output, errors = result
+        if errors:
+            LOG.warning(_LW('Raw command %(cmd)s failed in ipmitool shell: '
+                            '%(err)s'), {'cmd': command,
+                                         'err': '; '.join(errors)})
+            raise exception.IPMIFailure(cmd=command)
+        self.last_used = time.time()
+        return ' '.join(output)
+
+    def close(self):
+        if self.alive:
+            try:
+                self.process.stdin.close()
+                self.process.kill()
+            except (IOError, OSError):
+                pass
+        try:
+            self.process.wait()
+        except OSError:
+            pass
+
+
+class _ShellSessionPool(object):
+    """ipmitool shell sessions, one per BMC and bridging target."""
+
+    def __init__(self):
+        # (ipmitool arguments, password digest) -> _ShellSession
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _close_idle(self, now):
+        idle_timeout = CONF.intel_nm_driver.shell_idle_timeout
+        with self._lock:
+            # Sessions running a command are not idle
+            idle = [key for key, session in self._sessions.items()
+                    if now - session.last_used > idle_timeout]
+            sessions = [self._sessions.pop(key) for key in idle
+                        if not self._sessions[key].lock.locked()]
+        for session in sessions:
+            session.close()
+
+    def _get(self, key, args, password):
+        """Get the session of a key, opening one if needed.
+
+        :returns: a tuple of the session and whether it was just opened.
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and session.alive:
+                return session, False
+            session = self._sessions[key] = _ShellSession(args, password)
+            return session, True
+
+    def _discard(self, key, session):
+        with self._lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+        session.close()
+
+    def _execute(self, key, session, command):
+        with session.lock:
+            try:
+                return session.execute(
+                    command, CONF.intel_nm_driver.shell_command_timeout)
+            except exception.IPMIFailure:
+                self._discard(key, session)
+                raise
+
+    def execute(self, driver_info, command):
+        """Execute a raw command in the shell session of a BMC.
+
+        :param driver_info: the IPMI driver info, as returned by
+            ipmitool._parse_driver_info().
+        :param command: the raw command bytes, as a string.
+        :returns: the output of the command.
+        :raises: IPMIFailure on an error.
+        """
+        self._close_idle(time.time())
+        args = _shell_args(driver_info)
+        password = driver_info['password']
+        digest = hashlib.sha256((password or '').encode('utf-8')).hexdigest()
+        key = (tuple(args), digest)
+        session, opened = self._get(key, args, password)
+        try:
+            return self._execute(key, session, command)
+        except exception.IPMIFailure:
+            if opened:
+                raise
+        # The BMC may have closed the reused session
+        LOG.debug('Raw command %s failed in a reused ipmitool shell session, '
+                  'retrying in a new session', command)
+        session, opened = self._get(key, args, password)
+        return self._execute(key, session, command)
+
+    def close(self):
+        """Close all the sessions."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+_SESSIONS = _ShellSessionPool()
+
+
+def send_raw(task, raw_bytes):
+    """Send a raw command through the shell session of the node BMC.
+
+    :param task: a TaskManager instance.
+    :param raw_bytes: the raw command bytes, as a string.
+    :returns: the output of the command.
+    :raises: IPMIFailure on an error.
+    """
+    driver_info = ipmitool._parse_driver_info(task.node)
+    LOG.debug('Sending node %(node)s raw bytes %(bytes)s through ipmitool '
+              'shell', {'node': task.node.uuid, 'bytes': raw_bytes})
+    return _SESSIONS.execute(driver_info, raw_bytes)
+
+
+def send_raw_batch(task, commands):
+    """Send raw commands through a single ipmitool shell session.
+
+    The session is not shared, and is closed once the commands are done.
+
+    :param task: a TaskManager instance.
+    :param commands: a list of raw command bytes, as strings.
+    :returns: a list of the outputs of the commands.
+    :raises: IPMIFailure on an error.
+    """
+    driver_info = ipmitool._parse_driver_info(task.node)
+    LOG.debug('Sending node %(node)s %(count)d raw commands through ipmitool '
+              'shell', {'node': task.node.uuid, 'count': len(commands)})
+    session = _ShellSession(_shell_args(driver_info), driver_info['password'])
+    try:
+        return [session.execute(command,
+                                CONF.intel_nm_driver.shell_command_timeout)
+                for command in commands]
+    finally:
+        session.close()
@@ -13,6 +13,7 @@
 import binascii
 import collections
 import datetime
+import mmap
 import struct
 
 from ironic.common import exception as ironic_exception
@@ -111,6 +112,10 @@ STATISTICS = {
     }
 }
 
+# Global statistics parameters which are not related to a domain
+GLOBAL_PARAMETERS = ('unhandled_requests', 'response_time', 'cpu_throttling',
+                     'memory_throttling', 'communication_failures')
+
 
 def _reverse_dict(d):
     return {v: k for k, v in d.items()}
@@ -169,7 +174,13 @@ def _hex(x):
 
 
 def _raw_to_int(raw_data):
-    """Converting list of raw hex values as strings to integers."""
+    """Converting raw data to a sequence of integers.
+
+    :param raw_data: a list of raw hex values as strings, or a buffer (bytes,
+        bytearray or memoryview) with the raw values.
+    """
+    if isinstance(raw_data, (bytes, bytearray, memoryview)):
+        return bytearray(raw_data)
     return [int(x, 16) for x in raw_data]
 
 
@@ -516,27 +527,94 @@ def parse_statistics(raw_data):
 
 # Code below taken from Ceilometer
 # Copyright 2014 Intel Corporation.
-def parse_slave_and_channel(file_path):
-    """Parse the dumped file to get slave address and channel number.
 
-    :param file_path: file path of dumped SDR file.
-    :return: slave address and channel number of target device.
+# SDR record header: record ID, SDR version, record type, record length
+SDR_HEADER = struct.Struct('<HBBB')
+SDR_TYPE_OEM = 0xC0
+# Intel manufacturer ID, Intel NM discovery record subtype and version
+_NM_DISCOVERY_PREFIX = bytearray(b'\x57\x01\x00\x0d\x01')
+
+
+def iter_sdr_records(data):
+    """Iterate over the records of a binary SDR dump.
+
+    The records are read in place, a truncated last record is ignored.
+
+    :param data: the SDR records, as bytes, bytearray, memoryview or mmap,
+        in the format of "ipmitool sdr dump".
+    :returns: an iterator over (record type, record body) tuples.
     """
-    prefix = '5701000d01'
+    offset = 0
+    while offset + SDR_HEADER.size <= len(data):
+        record_id, version, record_type, length = SDR_HEADER.unpack_from(
+            data, offset)
+        offset += SDR_HEADER.size
+        if offset + length > len(data):
+            return
+        yield record_type, data[offset:offset + length]
+        offset += length
+
+
+def _parse_nm_discovery_record(body):
     # According to Intel Node Manager spec, section 4.5, for Intel NM
     # discovery OEM SDR records are type C0h. It contains manufacture ID
     # and OEM data in the record body.
     # 0-2 bytes are OEM ID, byte 3 is 0Dh and byte 4 is 01h. Byte 5, 6
     # is Intel NM device slave address and channel number/sensor owner LUN.
-    with open(file_path, 'rb') as bin_fp:
-        data_str = binascii.hexlify(bin_fp.read())
-
-    if six.PY3:
-        data_str = data_str.decode()
-    oem_id_index = data_str.find(prefix)
-    if oem_id_index != -1:
-        ret = data_str[oem_id_index + len(prefix):
-                       oem_id_index + len(prefix) + 4]
-        # Byte 5 is slave address. [7:4] from byte 6 is channel
-        # number, so just pick ret[2] here.
-        return ('0x' + ret[0:2], '0x0' + ret[2])
+    body = bytearray(body[:7])
+    if len(body) < 7 or body[:5] != _NM_DISCOVERY_PREFIX:
+        return None
+    # [7:4] from byte 6 is channel number
+    return '0x%02x' % body[5], '0x0%x' % (body[6] >> 4)
+
+
+def parse_sdr_records(data):
+    """Parse the SDR records to get slave address and channel number.
+
+    The records are walked until the first Intel NM discovery record.
+
+    :param data: the SDR records, as bytes, bytearray, memoryview or mmap.
+    :return: slave address and channel number of target device, or None if
+        there is no Intel NM discovery record.
+    """
+    for record_type, body in iter_sdr_records(data):
+        if record_type == SDR_TYPE_OEM:
+            result = _parse_nm_discovery_record(body)
+            if result is not None:
+                return result
+    return None
+
+
+def parse_sdr_record(record):
+    """Parse a single SDR record to get slave address and channel number.
+
+    :param record: the SDR record with its header, as bytes, bytearray or
+        memoryview.
+    :return: slave address and channel number of target device, or None if
+        the record is not an Intel NM discovery record.
+    """
+    if len(record) < SDR_HEADER.size:
+        return None
+    record_type = SDR_HEADER.unpack_from(record)[2]
+    if record_type != SDR_TYPE_OEM:
+        return None
+    return _parse_nm_discovery_record(record[SDR_HEADER.size:])
+
+
+def parse_slave_and_channel(sdr_filename):
+    """Parse the dumped SDR file to get slave address and channel number.
+
+    :param sdr_filename: file path of dumped SDR file.
+    :return: slave address and channel number of target device, or None if
+        there is no Intel NM discovery record.
+    """
+    with open(sdr_filename, 'rb') as bin_fp:
+        try:
+            data = mmap.mmap(bin_fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+    try:
+        return parse_sdr_records(data)
+    finally:
+        data.close()
@@ -12,10 +12,17 @@
 
 import json
 import os
+import threading
+import time
 
+import eventlet
+from futurist import periodics
+from ironic.common import driver_factory
 from ironic.common import exception
+from ironic.conductor import task_manager
 from ironic.drivers import base
 from ironic.drivers.modules import ipmitool
+from ironic.drivers import utils as driver_utils
 from ironic_lib import utils as ironic_utils
 import jsonschema
 from jsonschema import exceptions as json_schema_exc
@@ -27,15 +34,95 @@ import six
 from ironic_staging_drivers.common.i18n import _
 from ironic_staging_drivers.common.i18n import _LE
 from ironic_staging_drivers.common.i18n import _LI
+from ironic_staging_drivers.common.i18n import _LW
+from ironic_staging_drivers.intel_nm import ipmi_lan
+from ironic_staging_drivers.intel_nm import ipmi_shell
 from ironic_staging_drivers.intel_nm import nm_commands
-
+from ironic_staging_drivers.intel_nm import telemetry
+
+opts = [
+    cfg.StrOpt('transport',
+               default='ipmitool',
+               choices=['ipmitool', 'shell', 'lan'],
+               help=_('How the Intel Node Manager raw commands are sent to '
+                      'the BMC. "ipmitool" runs a new ipmitool process for '
+                      'each command, "shell" keeps a long-lived ipmitool '
+                      'shell session per BMC, and so reuses its IPMI '
+                      'session. "lan" keeps an RMCP+ session per BMC in the '
+                      'conductor process, without running ipmitool.')),
+    cfg.IntOpt('discovery_interval',
+               default=0,
+               min=0,
+               help=_('Interval (in seconds) between runs of the background '
+                      'detection of Intel Node Manager on the nodes. When '
+                      'enabled, the vendor methods only use the detection '
+                      'results and never dump the SDR themselves. The '
+                      'default of 0 disables it, Intel Node Manager is then '
+                      'detected on the first use of a node.')),
+    cfg.IntOpt('discovery_workers',
+               default=8,
+               min=1,
+               help=_('Maximum number of nodes on which Intel Node Manager '
+                      'is detected at the same time by the background '
+                      'detection.')),
+    cfg.IntOpt('discovery_retry_interval',
+               default=600,
+               min=1,
+               help=_('Time (in seconds) after which a failed detection of '
+                      'Intel Node Manager is retried. It is doubled after '
+                      'each consecutive failure, up to '
+                      'discovery_max_retry_interval.')),
+    cfg.IntOpt('discovery_max_retry_interval',
+               default=86400,
+               min=1,
+               help=_('Maximum time (in seconds) after which a failed '
+                      'detection of Intel Node Manager is retried.')),
+    cfg.IntOpt('discovery_refresh_interval',
+               default=86400,
+               min=0,
+               help=_('Time (in seconds) after which the background '
+                      'detection detects Intel Node Manager again on a node '
+                      'where it was found, to notice firmware changes. Set '
+                      'to 0 to never detect it again.')),
+]
 
 CONF = cfg.CONF
+opt_group = cfg.OptGroup(name='intel_nm_driver',
+                         title='Options for the Intel Node Manager vendor '
+                               'interface')
+CONF.register_group(opt_group)
+CONF.register_opts(opts, opt_group)
 CONF.import_opt('tempdir', 'ironic.common.utils')
 LOG = log.getLogger(__name__)
 
 SCHEMAS = ('control_schema', 'get_cap_schema', 'main_ids_schema',
-           'policy_schema', 'suspend_schema', 'statistics_schema')
+           'policy_schema', 'suspend_schema', 'statistics_schema',
+           'statistics_bulk_schema', 'telemetry_schema')
+
+# schema name -> jsonschema validator, shared by the vendor interfaces
+_VALIDATORS = {}
+_VALIDATORS_LOCK = threading.Lock()
+
+
+def _get_validators():
+    """Get the validators of the vendor methods parameters.
+
+    The JSON schemas are loaded and checked on the first call only, the
+    same validators are then returned to every vendor interface of the
+    process.
+
+    :returns: a dict mapping the schema names to Draft4Validator instances.
+    """
+    with _VALIDATORS_LOCK:
+        if not _VALIDATORS:
+            schemas_dir = os.path.dirname(__file__)
+            for schema in SCHEMAS:
+                filename = os.path.join(schemas_dir, schema + '.json')
+                with open(filename, 'r') as sf:
+                    schema_doc = json.load(sf)
+                jsonschema.Draft4Validator.check_schema(schema_doc)
+                _VALIDATORS[schema] = jsonschema.Draft4Validator(schema_doc)
+        return _VALIDATORS
 
 
 def _command_to_string(cmd):
@@ -43,41 +130,145 @@ def _command_to_string(cmd):
     return ' '.join(cmd)
 
 
-def _get_nm_address(task):
-    """Get Intel Node Manager target channel and address.
+def _send_raw(task, raw_bytes):
+    """Send raw bytes to the BMC with the configured transport.
 
     :param task: a TaskManager instance.
-    :raises: IPMIFailure if Intel Node Manager is not detected on a node or if
-             an error happens during detection.
-    :returns: a tuple with IPMI channel and address of Intel Node Manager.
+    :param raw_bytes: the raw command bytes, as a string.
+    :returns: the response data, as a memoryview with the "lan" transport,
+        or as a list of hex values as strings otherwise.
+    :raises: IPMIFailure on an error.
     """
-    node = task.node
-    driver_internal_info = node.driver_internal_info
+    transport = CONF.intel_nm_driver.transport
+    if transport == 'lan':
+        return memoryview(ipmi_lan.send_raw(task, raw_bytes))
+    if transport == 'shell':
+        return ipmi_shell.send_raw(task, raw_bytes).split()
+    return ipmitool.send_raw(task, raw_bytes)[0].split()
+
+
+def _send_raw_batch(task, commands):
+    """Send many raw commands to the BMC over a single IPMI session.
 
-    def _save_to_node(channel, address):
-        driver_internal_info['intel_nm_channel'] = channel
-        driver_internal_info['intel_nm_address'] = address
-        node.driver_internal_info = driver_internal_info
-        node.save()
+    With the "ipmitool" transport, the commands go through a one-off
+    ipmitool shell session, otherwise through the session of the configured
+    transport.
 
+    :param task: a TaskManager instance.
+    :param commands: a list of raw command bytes, as strings.
+    :returns: a list of the responses, as returned by _send_raw().
+    :raises: IPMIFailure on an error.
+    """
+    if CONF.intel_nm_driver.transport == 'ipmitool':
+        return [out.split()
+                for out in ipmi_shell.send_raw_batch(task, commands)]
+    return [_send_raw(task, command) for command in commands]
+
+
+def _save_detection(node, channel, address):
+    """Record the result of an Intel Node Manager detection on a node.
+
+    A failure is recorded with the time after which the detection is
+    retried, which doubles after each consecutive failure.
+    """
+    driver_internal_info = node.driver_internal_info
+    now = time.time()
+    driver_internal_info['intel_nm_channel'] = channel
+    driver_internal_info['intel_nm_address'] = address
+    driver_internal_info['intel_nm_detected_at'] = now
+    if channel and address:
+        driver_internal_info.pop('intel_nm_failures', None)
+        driver_internal_info.pop('intel_nm_retry_after', None)
+    else:
+        failures = driver_internal_info.get('intel_nm_failures', 0) + 1
+        retry_interval = CONF.intel_nm_driver.discovery_retry_interval
+        retry_interval = min(retry_interval * 2 ** (failures - 1),
+                             CONF.intel_nm_driver.discovery_max_retry_interval)
+        driver_internal_info['intel_nm_failures'] = failures
+        driver_internal_info['intel_nm_retry_after'] = now + retry_interval
+    node.driver_internal_info = driver_internal_info
+    node.save()
+
+
+def _needs_detection(driver_internal_info, now):
+    """Whether Intel Node Manager should be detected on a node.
+
+    :param driver_internal_info: the driver internal info of the node.
+    :param now: the current time.
+    :returns: True if Intel Node Manager was never detected, if its failed
+        detection should be retried, or if its successful detection should
+        be refreshed.
+    """
     channel = driver_internal_info.get('intel_nm_channel')
     address = driver_internal_info.get('intel_nm_address')
     if channel and address:
-        return channel, address
+        refresh_interval = CONF.intel_nm_driver.discovery_refresh_interval
+        detected_at = driver_internal_info.get('intel_nm_detected_at', 0)
+        return bool(refresh_interval) and (
+            now - detected_at > refresh_interval)
     if channel is False and address is False:
-        raise exception.IPMIFailure(_('Driver data indicates that Intel '
-                                      'Node Manager detection failed.'))
-    LOG.info(_LI('Start detection of Intel Node Manager on node %s'),
-             node.uuid)
-    sdr_filename = os.path.join(CONF.tempdir, node.uuid + '.sdr')
-    res = None
+        return now >= driver_internal_info.get('intel_nm_retry_after', 0)
+    return True
+
+
+def _find_nm_in_sdr(task):
+    """Find the Intel Node Manager discovery record in the SDR of a node.
+
+    With the "lan" transport, the SDR records are read in memory until the
+    Intel NM record. Otherwise the SDR is dumped to a temporary file by
+    ipmitool.
+
+    :param task: a TaskManager instance.
+    :raises: IPMIFailure if an error happens while reading the SDR.
+    :returns: a tuple with the slave address and the channel of Intel Node
+        Manager, or None if there is no Intel NM discovery record.
+    """
+    if CONF.intel_nm_driver.transport == 'lan':
+        for record in ipmi_lan.iter_sdr(task):
+            res = nm_commands.parse_sdr_record(record)
+            if res is not None:
+                return res
+        return None
+    sdr_filename = os.path.join(CONF.tempdir, task.node.uuid + '.sdr')
     try:
         ipmitool.dump_sdr(task, sdr_filename)
-        res = nm_commands.parse_slave_and_channel(sdr_filename)
+        return nm_commands.parse_slave_and_channel(sdr_filename)
     finally:
         ironic_utils.unlink_without_raise(sdr_filename)
+
+
+def _detect_nm_address(task):
+    """Detect Intel Node Manager target channel and address.
+
+    The result is saved in the driver internal info of the node. When the
+    detection of a node where Intel Node Manager was found is refreshed, an
+    error while reading the SDR keeps the previous result.
+
+    :param task: a TaskManager instance.
+    :raises: IPMIFailure if Intel Node Manager is not detected on a node or if
+             an error happens during detection.
+    :returns: a tuple with IPMI channel and address of Intel Node Manager.
+    """
+    node = task.node
+    LOG.info(_LI('Start detection of Intel Node Manager on node %s'),
+             node.uuid)
+    try:
+        res = _find_nm_in_sdr(task)
+    except exception.IPMIFailure as e:
+        with excutils.save_and_reraise_exception():
+            internal_info = node.driver_internal_info
+            if (internal_info.get('intel_nm_channel') and
+                    internal_info.get('intel_nm_address')):
+                LOG.warning(_LW('Can not refresh the detection of Intel Node '
+                                'Manager on node %(node)s, keeping the '
+                                'previous result: %(err)s'),
+                            {'node': node.uuid, 'err': e})
+            else:
+                # An unreachable BMC or wrong credentials are retried with
+                # backoff like any other failed detection
+                _save_detection(node, False, False)
     if res is None:
-        _save_to_node(False, False)
+        _save_detection(node, False, False)
         raise exception.IPMIFailure(_('Intel Node Manager is not detected.'))
     address, channel = res
     LOG.debug('Intel Node Manager sensors present in SDR on node %(node)s, '
@@ -88,17 +279,78 @@ def _get_nm_address(task):
     node.driver_info['ipmi_target_channel'] = channel
     node.driver_info['ipmi_target_address'] = address
     try:
-        ipmitool.send_raw(task,
-                          _command_to_string(nm_commands.get_version(None)))
-        _save_to_node(channel, address)
+        _send_raw(task, _command_to_string(nm_commands.get_version(None)))
+        _save_detection(node, channel, address)
         return channel, address
     except exception.IPMIFailure:
-        _save_to_node(False, False)
+        _save_detection(node, False, False)
         raise exception.IPMIFailure(_('Intel Node Manager sensors record '
                                       'present in SDR but Node Manager is not '
                                       'responding.'))
 
 
+def _get_nm_address(task):
+    """Get Intel Node Manager target channel and address.
+
+    When the background detection is enabled, only its results are used.
+    Otherwise Intel Node Manager is detected on the first use of the node,
+    and when a failed detection is due for a retry.
+
+    :param task: a TaskManager instance.
+    :raises: IPMIFailure if Intel Node Manager is not detected on a node or if
+             an error happens during detection.
+    :returns: a tuple with IPMI channel and address of Intel Node Manager.
+    """
+    driver_internal_info = task.node.driver_internal_info
+    channel = driver_internal_info.get('intel_nm_channel')
+    address = driver_internal_info.get('intel_nm_address')
+    if channel and address:
+        return channel, address
+    failed = channel is False and address is False
+    if CONF.intel_nm_driver.discovery_interval:
+        if failed:
+            raise exception.IPMIFailure(_('Driver data indicates that Intel '
+                                          'Node Manager detection failed.'))
+        raise exception.IPMIFailure(_('Intel Node Manager detection has not '
+                                      'completed yet.'))
+    if not _needs_detection(driver_internal_info, time.time()):
+        raise exception.IPMIFailure(_('Driver data indicates that Intel '
+                                      'Node Manager detection failed.'))
+    return _detect_nm_address(task)
+
+
+def _discover_node(context, node_uuid):
+    try:
+        with task_manager.acquire(context, node_uuid, shared=False,
+                                  purpose='detecting Intel Node '
+                                          'Manager') as task:
+            # The node may have been detected since it was listed
+            if _needs_detection(task.node.driver_internal_info,
+                                time.time()):
+                _detect_nm_address(task)
+    except (exception.NodeLocked, exception.NodeNotFound):
+        LOG.debug('Node %s is locked or was deleted, skipping the detection '
+                  'of Intel Node Manager', node_uuid)
+    except exception.IPMIFailure as e:
+        LOG.info(_LI('Intel Node Manager is not detected on node %(node)s: '
+                     '%(err)s'), {'node': node_uuid, 'err': e})
+
+
+def discover_nm_addresses(context, node_uuids):
+    """Detect Intel Node Manager on many nodes at once.
+
+    At most [intel_nm_driver]discovery_workers nodes are handled at the same
+    time. Locked nodes are skipped.
+
+    :param context: an admin context.
+    :param node_uuids: a list of node UUIDs.
+    """
+    pool = eventlet.GreenPool(CONF.intel_nm_driver.discovery_workers)
+    for node_uuid in node_uuids:
+        pool.spawn_n(_discover_node, context, node_uuid)
+    pool.waitall()
+
+
 def _execute_nm_command(task, data, command_func, parse_func=None):
     """Execute Intel Node Manager command via send_raw().
 
@@ -111,6 +363,20 @@ def _execute_nm_command(task, data, command_func, parse_func=None):
     :returns: a dict with parsed output or None if command does not return
               user's info.
     """
+    _set_nm_target(task)
+    cmd = _command_to_string(command_func(data))
+    out = _send_raw(task, cmd)
+    if parse_func:
+        return _parse_output(task, parse_func, out)
+
+
+def _set_nm_target(task):
+    """Bridge the IPMI commands of a node to Intel Node Manager.
+
+    :param task: a TaskManager instance.
+    :raises: IPMIFailure if Intel Node Manager is not detected on a node or if
+             an error happens during detection.
+    """
     try:
         channel, address = _get_nm_address(task)
     except exception.IPMIFailure as e:
@@ -122,42 +388,179 @@ def _execute_nm_command(task, data, command_func, parse_func=None):
     driver_info['ipmi_bridging'] = 'single'
     driver_info['ipmi_target_channel'] = channel
     driver_info['ipmi_target_address'] = address
-    cmd = _command_to_string(command_func(data))
-    out = ipmitool.send_raw(task, cmd)[0]
-    if parse_func:
-        try:
-            return parse_func(out.split())
-        except exception.IPMIFailure as e:
-            with excutils.save_and_reraise_exception():
-                LOG.exception(_LE('Error in returned data for node %(node)s: '
-                                  '%(err)s'), {'node': task.node.uuid,
-                                               'err': six.text_type(e)})
 
 
-class IntelNMVendorPassthru(base.VendorInterface):
+def _parse_output(task, parse_func, out):
+    try:
+        return parse_func(out)
+    except exception.IPMIFailure as e:
+        with excutils.save_and_reraise_exception():
+            LOG.exception(_LE('Error in returned data for node %(node)s: '
+                              '%(err)s'), {'node': task.node.uuid,
+                                           'err': six.text_type(e)})
+
+
+def _get_statistics_bulk(task, data):
+    """Get many Intel Node Manager statistics over a single IPMI session.
+
+    :param task: a TaskManager instance.
+    :param data: a dict with the scope, the domain ID, the policy ID for the
+        policy scope, and optionally the list of parameter names. By
+        default, all the parameters of the scope related to a domain are
+        fetched.
+    :raises: IPMIFailure if Intel Node Manager is not detected on a node or if
+             an error happens during command execution.
+    :returns: a dict mapping the parameter names to the parsed statistics.
+    """
+    scope = data['scope']
+    parameters = data.get('parameter_names')
+    if not parameters:
+        parameters = sorted(
+            (name for name in nm_commands.STATISTICS[scope]
+             if name not in nm_commands.GLOBAL_PARAMETERS),
+            key=nm_commands.STATISTICS[scope].get)
+    commands = []
+    for parameter in parameters:
+        command_data = {'scope': scope, 'parameter_name': parameter,
+                        'domain_id': data['domain_id']}
+        if scope == 'policy':
+            command_data['policy_id'] = data['policy_id']
+        if parameter in nm_commands.GLOBAL_PARAMETERS:
+            # These parameters are not related to a domain
+            command_data['domain_id'] = 'platform'
+        commands.append(_command_to_string(
+            nm_commands.get_statistics(command_data)))
+    _set_nm_target(task)
+    outputs = _send_raw_batch(task, commands)
+    return dict((parameter, _parse_output(task, nm_commands.parse_statistics,
+                                          out))
+                for parameter, out in zip(parameters, outputs))
+
+
+def _sample_node(context, node_uuid):
+    try:
+        with task_manager.acquire(context, node_uuid, shared=True,
+                                  purpose='sampling Intel Node Manager '
+                                          'telemetry') as task:
+            for domain in CONF.intel_nm_driver.telemetry_domains:
+                for parameter in telemetry.PARAMETERS:
+                    data = {'scope': 'global', 'domain_id': domain,
+                            'parameter_name': parameter}
+                    try:
+                        statistics = _execute_nm_command(
+                            task, data, nm_commands.get_statistics,
+                            nm_commands.parse_statistics)
+                    except exception.IPMIFailure as e:
+                        LOG.debug('Failed to sample Intel Node Manager '
+                                  '%(param)s statistics of domain %(domain)s '
+                                  'on node %(node)s: %(err)s',
+                                  {'param': parameter, 'domain': domain,
+                                   'node': node_uuid, 'err': e})
+                        continue
+                    telemetry.HISTORY.record(node_uuid, domain, parameter,
+                                             time.time(),
+                                             statistics['current_value'])
+    except exception.NodeNotFound:
+        LOG.debug('Node %s was deleted, skipping the sampling of Intel Node '
+                  'Manager telemetry', node_uuid)
+
+
+def sample_nm_telemetry(context, node_uuids):
+    """Sample the Intel Node Manager telemetry of many nodes at once.
+
+    The current values of the telemetry.PARAMETERS global statistics of the
+    [intel_nm_driver]telemetry_domains domains are recorded in
+    telemetry.HISTORY. At most [intel_nm_driver]telemetry_workers nodes are
+    handled at the same time.
+
+    :param context: an admin context.
+    :param node_uuids: a list of node UUIDs.
+    """
+    pool = eventlet.GreenPool(CONF.intel_nm_driver.telemetry_workers)
+    for node_uuid in node_uuids:
+        pool.spawn_n(_sample_node, context, node_uuid)
+    pool.waitall()
+
+
+class _IntelNMPeriodicTasks(object):
+    """Periodic tasks of the interfaces giving access to Intel NM.
+
+    The conductor collects the periodic tasks of the vendor interface of
+    each driver, only once per interface class. So each class handles the
+    nodes of all the drivers whose vendor interface is of this very class,
+    and a node is never handled twice.
+    """
+
+    def _handles(self, driver_name):
+        """Whether the nodes of a driver are handled by this interface."""
+        try:
+            driver = driver_factory.get_driver(driver_name)
+        except exception.DriverNotFound:
+            return False
+        return type(getattr(driver, 'vendor', None)) is type(self)
+
+    @periodics.periodic(spacing=CONF.intel_nm_driver.discovery_interval,
+                        enabled=CONF.intel_nm_driver.discovery_interval > 0)
+    def _discover_nm_addresses(self, manager, context):
+        """Detect Intel Node Manager on the nodes needing it."""
+        now = time.time()
+        node_iter = manager.iter_nodes(fields=['driver_internal_info'],
+                                       filters={'maintenance': False})
+        node_uuids = []
+        for node_uuid, driver_name, driver_internal_info in node_iter:
+            if not self._handles(driver_name):
+                continue
+            if _needs_detection(driver_internal_info, now):
+                node_uuids.append(node_uuid)
+        if node_uuids:
+            LOG.debug('Detecting Intel Node Manager on nodes %s',
+                      ', '.join(node_uuids))
+            discover_nm_addresses(context, node_uuids)
+
+    @periodics.periodic(spacing=CONF.intel_nm_driver.telemetry_interval,
+                        enabled=CONF.intel_nm_driver.telemetry_interval > 0)
+    def _sample_nm_telemetry(self, manager, context):
+        """Sample the telemetry of the nodes with Intel Node Manager."""
+        node_iter = manager.iter_nodes(fields=['driver_internal_info'],
+                                       filters={'maintenance': False})
+        node_uuids = []
+        for node_uuid, driver_name, driver_internal_info in node_iter:
+            if not self._handles(driver_name):
+                continue
+            detected = (driver_internal_info.get('intel_nm_channel'),
+                        driver_internal_info.get('intel_nm_address'))
+            if all(detected):
+                node_uuids.append(node_uuid)
+        sample_nm_telemetry(context, node_uuids)
+        # Forget the nodes not sampled for the length of the history
+        interval = CONF.intel_nm_driver.telemetry_interval
+        history = interval * CONF.intel_nm_driver.telemetry_history
+        telemetry.HISTORY.expire(time.time() - history)
+
+
+class IntelNMVendorPassthru(_IntelNMPeriodicTasks, base.VendorInterface):
     """Intel Node Manager policies vendor interface."""
 
     def __init__(self):
-        schemas_dir = os.path.dirname(__file__)
-        for schema in SCHEMAS:
-            filename = os.path.join(schemas_dir, schema + '.json')
-            with open(filename, 'r') as sf:
-                setattr(self, schema, json.load(sf))
+        self._validators = _get_validators()
+
+    def _validate_schema(self, schema, kwargs):
+        self._validators[schema].validate(kwargs)
 
     def _validate_policy_methods(self, method, **kwargs):
         if method in ('get_nm_policy', 'remove_nm_policy',
                       'get_nm_policy_suspend', 'remove_nm_policy_suspend'):
-            jsonschema.validate(kwargs, self.main_ids_schema)
+            self._validate_schema('main_ids_schema', kwargs)
 
         elif method == 'control_nm_policy':
-            jsonschema.validate(kwargs, self.control_schema)
+            self._validate_schema('control_schema', kwargs)
             if kwargs['scope'] != 'global' and 'domain_id' not in kwargs:
                 raise exception.MissingParameterValue(_('Missing "domain_id"'))
             if kwargs['scope'] == 'policy' and 'policy_id' not in kwargs:
                 raise exception.MissingParameterValue(_('Missing "policy_id"'))
 
         elif method == 'set_nm_policy':
-            jsonschema.validate(kwargs, self.policy_schema)
+            self._validate_schema('policy_schema', kwargs)
             if kwargs['policy_trigger'] == 'boot':
                 if not isinstance(kwargs['target_limit'], dict):
                     raise exception.InvalidParameterValue(_('Invalid boot '
@@ -167,17 +570,15 @@ class IntelNMVendorPassthru(base.VendorInterface):
                     _('Missing "correction_time" for no-boot policy'))
 
         elif method == 'set_nm_policy_suspend':
-            jsonschema.validate(kwargs, self.suspend_schema)
+            self._validate_schema('suspend_schema', kwargs)
 
         elif method == 'get_nm_capabilities':
-            jsonschema.validate(kwargs, self.get_cap_schema)
+            self._validate_schema('get_cap_schema', kwargs)
 
     def _validate_statistics_methods(self, method, **kwargs):
-        jsonschema.validate(kwargs, self.statistics_schema)
+        self._validate_schema('statistics_schema', kwargs)
 
-        global_params = ('unhandled_requests', 'response_time',
-                         'cpu_throttling', 'memory_throttling',
-                         'communication_failures')
+        global_params = nm_commands.GLOBAL_PARAMETERS
 
         if kwargs['scope'] == 'policy' and 'policy_id' not in kwargs:
                 raise exception.MissingParameterValue(_('Missing "policy_id"'))
@@ -206,6 +607,19 @@ class IntelNMVendorPassthru(base.VendorInterface):
                           '%(scope)s') % {'param': kwargs['parameter_name'],
                                           'scope': kwargs['scope']})
 
+    def _validate_statistics_bulk(self, **kwargs):
+        self._validate_schema('statistics_bulk_schema', kwargs)
+        scope = kwargs['scope']
+        if scope == 'policy' and 'policy_id' not in kwargs:
+            raise exception.MissingParameterValue(_('Missing "policy_id"'))
+        invalid = [name for name in kwargs.get('parameter_names', ())
+                   if name not in nm_commands.STATISTICS[scope]]
+        if invalid:
+            raise exception.InvalidParameterValue(
+                _('Invalid parameter names %(params)s for scope '
+                  '%(scope)s') % {'params': ', '.join(invalid),
+                                  'scope': scope})
+
     def get_properties(self):
         """Returns the properties of the interface.."""
         return {}
@@ -224,8 +638,12 @@ class IntelNMVendorPassthru(base.VendorInterface):
         :raises: MissingParameterValue if parameters missing in supplied data.
         """
         try:
-            if 'statistics' in method:
+            if method == 'get_nm_statistics_bulk':
+                self._validate_statistics_bulk(**kwargs)
+            elif 'statistics' in method:
                 self._validate_statistics_methods(method, **kwargs)
+            elif method == 'get_nm_telemetry':
+                self._validate_schema('telemetry_schema', kwargs)
             else:
                 self._validate_policy_methods(method, **kwargs)
         except json_schema_exc.ValidationError as e:
@@ -344,6 +762,18 @@ class IntelNMVendorPassthru(base.VendorInterface):
                                    nm_commands.get_statistics,
                                    nm_commands.parse_statistics)
 
+    @base.passthru(['GET'], async=False)
+    def get_nm_statistics_bulk(self, task, **kwargs):
+        """Get many Intel Node Manager statistics of a domain at once.
+
+        :param task: a TaskManager instance.
+        :param kwargs: data passed to method.
+        :raises: IPMIFailure on an error.
+        :returns: a dictionary mapping the statistics parameter names to
+            their statistics info.
+        """
+        return _get_statistics_bulk(task, kwargs)
+
     @base.passthru(['PUT'])
     def reset_nm_statistics(self, task, **kwargs):
         """Reset Intel Node Manager statistics.
@@ -353,3 +783,39 @@ class IntelNMVendorPassthru(base.VendorInterface):
         :raises: IPMIFailure on an error.
         """
         _execute_nm_command(task, kwargs, nm_commands.reset_statistics)
+
+    @base.passthru(['GET'], async=False)
+    def get_nm_telemetry(self, task, **kwargs):
+        """Get the history of Intel Node Manager power telemetry.
+
+        The samples are taken by the conductor, the BMC is not queried.
+
+        :param task: a TaskManager instance.
+        :param kwargs: data passed to method.
+        :returns: a dictionary mapping the statistics parameters to the
+            summary of their sampled current values: the number of samples,
+            the current, minimum, maximum and average values, and the
+            percentiles.
+        """
+        domain = kwargs.get('domain_id', 'platform')
+        parameters = ([kwargs['parameter_name']] if 'parameter_name' in kwargs
+                      else telemetry.PARAMETERS)
+        percentiles = kwargs.get('percentiles',
+                                 telemetry.DEFAULT_PERCENTILES)
+        since = None
+        if 'window' in kwargs:
+            since = time.time() - kwargs['window']
+        return dict(
+            (parameter, telemetry.summarize(
+                telemetry.HISTORY.values(task.node.uuid, domain, parameter,
+                                         since), percentiles))
+            for parameter in parameters)
+
+
+class IntelNMMixinVendorInterface(_IntelNMPeriodicTasks,
+                                  driver_utils.MixinVendorInterface):
+    """Vendor interface of the drivers mixing Intel NM with other methods.
+
+    The Intel NM interface of such drivers is not their vendor interface,
+    this one runs its periodic tasks for it.
+    """
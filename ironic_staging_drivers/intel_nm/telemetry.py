@@ -0,0 +1,181 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+In-memory history of Intel Node Manager power telemetry
+
+The current values of the global power, temperature and chassis power
+statistics are sampled periodically and kept in fixed-size ring buffers,
+one per node, domain and statistics parameter. The buffers are backed by
+arrays of doubles, so that their size doesn't grow with the number of
+samples.
+"""
+import array
+import threading
+
+from oslo_config import cfg
+
+from ironic_staging_drivers.common.i18n import _
+
+opts = [
+    cfg.IntOpt('telemetry_interval',
+               default=0,
+               min=0,
+               help=_('Interval (in seconds) between two samples of the '
+                      'Intel Node Manager power telemetry of the nodes. Set '
+                      'to 0 to disable the sampling.')),
+    cfg.IntOpt('telemetry_history',
+               default=1440,
+               min=1,
+               help=_('Number of samples of each telemetry statistics kept '
+                      'per node and domain.')),
+    cfg.ListOpt('telemetry_domains',
+                default=['platform'],
+                help=_('Intel Node Manager domains whose telemetry is '
+                       'sampled.')),
+    cfg.IntOpt('telemetry_workers',
+               default=8,
+               min=1,
+               help=_('Maximum number of nodes whose telemetry is sampled at '
+                      'the same time.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='intel_nm_driver')
+
+# Global statistics parameters sampled
+PARAMETERS = ('power', 'temperature', 'chassis_power')
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+class RingBuffer(object):
+    """A fixed-size history of timestamped samples.
+
+    When full, a new sample replaces the oldest one.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._timestamps = array.array('d', [0.0]) * size
+        self._values = array.array('d', [0.0]) * size
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        self._timestamps[self._next] = timestamp
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    @property
+    def last_timestamp(self):
+        if not self._count:
+            return None
+        return self._timestamps[self._next - 1]
+
+    def values(self, since=None):
+        """Get the values of the samples, oldest first.
+
+        :param since: if set, only the samples taken at this time or later
+            are returned.
+        :returns: a list of values.
+        """
+        values = []
+        # The samples are in chronological order, walk them back from the
+        # newest one
+        for i in range(1, self._count + 1):
+            index = (self._next - i) % self.size
+            if since is not None and self._timestamps[index] < since:
+                break
+            values.append(self._values[index])
+        values.reverse()
+        return values
+
+
+class TelemetryHistory(object):
+    """The ring buffers of the sampled nodes."""
+
+    def __init__(self):
+        # (node UUID, domain, parameter) -> RingBuffer
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def record(self, node_uuid, domain, parameter, timestamp, value):
+        """Record a sample of a statistics parameter of a node."""
+        key = (node_uuid, domain, parameter)
+        with self._lock:
+            buf = self._buffers.get(key)
+            if buf is None:
+                buf = self._buffers[key] = RingBuffer(
+                    CONF.intel_nm_driver.telemetry_history)
+            buf.append(timestamp, value)
+
+    def values(self, node_uuid, domain, parameter, since=None):
+        """Get the sampled values of a statistics parameter of a node.
+
+        :param since: if set, only the samples taken at this time or later
+            are returned.
+        :returns: a list of values, oldest first.
+        """
+        with self._lock:
+            buf = self._buffers.get((node_uuid, domain, parameter))
+            return buf.values(since) if buf is not None else []
+
+    def expire(self, before):
+        """Forget the nodes which were not sampled since a given time."""
+        with self._lock:
+            expired = [key for key, buf in self._buffers.items()
+                       if buf.last_timestamp < before]
+            for key in expired:
+                del self._buffers[key]
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+
+
+HISTORY = TelemetryHistory()
+
+
+def _percentile(values, percent):
+    """Compute a percentile of sorted values, interpolating linearly."""
+    position = (len(values) - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(values, percentiles=DEFAULT_PERCENTILES):
+    """Summarize sampled values.
+
+    :param values: a list of values, oldest first.
+    :param percentiles: the percentiles to compute, between 0 and 100.
+    :returns: a dict with the number of samples, the current, minimum,
+        maximum and average values, and the requested percentiles keyed by
+        their string representation. The values are None without samples.
+    """
+    summary = {'samples': len(values)}
+    if not values:
+        summary.update(current_value=None, minimum_value=None,
+                       maximum_value=None, average_value=None,
+                       percentiles=dict(('%g' % p, None)
+                                        for p in percentiles))
+        return summary
+    ordered = sorted(values)
+    summary.update(current_value=values[-1], minimum_value=ordered[0],
+                   maximum_value=ordered[-1],
+                   average_value=sum(values) / len(values),
+                   percentiles=dict(('%g' % p, _percentile(ordered, p))
+                                    for p in percentiles))
+    return summary
@@ -38,27 +38,73 @@ Currently supported transports are:
 
 """
 
+import collections
+import contextlib
 import os
+import threading
+import time
+import traceback
 import xml.etree.ElementTree as ET
 
+from eventlet import patcher
 import libvirt
 from oslo_config import cfg
 from oslo_log import log as logging
+import six
 
 from ironic.common import boot_devices
 from ironic.common import exception as ir_exc
 from ironic.common.i18n import _
+from ironic.common.i18n import _LE
+from ironic.common.i18n import _LW
 from ironic.common import states
 from ironic.conductor import task_manager
 from ironic.drivers import base
 from ironic.drivers import utils as driver_utils
+from ironic import objects
 from ironic_staging_drivers.common import exception as isd_exc
-
+from ironic_staging_drivers.common import utils
+
+
+opts = [
+    cfg.IntOpt('connection_pool_size',
+               default=16,
+               min=1,
+               help=_('Maximum number of libvirt connections kept open by '
+                      'the conductor. The least recently used connection is '
+                      'closed when the limit is reached.')),
+    cfg.IntOpt('connection_idle_timeout',
+               default=300,
+               min=0,
+               help=_('Time (in seconds) after which an unused libvirt '
+                      'connection is closed. Setting it to 0 keeps idle '
+                      'connections open until they are evicted from the '
+                      'pool.')),
+    cfg.BoolOpt('power_state_events',
+                default=False,
+                help=_('Whether to track the power states of the domains '
+                       'with libvirt lifecycle events instead of querying '
+                       'the hypervisor on every power state check.')),
+    cfg.IntOpt('power_state_cache_ttl',
+               default=60,
+               min=0,
+               help=_('Time (in seconds) for which a power state received '
+                      'from a lifecycle event is trusted. Only used when '
+                      'power_state_events is enabled.')),
+]
 
 CONF = cfg.CONF
+opt_group = cfg.OptGroup(name='libvirt_driver',
+                         title='Options for the Libvirt power driver')
+CONF.register_group(opt_group)
+CONF.register_opts(opts, opt_group)
 
 LOG = logging.getLogger(__name__)
 
+# The libvirt event loop blocks in C code, so it has to run in a real
+# thread rather than in a green one.
+_native_threading = patcher.original('threading')
+
 DEFAULT_URI = 'qemu+unix:///system'
 REQUIRED_PROPERTIES = {}
 OTHER_PROPERTIES = {
@@ -80,11 +126,11 @@ _BOOT_DEVICES_MAP = {
 }
 
 
-def _get_libvirt_connection(driver_info):
-    """Get the libvirt connection.
+def _open_libvirt_connection(driver_info):
+    """Open a new libvirt connection.
 
     :param driver_info: driver info
-    :returns: the active libvirt connection
+    :returns: the new libvirt connection
     :raises: LibvirtError if failed to connect to the Libvirt uri.
     """
 
@@ -119,6 +165,491 @@ def _get_libvirt_connection(driver_info):
     return conn
 
 
+def _connection_key(driver_info):
+    """Get the key identifying a pooled connection."""
+    return (driver_info.get('libvirt_uri') or DEFAULT_URI,
+            driver_info.get('sasl_username'),
+            driver_info.get('ssh_key_filename'))
+
+
+def _is_alive(conn):
+    """Check whether the libvirt connection is still usable."""
+    try:
+        return bool(conn.isAlive())
+    except libvirt.libvirtError:
+        return False
+
+
+def _close_connection(conn):
+    """Close the libvirt connection, ignoring errors."""
+    _POWER_STATE_CACHE.unwatch(conn)
+    try:
+        conn.close()
+    except libvirt.libvirtError as e:
+        LOG.debug("Failed to close libvirt connection: %s", e)
+
+
+class _ConnectionPool(object):
+    """Process-wide pool of long-lived libvirt connections.
+
+    Connections are keyed by URI and credentials. They are checked for
+    liveness before being handed out, and closed when they stay unused
+    longer than ``[libvirt_driver]connection_idle_timeout`` or when the
+    pool grows over ``[libvirt_driver]connection_pool_size``. A connection
+    leased with lease() is never closed for being idle or evicted, so the
+    pool can grow over its size while all the connections are in use.
+    """
+
+    def __init__(self):
+        # key -> [connection, last used timestamp], least recently used first
+        self._connections = collections.OrderedDict()
+        # key -> number of leases
+        self._leases = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _pop_idle(self, now):
+        timeout = CONF.libvirt_driver.connection_idle_timeout
+        if not timeout:
+            return []
+        idle = [key for key, (conn, last_used) in self._connections.items()
+                if now - last_used > timeout and not self._leases[key]]
+        return [self._connections.pop(key)[0] for key in idle]
+
+    def _pop_overflow(self, new_key):
+        size = CONF.libvirt_driver.connection_pool_size
+        excess = len(self._connections) - size
+        if excess <= 0:
+            return []
+        evicted = [key for key in self._connections
+                   if key != new_key and not self._leases[key]][:excess]
+        return [self._connections.pop(key)[0] for key in evicted]
+
+    @contextlib.contextmanager
+    def lease(self, driver_info):
+        """Mark the connection for the given driver info as in use.
+
+        While the lease is held, the connection is not closed for being idle
+        or evicted, so that it and the domains got from it stay usable.
+
+        :param driver_info: driver info
+        """
+        key = _connection_key(driver_info)
+        with self._lock:
+            self._leases[key] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._leases[key] -= 1
+                if not self._leases[key]:
+                    del self._leases[key]
+                entry = self._connections.get(key)
+                if entry is not None:
+                    entry[1] = time.time()
+
+    def get(self, driver_info):
+        """Get a live connection for the given driver info.
+
+        :param driver_info: driver info
+        :returns: the active libvirt connection
+        :raises: LibvirtError if failed to connect to the Libvirt uri.
+        """
+        key = _connection_key(driver_info)
+        now = time.time()
+        with self._lock:
+            to_close = self._pop_idle(now)
+            entry = self._connections.pop(key, None)
+            if entry is not None:
+                entry[1] = now
+                self._connections[key] = entry
+        for conn in to_close:
+            _close_connection(conn)
+
+        if entry is not None:
+            if _is_alive(entry[0]):
+                return entry[0]
+            LOG.debug("Libvirt connection to %s is dead, reconnecting", key[0])
+            self.discard(driver_info, entry[0])
+
+        events = CONF.libvirt_driver.power_state_events
+        if events:
+            # The event loop must be registered before opening a connection
+            # for the connection to deliver events.
+            _EVENT_LOOP.start()
+        conn = _open_libvirt_connection(driver_info)
+        with self._lock:
+            entry = self._connections.get(key)
+            if entry is None:
+                self._connections[key] = [conn, now]
+                to_close = self._pop_overflow(key)
+            else:
+                # Another thread connected in the meantime, use its connection
+                to_close = [conn]
+                conn = entry[0]
+                events = False
+        for old_conn in to_close:
+            _close_connection(old_conn)
+        if events:
+            _POWER_STATE_CACHE.watch(key, conn)
+        return conn
+
+    def discard(self, driver_info, conn=None):
+        """Remove a connection from the pool and close it.
+
+        :param driver_info: driver info
+        :param conn: the connection expected in the pool; nothing is done if
+            the pool holds a different one. Any connection is removed if None.
+        """
+        key = _connection_key(driver_info)
+        with self._lock:
+            entry = self._connections.get(key)
+            if entry is None or (conn is not None and entry[0] is not conn):
+                entry = None
+            else:
+                del self._connections[key]
+        if entry is not None:
+            _close_connection(entry[0])
+
+    def clear(self):
+        """Close all pooled connections."""
+        with self._lock:
+            conns = [conn for conn, last_used in self._connections.values()]
+            self._connections.clear()
+        for conn in conns:
+            _close_connection(conn)
+
+
+_CONNECTION_POOL = _ConnectionPool()
+
+
+def _get_libvirt_connection(driver_info):
+    """Get the libvirt connection.
+
+    The connection is taken from the process-wide pool, a new one is opened
+    only if there is no live connection for the same URI and credentials.
+
+    :param driver_info: driver info
+    :returns: the active libvirt connection
+    :raises: LibvirtError if failed to connect to the Libvirt uri.
+    """
+
+    return _CONNECTION_POOL.get(driver_info)
+
+
+def _leases_connection(method):
+    """Keep the pooled connection of the node in use during the method.
+
+    The domains got by the method are only usable while their connection
+    is open.
+    """
+
+    @six.wraps(method)
+    def wrapper(self, task, *args, **kwargs):
+        with _CONNECTION_POOL.lease(_parse_driver_info(task.node)):
+            return method(self, task, *args, **kwargs)
+    return wrapper
+
+
+def _call_with_reconnect(driver_info, func):
+    """Call a function with a pooled connection, reconnecting if needed.
+
+    If the call fails because the pooled connection was broken, the
+    connection is dropped from the pool and the call is retried once with a
+    new connection.
+
+    :param driver_info: driver info
+    :param func: a function accepting the libvirt connection.
+    :returns: the result of the function.
+    :raises: LibvirtError if the call failed.
+    """
+
+    with _CONNECTION_POOL.lease(driver_info):
+        conn = _get_libvirt_connection(driver_info)
+        try:
+            return func(conn)
+        except libvirt.libvirtError as e:
+            if _is_alive(conn):
+                raise isd_exc.LibvirtError(err=e)
+            LOG.debug("Libvirt connection to %(uri)s was lost: %(err)s, "
+                      "reconnecting", {'uri': driver_info.get('libvirt_uri'),
+                                       'err': e})
+            _CONNECTION_POOL.discard(driver_info, conn)
+
+        conn = _get_libvirt_connection(driver_info)
+        try:
+            return func(conn)
+        except libvirt.libvirtError as e:
+            raise isd_exc.LibvirtError(err=e)
+
+
+def _get_domain_macs(domain):
+    """Get the normalized MAC addresses of the domain's interfaces.
+
+    :param domain: libvirt domain object.
+    :returns: a set of normalized MAC addresses.
+    :raises: libvirtError if failed to get the domain XML.
+    """
+
+    parsed = ET.fromstring(domain.XMLDesc())
+    return {driver_utils.normalize_mac(el.attrib['address'])
+            for el in parsed.iter('mac')}
+
+
+class _DomainIndex(object):
+    """Per-URI index of libvirt domain UUIDs by normalized MAC address.
+
+    The index is built from a single domain listing, so that looking up the
+    domain of a node costs one lookupByUUIDString call instead of fetching
+    and parsing the XML of every domain on the hypervisor.
+    """
+
+    def __init__(self):
+        # uri -> {normalized mac: domain uuid}
+        self._indexes = {}
+        # Indexes are invalidated from the event loop thread, so the lock
+        # has to be a native one. It is never held across a green switch.
+        self._lock = _native_threading.Lock()
+
+    def get(self, uri):
+        """Get the index for the URI, None if it is not built."""
+        return self._indexes.get(uri)
+
+    def build(self, uri, domains):
+        """Build the index for the URI from a domain listing.
+
+        :param uri: libvirt URI.
+        :param domains: a list of libvirt domain objects.
+        :returns: the new index.
+        :raises: libvirtError if failed to get a domain description.
+        """
+        index = {}
+        for domain in domains:
+            try:
+                macs = _get_domain_macs(domain)
+                uuid = domain.UUIDString()
+            except libvirt.libvirtError as e:
+                # The domain could be undefined while listing
+                if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                    continue
+                raise
+            for mac in macs:
+                index[mac] = uuid
+        with self._lock:
+            self._indexes[uri] = index
+        return index
+
+    def invalidate(self, uri=None):
+        """Drop the index for the URI, or all indexes if it is None."""
+        with self._lock:
+            if uri is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(uri, None)
+
+
+_DOMAIN_INDEX = _DomainIndex()
+
+
+class _EventLoop(object):
+    """The libvirt default event loop, running in a native thread."""
+
+    def __init__(self):
+        self._thread = None
+        self._registered = False
+        self._lock = threading.Lock()
+        # Error of the event loop, logged from a green thread
+        self._failure = None
+
+    def is_alive(self):
+        """Check whether the event loop is running."""
+        failure, self._failure = self._failure, None
+        if failure is not None:
+            LOG.error(_LE("The libvirt event loop failed, falling back to "
+                          "querying power states: %s"), failure)
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the event loop unless it is already running."""
+        with self._lock:
+            if self.is_alive():
+                return
+            if not self._registered:
+                libvirt.virEventRegisterDefaultImpl()
+                self._registered = True
+            self._thread = _native_threading.Thread(
+                target=self._run, name='libvirt-event-loop')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                libvirt.virEventRunDefaultImpl()
+            except Exception:
+                # Logging takes green locks, it can't be done from here
+                self._failure = traceback.format_exc()
+                return
+
+
+_EVENT_LOOP = _EventLoop()
+
+
+def _get_lifecycle_events_map():
+    return {
+        libvirt.VIR_DOMAIN_EVENT_STARTED: states.POWER_ON,
+        libvirt.VIR_DOMAIN_EVENT_SUSPENDED: states.POWER_ON,
+        libvirt.VIR_DOMAIN_EVENT_RESUMED: states.POWER_ON,
+        libvirt.VIR_DOMAIN_EVENT_PMSUSPENDED: states.POWER_ON,
+        libvirt.VIR_DOMAIN_EVENT_STOPPED: states.POWER_OFF,
+    }
+
+
+class _PowerStateCache(object):
+    """Power states of domains, kept up to date by lifecycle events.
+
+    The table is updated from the event loop thread, so only atomic
+    dictionary operations are used to access it. The callbacks run in that
+    native thread, they must not take green locks, which rules out logging.
+
+    Connections are watched by their key in the connection pool, as several
+    pooled connections with different credentials can share a URI. The
+    power states of a URI are kept while any of them is watched.
+    """
+
+    def __init__(self):
+        # (uri, domain uuid) -> (power state, timestamp)
+        self._states = {}
+        # connection pool key -> (connection, callback id)
+        self._watched = {}
+        self._events_map = _get_lifecycle_events_map()
+
+    def watch(self, key, conn):
+        """Register for lifecycle events of the domains of a connection.
+
+        :param key: the key of the connection in the connection pool, the
+            libvirt URI first.
+        :param conn: active libvirt connection.
+        """
+        try:
+            callback_id = conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                self._lifecycle_callback, key)
+            conn.registerCloseCallback(self._close_callback, key)
+        except libvirt.libvirtError as e:
+            LOG.warning(_LW("Unable to register for domain lifecycle events "
+                            "on %(uri)s, power states will be queried from "
+                            "the hypervisor: %(err)s"),
+                        {'uri': key[0], 'err': e})
+            return
+        self._watched[key] = (conn, callback_id)
+
+    def unwatch(self, conn):
+        """Stop tracking the domains of a connection.
+
+        :param conn: the libvirt connection being closed.
+        """
+        for key, (watched_conn, callback_id) in list(self._watched.items()):
+            if watched_conn is not conn:
+                continue
+            self._forget_key(key)
+            try:
+                conn.domainEventDeregisterAny(callback_id)
+                conn.unregisterCloseCallback()
+            except libvirt.libvirtError as e:
+                LOG.debug("Failed to deregister libvirt event callbacks for "
+                          "%(uri)s: %(err)s", {'uri': key[0], 'err': e})
+
+    def is_watched(self, uri):
+        """Check whether lifecycle events are received for the URI."""
+        if not any(key[0] == uri for key in list(self._watched)):
+            return False
+        return _EVENT_LOOP.is_alive()
+
+    def get(self, uri, uuid):
+        """Get the power state of a domain if it is recent enough.
+
+        :param uri: libvirt URI.
+        :param uuid: domain UUID.
+        :returns: power state or None if it is unknown or expired.
+        """
+        entry = self._states.get((uri, uuid))
+        if entry is None:
+            return None
+        pstate, timestamp = entry
+        if time.time() - timestamp > CONF.libvirt_driver.power_state_cache_ttl:
+            return None
+        return pstate
+
+    def record(self, uri, uuid, pstate):
+        """Record the power state of a domain."""
+        self._states[(uri, uuid)] = (pstate, time.time())
+
+    def forget(self, uri, uuid):
+        """Forget the power state of a domain."""
+        self._states.pop((uri, uuid), None)
+
+    def _forget_key(self, key):
+        self._watched.pop(key, None)
+        uri = key[0]
+        if any(other[0] == uri for other in list(self._watched)):
+            # Still kept up to date by another connection
+            return
+        for state_key in list(self._states):
+            if state_key[0] == uri:
+                self._states.pop(state_key, None)
+
+    def _lifecycle_callback(self, conn, domain, event, detail, key):
+        uri = key[0]
+        uuid = domain.UUIDString()
+        if event in (libvirt.VIR_DOMAIN_EVENT_DEFINED,
+                     libvirt.VIR_DOMAIN_EVENT_UNDEFINED):
+            # MAC addresses could have been changed
+            _DOMAIN_INDEX.invalidate(uri)
+
+        pstate = self._events_map.get(event)
+        if pstate is None:
+            self.forget(uri, uuid)
+        else:
+            self.record(uri, uuid, pstate)
+
+    def _close_callback(self, conn, reason, key):
+        watched = self._watched.get(key)
+        if watched is not None and watched[0] is conn:
+            self._forget_key(key)
+
+
+_POWER_STATE_CACHE = _PowerStateCache()
+
+
+def _lookup_domain_in_index(conn, index, node_macs):
+    """Look up the domain with any of the MACs using the index.
+
+    The MACs of the found domain are checked again, so that a stale index
+    entry is never returned.
+
+    :param conn: active libvirt connection.
+    :param index: a dict mapping normalized MACs to domain UUIDs.
+    :param node_macs: a set of normalized MACs of the node.
+    :returns: the libvirt domain object or None if not found.
+    :raises: libvirtError if failed to look up the domain.
+    """
+
+    uuids = {index[mac] for mac in node_macs if mac in index}
+    for uuid in uuids:
+        try:
+            domain = conn.lookupByUUIDString(uuid)
+            found_macs = _get_domain_macs(domain) & node_macs
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                continue
+            raise
+
+        if found_macs:
+            LOG.debug("Found MAC addresses: %(macs)s in domain %(domain)s",
+                      {'macs': found_macs, 'domain': uuid})
+            return domain
+
+
 def _get_domain_by_macs(task):
     """Get the domain the host uses to reference the node.
 
@@ -132,31 +663,33 @@ def _get_domain_by_macs(task):
     """
 
     driver_info = _parse_driver_info(task.node)
-    conn = _get_libvirt_connection(driver_info)
+    uri = driver_info['libvirt_uri']
     macs = driver_utils.get_node_mac_addresses(task)
     node_macs = {driver_utils.normalize_mac(mac)
                  for mac in macs}
 
-    full_node_list = conn.listAllDomains()
+    def _lookup(conn):
+        index = _DOMAIN_INDEX.get(uri)
+        if index is not None:
+            domain = _lookup_domain_in_index(conn, index, node_macs)
+            if domain is not None:
+                return domain
+            LOG.debug("Domain for node %s is not in the index, rebuilding "
+                      "the index for %s", driver_info['uuid'], uri)
+        index = _DOMAIN_INDEX.build(uri, conn.listAllDomains())
+        return _lookup_domain_in_index(conn, index, node_macs)
 
-    for domain in full_node_list:
-        LOG.debug("Checking Domain: %s's Mac address", domain.name())
-        parsed = ET.fromstring(domain.XMLDesc())
-        domain_macs = {driver_utils.normalize_mac(
-                       el.attrib['address']) for el in parsed.iter('mac')}
+    domain = _call_with_reconnect(driver_info, _lookup)
+    if domain is None:
+        raise ir_exc.NodeNotFound(
+            _("Can't find domain with specified MACs: %(macs)s "
+              "for node %(node)s") %
+            {'macs': node_macs, 'node': driver_info['uuid']})
 
-        found_macs = domain_macs & node_macs  # this is intersection of sets
-        if found_macs:
-            LOG.debug("Found MAC addresses: %s "
-                      "for node: %s", found_macs, driver_info['uuid'])
-            return domain
-
-    raise ir_exc.NodeNotFound(
-        _("Can't find domain with specified MACs: %(macs)s "
-          "for node %(node)s") %
-        {'macs': domain_macs, 'node': driver_info['uuid']})
+    return domain
 
 
+@utils.cache_driver_info()
 def _parse_driver_info(node):
     """Gets the information needed for accessing the node.
 
@@ -264,6 +797,22 @@ def _power_cycle(domain):
         raise ir_exc.PowerStateFailure(pstate=states.POWER_ON)
 
 
+def _get_domain_power_state(domain):
+    """Get the power state of a domain from whether it is active.
+
+    It matches the bulk queries, which tell the power states from the
+    listings of the active and inactive domains.
+
+    :param domain: libvirt domain object.
+    :returns: power state. One of :class:`ironic.common.states`.
+    :raises: libvirtError if failed to get the domain status.
+    """
+
+    if domain.isActive():
+        return states.POWER_ON
+    return states.POWER_OFF
+
+
 def _get_power_state(domain):
     """Get the current power state of domain.
 
@@ -273,13 +822,10 @@ def _get_power_state(domain):
     """
 
     try:
-        if domain.isActive():
-            return states.POWER_ON
+        return _get_domain_power_state(domain)
     except libvirt.libvirtError as e:
         raise isd_exc.LibvirtError(err=e)
 
-    return states.POWER_OFF
-
 
 def _get_boot_device(domain):
     """Get the current boot device.
@@ -321,6 +867,176 @@ def _set_boot_device(conn, domain, device):
         raise isd_exc.LibvirtError(err=e)
 
 
+def _forget_cached_power_state(task, domain):
+    """Make the next power state query of the node go to the hypervisor.
+
+    :param task: a TaskManager instance containing the node to act on.
+    :param domain: libvirt domain object.
+    """
+
+    if CONF.libvirt_driver.power_state_events:
+        uri = _parse_driver_info(task.node)['libvirt_uri']
+        _POWER_STATE_CACHE.forget(uri, domain.UUIDString())
+
+
+def _get_cached_power_state(task):
+    """Get the power state of the node tracked by lifecycle events.
+
+    :param task: a TaskManager instance containing the node to act on.
+    :returns: power state or None if it has to be queried from the
+        hypervisor.
+    :raises: InvalidParameterValue if any connection parameters are
+             incorrect.
+    """
+
+    uri = _parse_driver_info(task.node)['libvirt_uri']
+    index = _DOMAIN_INDEX.get(uri)
+    if index is None or not _POWER_STATE_CACHE.is_watched(uri):
+        return None
+
+    macs = driver_utils.get_node_mac_addresses(task)
+    uuids = {index.get(driver_utils.normalize_mac(mac)) for mac in macs}
+    uuids.discard(None)
+    if len(uuids) != 1:
+        return None
+    return _POWER_STATE_CACHE.get(uri, uuids.pop())
+
+
+def _get_macs(task_or_node, context):
+    """Get the normalized MACs and the node of a task or a node."""
+    if hasattr(task_or_node, 'node'):
+        node = task_or_node.node
+        macs = driver_utils.get_node_mac_addresses(task_or_node)
+    else:
+        node = task_or_node
+        macs = [port.address for port in
+                objects.Port.list_by_node_id(context, node.id)]
+    return node, {driver_utils.normalize_mac(mac) for mac in macs}
+
+
+def _resolve_domains(index, nodes_macs, domain_uuids):
+    """Find the single listed domain of each node in a domain index.
+
+    :param index: a dict mapping normalized MACs to domain UUIDs.
+    :param nodes_macs: a dict mapping node UUIDs to sets of normalized MACs.
+    :param domain_uuids: a set of the UUIDs of the listed domains.
+    :returns: a dict mapping node UUIDs to domain UUIDs, or to None if the
+        node has no or several listed domains.
+    """
+
+    resolved = {}
+    for node_uuid, macs in nodes_macs.items():
+        found = {index[mac] for mac in macs if mac in index} & domain_uuids
+        resolved[node_uuid] = found.pop() if len(found) == 1 else None
+    return resolved
+
+
+def _get_hypervisor_power_states(driver_info, nodes_macs):
+    """Get the power states of the nodes sharing a hypervisor.
+
+    The power states are given by the listings of the active and inactive
+    domains, which is what isActive() reports for a single node, so that no
+    call is made per domain. The domain index is only rebuilt when a node
+    can't be found in it.
+
+    :param driver_info: driver info to connect to the hypervisor.
+    :param nodes_macs: a dict mapping node UUIDs to sets of normalized MACs.
+    :returns: a dict mapping node UUIDs to power states.
+    :raises: LibvirtError if failed to list the domains.
+    """
+
+    uri = driver_info['libvirt_uri']
+
+    def _list(conn):
+        active = conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE)
+        inactive = conn.listAllDomains(
+            libvirt.VIR_CONNECT_LIST_DOMAINS_INACTIVE)
+        pstates = {}
+        for pstate, domains in ((states.POWER_ON, active),
+                                (states.POWER_OFF, inactive)):
+            for domain in domains:
+                pstates[domain.UUIDString()] = pstate
+
+        resolved = None
+        index = _DOMAIN_INDEX.get(uri)
+        if index is not None:
+            resolved = _resolve_domains(index, nodes_macs, set(pstates))
+        if resolved is None or None in resolved.values():
+            index = _DOMAIN_INDEX.build(uri, active + inactive)
+            resolved = _resolve_domains(index, nodes_macs, set(pstates))
+
+        result = {}
+        for node_uuid, domain_uuid in resolved.items():
+            if domain_uuid is None:
+                LOG.warning(_LW("Can't find a single domain with MACs "
+                                "%(macs)s for node %(node)s on %(uri)s"),
+                            {'macs': nodes_macs[node_uuid],
+                             'node': node_uuid, 'uri': uri})
+                result[node_uuid] = states.ERROR
+                continue
+            pstate = pstates[domain_uuid]
+            if CONF.libvirt_driver.power_state_events:
+                _POWER_STATE_CACHE.record(uri, domain_uuid, pstate)
+            result[node_uuid] = pstate
+        return result
+
+    return _call_with_reconnect(driver_info, _list)
+
+
+def get_power_states(tasks_or_nodes, context=None):
+    """Get the power states of many nodes at once.
+
+    Nodes are grouped by hypervisor, and the active and inactive domains of
+    each hypervisor are listed once, so that a power state sync needs two
+    listings per hypervisor instead of one lookup per node.
+
+    :param tasks_or_nodes: a list of TaskManager instances or Node objects.
+    :param context: the request context used to list the ports of the Node
+        objects. Required when Node objects are given.
+    :returns: a dict mapping node UUIDs to power states. The state is
+        ERROR for the nodes with invalid driver info, for the nodes without
+        a matching domain and for the nodes of unreachable hypervisors.
+    :raises: InvalidParameterValue if Node objects are given without a
+        context.
+    """
+
+    tasks_or_nodes = list(tasks_or_nodes)
+    if context is None and not all(hasattr(t, 'node')
+                                   for t in tasks_or_nodes):
+        raise ir_exc.InvalidParameterValue(
+            _("A context is required to get the power states of Node "
+              "objects"))
+
+    result = {}
+    # connection key -> (driver info, {node uuid: normalized MACs})
+    hypervisors = {}
+    for task_or_node in tasks_or_nodes:
+        node, macs = _get_macs(task_or_node, context)
+        try:
+            driver_info = _parse_driver_info(node)
+        except (ir_exc.InvalidParameterValue,
+                ir_exc.MissingParameterValue) as e:
+            LOG.warning(_LW("Can't get power state of node %(node)s: "
+                            "%(err)s"), {'node': node.uuid, 'err': e})
+            result[node.uuid] = states.ERROR
+            continue
+        key = _connection_key(driver_info)
+        hypervisors.setdefault(key, (driver_info, {}))[1][node.uuid] = macs
+
+    for driver_info, nodes_macs in hypervisors.values():
+        try:
+            result.update(_get_hypervisor_power_states(driver_info,
+                                                       nodes_macs))
+        except isd_exc.LibvirtError as e:
+            LOG.warning(_LW("Can't get power states of nodes %(nodes)s "
+                            "from %(uri)s: %(err)s"),
+                        {'nodes': ', '.join(nodes_macs),
+                         'uri': driver_info['libvirt_uri'], 'err': e})
+            result.update((uuid, states.ERROR) for uuid in nodes_macs)
+
+    return result
+
+
 class LibvirtPower(base.PowerInterface):
     """Libvirt Power Interface.
 
@@ -350,6 +1066,7 @@ class LibvirtPower(base.PowerInterface):
                 _("Node %s does not have any ports associated with it"
                   ) % task.node.uuid)
 
+    @_leases_connection
     def get_power_state(self, task):
         """Get the current power state of the task's node.
 
@@ -364,10 +1081,21 @@ class LibvirtPower(base.PowerInterface):
         :raises: LibvirtError if failed to connect to the Libvirt uri.
         """
 
+        events = CONF.libvirt_driver.power_state_events
+        if events:
+            pstate = _get_cached_power_state(task)
+            if pstate is not None:
+                return pstate
+
         domain = _get_domain_by_macs(task)
-        return _get_power_state(domain)
+        pstate = _get_power_state(domain)
+        if events:
+            uri = _parse_driver_info(task.node)['libvirt_uri']
+            _POWER_STATE_CACHE.record(uri, domain.UUIDString(), pstate)
+        return pstate
 
     @task_manager.require_exclusive_lock
+    @_leases_connection
     def set_power_state(self, task, pstate):
         """Turn the power on or off.
 
@@ -386,6 +1114,7 @@ class LibvirtPower(base.PowerInterface):
         """
 
         domain = _get_domain_by_macs(task)
+        _forget_cached_power_state(task, domain)
         if pstate == states.POWER_ON:
             state = _power_on(domain)
         elif pstate == states.POWER_OFF:
@@ -399,6 +1128,7 @@ class LibvirtPower(base.PowerInterface):
             raise ir_exc.PowerStateFailure(pstate=pstate)
 
     @task_manager.require_exclusive_lock
+    @_leases_connection
     def reboot(self, task):
         """Cycles the power to the task's node.
 
@@ -415,6 +1145,7 @@ class LibvirtPower(base.PowerInterface):
         """
 
         domain = _get_domain_by_macs(task)
+        _forget_cached_power_state(task, domain)
 
         _power_cycle(domain)
 
@@ -452,6 +1183,7 @@ class LibvirtManagement(base.ManagementInterface):
         return list(_BOOT_DEVICES_MAP.keys())
 
     @task_manager.require_exclusive_lock
+    @_leases_connection
     def set_boot_device(self, task, device, persistent=False):
         """Set the boot device for the task's node.
 
@@ -481,6 +1213,7 @@ class LibvirtManagement(base.ManagementInterface):
         boot_device_map = _BOOT_DEVICES_MAP
         _set_boot_device(conn, domain, boot_device_map[device])
 
+    @_leases_connection
     def get_boot_device(self, task):
         """Get the current boot device for the task's node.
 
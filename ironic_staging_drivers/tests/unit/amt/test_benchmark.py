@@ -0,0 +1,147 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Microbenchmarks of the cached AMT request body builders
+"""
+
+import timeit
+from xml.etree import ElementTree
+
+from ironic.common import boot_devices
+from ironic.common import states
+from ironic.tests import base
+import mock
+from testtools import content
+
+from ironic_staging_drivers.amt import common as amt_common
+from ironic_staging_drivers.amt import management as amt_mgmt
+from ironic_staging_drivers.amt import power as amt_power
+
+INVOCATIONS = 10000
+
+
+class RequestTemplateBenchmarkTestCase(base.TestCase):
+
+    def setUp(self):
+        super(RequestTemplateBenchmarkTestCase, self).setUp()
+        # A fresh pywsman mock, so that the shared one does not record the
+        # calls made here
+        self.pywsman = mock.MagicMock()
+        for module in (amt_power, amt_mgmt):
+            patcher = mock.patch.object(module, 'pywsman', self.pywsman)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _check_built_once(self, builder, args_list):
+        builder.cache_clear()
+        self.addCleanup(builder.cache_clear)
+
+        for i in range(INVOCATIONS):
+            args = args_list[i % len(args_list)]
+            self.assertIs(builder(*args), builder(*args))
+        self.assertEqual(len(args_list), self.pywsman.XmlDoc.call_count)
+
+    def test_power_action_input(self):
+        self._check_built_once(amt_power._generate_power_action_input,
+                               [(amt_power.AMT_POWER_MAP[state],)
+                                for state in (states.POWER_ON,
+                                              states.POWER_OFF)])
+
+    def test_change_boot_order_input(self):
+        self._check_built_once(amt_mgmt._generate_change_boot_order_input,
+                               [(amt_common.BOOT_DEVICES_MAPPING[device],)
+                                for device in (boot_devices.PXE,
+                                               boot_devices.DISK)])
+
+    def test_enable_boot_config_input(self):
+        self._check_built_once(amt_mgmt._generate_enable_boot_config_input,
+                               [()])
+
+
+class _XmlNode(object):
+    """A pywsman XmlNode stand-in building an ElementTree element."""
+
+    def __init__(self, element):
+        self.element = element
+
+    def set_ns(self, namespace):
+        self.element.set('xmlns', namespace)
+
+    def add(self, namespace, name, value):
+        child = ElementTree.SubElement(self.element,
+                                       '{%s}%s' % (namespace, name))
+        child.text = value
+        return _XmlNode(child)
+
+    def attr_add(self, namespace, name, value):
+        self.element.set('{%s}%s' % (namespace, name), value)
+
+
+class _XmlDoc(object):
+    """A pywsman XmlDoc stand-in which, unlike a mock, records nothing."""
+
+    def __init__(self, name):
+        self._root = _XmlNode(ElementTree.Element(name))
+
+    def root(self):
+        return self._root
+
+
+class _Pywsman(object):
+    XmlDoc = _XmlDoc
+
+
+class RequestTemplateTimingTestCase(base.TestCase):
+
+    def setUp(self):
+        super(RequestTemplateTimingTestCase, self).setUp()
+        for module in (amt_power, amt_mgmt):
+            patcher = mock.patch.object(module, 'pywsman', _Pywsman)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _time_builder(self, name, builder, args_list):
+        builder.cache_clear()
+        self.addCleanup(builder.cache_clear)
+
+        def run(func):
+            for i in range(INVOCATIONS):
+                func(*args_list[i % len(args_list)])
+
+        for label, func in (('uncached', builder.__wrapped__),
+                            ('cached', builder)):
+            elapsed = timeit.timeit(lambda: run(func), number=1)
+            self.addDetail('%s-%s' % (name, label),
+                           content.text_content(
+                               '%.3f ms for %d requests' % (
+                                   elapsed * 1e3, INVOCATIONS)))
+
+    def test_power_action_input(self):
+        self._time_builder('power_action_input',
+                           amt_power._generate_power_action_input,
+                           [(amt_power.AMT_POWER_MAP[state],)
+                            for state in (states.POWER_ON,
+                                          states.POWER_OFF)])
+
+    def test_change_boot_order_input(self):
+        self._time_builder('change_boot_order_input',
+                           amt_mgmt._generate_change_boot_order_input,
+                           [(amt_common.BOOT_DEVICES_MAPPING[device],)
+                            for device in (boot_devices.PXE,
+                                           boot_devices.DISK)])
+
+    def test_enable_boot_config_input(self):
+        self._time_builder('enable_boot_config_input',
+                           amt_mgmt._generate_enable_boot_config_input,
+                           [()])
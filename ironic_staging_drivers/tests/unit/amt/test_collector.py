@@ -0,0 +1,207 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Test class for the AMT power state collector
+"""
+
+import eventlet
+from ironic.common import exception as ironic_exception
+from ironic.common import states
+from ironic.tests.unit.db import base as db_base
+from ironic.tests.unit.objects import utils as obj_utils
+import mock
+from oslo_config import cfg
+from oslo_utils import uuidutils
+
+from ironic_staging_drivers.amt import collector
+from ironic_staging_drivers.amt import common as amt_common
+from ironic_staging_drivers.amt import resource_uris
+from ironic_staging_drivers.common import exception
+from ironic_staging_drivers.tests.unit.amt import pywsman_mocks_specs \
+    as mock_specs
+from ironic_staging_drivers.tests.unit.amt import utils as test_utils
+
+INFO_DICT = test_utils.get_test_amt_info()
+CONF = cfg.CONF
+
+
+def _execute(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+@mock.patch.object(collector.tpool, 'execute', side_effect=_execute)
+@mock.patch.object(amt_common, 'pywsman', spec_set=mock_specs.PYWSMAN_SPEC)
+class AMTCollectorGetPowerStateTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(AMTCollectorGetPowerStateTestCase, self).setUp()
+        amt_common._CLIENT_CACHE.clear()
+        amt_common.AMT_CIRCUIT_BREAKER.clear()
+        self.node = obj_utils.create_test_node(self.context,
+                                               driver='fake_amt_fake',
+                                               driver_info=INFO_DICT)
+
+    def test__get_power_state(self, mock_client_pywsman, mock_execute):
+        namespace = resource_uris.CIM_AssociatedPowerManagementService
+        result_xml = test_utils.build_soap_xml([{'PowerState': '8'}],
+                                               namespace)
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        mock_pywsman.get.return_value = test_utils.mock_wsman_root(
+            result_xml)
+
+        self.assertEqual(states.POWER_OFF,
+                         collector._get_power_state(self.node))
+        mock_execute.assert_called_once_with(mock_pywsman.get, mock.ANY,
+                                             namespace)
+
+    @mock.patch.object(amt_common, 'get_wsman_client', autospec=True)
+    def test__get_power_state_own_client(self, mock_get_client,
+                                         mock_client_pywsman, mock_execute):
+        CONF.set_override('collector_timeout', 5, 'amt_driver')
+        CONF.set_override('wsman_timeout', 60, 'amt_driver')
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        mock_pywsman.get.return_value = None
+
+        self.assertRaises(exception.AMTConnectFailure,
+                          collector._get_power_state, self.node)
+        # The transport gives up after the collector timeout, and the
+        # cached client of the node isn't used
+        transport = mock_pywsman.transport.return_value
+        transport.set_timeout.assert_called_once_with(5)
+        self.assertFalse(mock_get_client.called)
+
+    def test__get_power_state_no_response(self, mock_client_pywsman,
+                                          mock_execute):
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        mock_pywsman.get.return_value = None
+
+        self.assertRaises(exception.AMTConnectFailure,
+                          collector._get_power_state, self.node)
+
+    def test__get_power_state_timeout(self, mock_client_pywsman,
+                                      mock_execute):
+        CONF.set_override('collector_timeout', 1, 'amt_driver')
+        CONF.set_override('circuit_breaker_threshold', 1, 'amt_driver')
+        mock_execute.return_value = None
+
+        with mock.patch.object(collector, 'time', autospec=True) as mock_time:
+            mock_time.time.side_effect = [100, 101]
+            self.assertRaises(exception.AMTTimeout,
+                              collector._get_power_state, self.node)
+        self.assertRaises(exception.AMTConnectFailure,
+                          collector._get_power_state, self.node)
+        self.assertEqual(1, mock_execute.call_count)
+
+
+@mock.patch.object(collector, '_get_power_state', autospec=True)
+@mock.patch.object(amt_common, 'awake_amt_interfaces', autospec=True)
+class AMTCollectorTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(AMTCollectorTestCase, self).setUp()
+        self.nodes = []
+        for address in ('1.2.3.4', '1.2.3.5', '1.2.3.6'):
+            info = dict(INFO_DICT, amt_address=address)
+            self.nodes.append(obj_utils.create_test_node(
+                self.context, uuid=uuidutils.generate_uuid(),
+                driver='fake_amt_fake', driver_info=info))
+
+    def test_get_power_states(self, mock_awake, mock_gps):
+        mock_awake.return_value = []
+        error = exception.AMTFailure(cmd='wsman_get')
+        mock_gps.side_effect = [states.POWER_ON, states.POWER_OFF, error]
+
+        result = collector.get_power_states(self.nodes)
+
+        self.assertEqual({self.nodes[0].uuid: states.POWER_ON,
+                          self.nodes[1].uuid: states.POWER_OFF,
+                          self.nodes[2].uuid: error}, result)
+        mock_awake.assert_called_once_with(self.nodes)
+
+    def test_get_power_states_unexpected_error(self, mock_awake, mock_gps):
+        mock_awake.return_value = []
+        error = ValueError('malformed response')
+        mock_gps.side_effect = [states.POWER_ON, error, states.POWER_OFF]
+
+        result = collector.get_power_states(self.nodes)
+
+        self.assertEqual({self.nodes[0].uuid: states.POWER_ON,
+                          self.nodes[1].uuid: error,
+                          self.nodes[2].uuid: states.POWER_OFF}, result)
+
+    def test_get_power_states_asleep(self, mock_awake, mock_gps):
+        mock_awake.return_value = [self.nodes[1]]
+        mock_gps.return_value = states.POWER_ON
+
+        result = collector.get_power_states(self.nodes)
+
+        self.assertEqual(states.POWER_ON, result[self.nodes[0].uuid])
+        self.assertIsInstance(result[self.nodes[1].uuid],
+                              exception.AMTConnectFailure)
+        self.assertEqual(states.POWER_ON, result[self.nodes[2].uuid])
+        self.assertEqual(2, mock_gps.call_count)
+
+    def test_get_power_states_invalid_driver_info(self, mock_awake,
+                                                  mock_gps):
+        del self.nodes[0].driver_info['amt_password']
+        mock_awake.return_value = []
+        mock_gps.return_value = states.POWER_ON
+
+        result = collector.get_power_states(self.nodes)
+
+        self.assertIsInstance(result[self.nodes[0].uuid],
+                              ironic_exception.MissingParameterValue)
+        mock_awake.assert_called_once_with(self.nodes[1:])
+        self.assertEqual(2, mock_gps.call_count)
+
+    def test_get_power_states_bounded(self, mock_awake, mock_gps):
+        CONF.set_override('collector_workers', 2, 'amt_driver')
+        mock_awake.return_value = []
+        running = []
+        max_running = []
+
+        def _get_power_state(node):
+            running.append(node)
+            max_running.append(len(running))
+            eventlet.sleep(0)
+            running.remove(node)
+            return states.POWER_ON
+
+        mock_gps.side_effect = _get_power_state
+
+        result = collector.get_power_states(self.nodes)
+
+        self.assertEqual(3, len(result))
+        self.assertEqual(2, max(max_running))
+
+    @mock.patch.dict(collector.os.environ, {'EVENTLET_THREADPOOL_SIZE': '1'})
+    def test_get_power_states_bounded_by_tpool(self, mock_awake, mock_gps):
+        CONF.set_override('collector_workers', 2, 'amt_driver')
+        mock_awake.return_value = []
+        running = []
+        max_running = []
+
+        def _get_power_state(node):
+            running.append(node)
+            max_running.append(len(running))
+            eventlet.sleep(0)
+            running.remove(node)
+            return states.POWER_ON
+
+        mock_gps.side_effect = _get_power_state
+
+        result = collector.get_power_states(self.nodes)
+
+        self.assertEqual(3, len(result))
+        self.assertEqual(1, max(max_running))
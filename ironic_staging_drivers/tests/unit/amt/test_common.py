@@ -15,19 +15,23 @@
 Test class for AMT Common
 """
 
+import os
+import shutil
+import tempfile
+
 from ironic.common import exception as ironic_exception
-from ironic.common import utils
 from ironic.tests import base
 from ironic.tests.unit.db import base as db_base
 
 from ironic.tests.unit.objects import utils as obj_utils
 import mock
-from oslo_concurrency import processutils
 from oslo_config import cfg
+from oslo_utils import uuidutils
 import time
 
 from ironic_staging_drivers.amt import common as amt_common
 from ironic_staging_drivers.amt import resource_uris
+from ironic_staging_drivers.amt import wake
 from ironic_staging_drivers.common import exception
 from ironic_staging_drivers.tests.unit.amt import pywsman_mocks_specs \
     as mock_specs
@@ -41,6 +45,9 @@ class AMTCommonMethodsTestCase(db_base.DbTestCase):
 
     def setUp(self):
         super(AMTCommonMethodsTestCase, self).setUp()
+        amt_common.parse_driver_info.cache_clear()
+        amt_common._CLIENT_CACHE.clear()
+        amt_common.AMT_CIRCUIT_BREAKER.clear()
         self.node = obj_utils.create_test_node(self.context,
                                                driver='fake_amt_fake',
                                                driver_info=INFO_DICT)
@@ -76,6 +83,14 @@ class AMTCommonMethodsTestCase(db_base.DbTestCase):
         info = amt_common.parse_driver_info(self.node)
         self.assertEqual('http', info.get('protocol'))
 
+    def test_parse_driver_info_default_protocol_changed(self):
+        del self.node.driver_info['amt_protocol']
+        self.assertEqual('http',
+                         amt_common.parse_driver_info(self.node)['protocol'])
+        CONF.set_override('protocol', 'https', 'amt_driver')
+        self.assertEqual('https',
+                         amt_common.parse_driver_info(self.node)['protocol'])
+
     def test_parse_driver_info_wrong_protocol(self):
         self.node.driver_info['amt_protocol'] = 'fake-protocol'
         self.assertRaises(ironic_exception.InvalidParameterValue,
@@ -92,6 +107,56 @@ class AMTCommonMethodsTestCase(db_base.DbTestCase):
 
         mock_client.assert_called_once_with(**options)
 
+    @mock.patch.object(amt_common, 'Client', spec_set=True, autospec=True)
+    def test_get_wsman_client_cached(self, mock_client):
+        client = amt_common.get_wsman_client(self.node)
+        self.assertIs(client, amt_common.get_wsman_client(self.node))
+        self.assertEqual(1, mock_client.call_count)
+
+    @mock.patch.object(amt_common, 'Client', spec_set=True, autospec=True)
+    def test_get_wsman_client_credentials_changed(self, mock_client):
+        mock_client.side_effect = [mock.sentinel.client1,
+                                   mock.sentinel.client2]
+        self.assertIs(mock.sentinel.client1,
+                      amt_common.get_wsman_client(self.node))
+        self.node.driver_info['amt_password'] = 'new-password'
+        self.assertIs(mock.sentinel.client2,
+                      amt_common.get_wsman_client(self.node))
+        self.assertIs(mock.sentinel.client2,
+                      amt_common.get_wsman_client(self.node))
+
+    @mock.patch.object(time, 'time', autospec=True)
+    @mock.patch.object(amt_common, 'Client', spec_set=True, autospec=True)
+    def test_get_wsman_client_idle_expired(self, mock_client, mock_time):
+        CONF.set_override('client_cache_ttl', 10, 'amt_driver')
+        mock_client.side_effect = [mock.sentinel.client1,
+                                   mock.sentinel.client2]
+        mock_time.side_effect = [100, 105, 116]
+        self.assertIs(mock.sentinel.client1,
+                      amt_common.get_wsman_client(self.node))
+        self.assertIs(mock.sentinel.client1,
+                      amt_common.get_wsman_client(self.node))
+        self.assertIs(mock.sentinel.client2,
+                      amt_common.get_wsman_client(self.node))
+
+    @mock.patch.object(amt_common, 'Client', spec_set=True, autospec=True)
+    def test_get_wsman_client_cache_disabled(self, mock_client):
+        CONF.set_override('client_cache_ttl', 0, 'amt_driver')
+        amt_common.get_wsman_client(self.node)
+        amt_common.get_wsman_client(self.node)
+        self.assertEqual(2, mock_client.call_count)
+
+    @mock.patch.object(amt_common, 'pywsman',
+                       spec_set=mock_specs.PYWSMAN_SPEC)
+    def test_get_wsman_client_connect_failure(self, mock_client_pywsman):
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        mock_pywsman.get.return_value = None
+        client = amt_common.get_wsman_client(self.node)
+
+        self.assertRaises(exception.AMTConnectFailure,
+                          client.wsman_get, 'namespace')
+        self.assertIsNot(client, amt_common.get_wsman_client(self.node))
+
     def test_xml_find(self):
         namespace = 'http://fake'
         value = 'fake_value'
@@ -108,13 +173,97 @@ class AMTCommonMethodsTestCase(db_base.DbTestCase):
                           amt_common.xml_find,
                           mock_doc, 'namespace', 'test_element')
 
+    def test_xml_find_response(self):
+        namespace = 'http://fake'
+        test_xml = test_utils.build_soap_xml([{'test_element': 'value'}],
+                                             namespace)
+        mock_doc = test_utils.mock_wsman_root(test_xml)
+        response = amt_common.WSManResponse(mock_doc)
+
+        result = amt_common.xml_find(response, namespace, 'test_element')
+        self.assertEqual('value', result.text)
+        self.assertEqual(1, mock_doc.root.return_value.string.call_count)
+
+
+class RequestTemplateTestCase(base.TestCase):
+
+    def test_request_template(self):
+        builder = mock.Mock(side_effect=lambda *args: object())
+        cached = amt_common.request_template(builder)
+
+        doc = cached('2')
+        self.assertIs(doc, cached('2'))
+        self.assertIsNot(doc, cached('8'))
+        self.assertEqual([mock.call('2'), mock.call('8')],
+                         builder.call_args_list)
+
+        cached.cache_clear()
+        self.assertIsNot(doc, cached('2'))
+        self.assertEqual(3, builder.call_count)
+
+
+class WSManResponseTestCase(base.TestCase):
+
+    def test_find_parses_once(self):
+        namespace = resource_uris.CIM_AssociatedPowerManagementService
+        test_xml = test_utils.build_soap_xml(
+            [{'PowerState': '2'}, {'OtherElement': 'other'}], namespace)
+        mock_doc = test_utils.mock_wsman_root(test_xml)
+
+        response = amt_common.WSManResponse(mock_doc)
+        self.assertIs(mock_doc, response.doc)
+        self.assertEqual('2', response.find(namespace, 'PowerState').text)
+        self.assertEqual('other',
+                         response.find(namespace, 'OtherElement').text)
+        self.assertIsNone(response.find(amt_common._SOAP_ENVELOPE, 'Fault'))
+        self.assertIsNone(response.find('http://fake', 'PowerState'))
+        self.assertEqual(1, mock_doc.root.return_value.string.call_count)
+
+    def test_no_response(self):
+        self.assertRaises(exception.AMTConnectFailure,
+                          amt_common.WSManResponse, None)
+
 
 @mock.patch.object(amt_common, 'pywsman', spec_set=mock_specs.PYWSMAN_SPEC)
 class AMTCommonClientTestCase(base.TestCase):
     def setUp(self):
         super(AMTCommonClientTestCase, self).setUp()
+        amt_common.AMT_CIRCUIT_BREAKER.clear()
         self.info = {key[4:]: INFO_DICT[key] for key in INFO_DICT.keys()}
 
+    def test_client_timeout(self, mock_client_pywsman):
+        CONF.set_override('wsman_timeout', 20, 'amt_driver')
+        mock_transport = mock_client_pywsman.Client.return_value.transport
+        amt_common.Client(**self.info)
+        mock_transport.return_value.set_timeout.assert_called_once_with(20)
+
+    def test_client_timeout_disabled(self, mock_client_pywsman):
+        CONF.set_override('wsman_timeout', 0, 'amt_driver')
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        amt_common.Client(**self.info)
+        self.assertFalse(mock_pywsman.transport.called)
+
+    def test_wsman_get_circuit_open(self, mock_client_pywsman):
+        CONF.set_override('circuit_breaker_threshold', 2, 'amt_driver')
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        mock_pywsman.get.return_value = None
+        client = amt_common.Client(**self.info)
+
+        for i in range(3):
+            self.assertRaises(exception.AMTConnectFailure,
+                              client.wsman_get, 'namespace')
+        self.assertEqual(2, mock_pywsman.get.call_count)
+
+    def test_wsman_invoke_circuit_open(self, mock_client_pywsman):
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        client = amt_common.Client(**self.info)
+        with mock.patch.object(amt_common.AMT_CIRCUIT_BREAKER, 'is_open',
+                               autospec=True, return_value=True):
+            self.assertRaises(exception.AMTConnectFailure,
+                              client.wsman_invoke, mock.Mock(spec_set=[]),
+                              'namespace', 'method')
+        self.assertFalse(mock_pywsman.invoke.called)
+
     def test_wsman_get(self, mock_client_pywsman):
         namespace = resource_uris.CIM_AssociatedPowerManagementService
         result_xml = test_utils.build_soap_xml([{'PowerState':
@@ -125,8 +274,33 @@ class AMTCommonClientTestCase(base.TestCase):
         mock_pywsman.get.return_value = mock_doc
         client = amt_common.Client(**self.info)
 
-        client.wsman_get(namespace)
+        response = client.wsman_get(namespace)
         mock_pywsman.get.assert_called_once_with(mock.ANY, namespace)
+        self.assertEqual('2', response.find(namespace, 'PowerState').text)
+        self.assertEqual(1, mock_doc.root.return_value.string.call_count)
+
+    def test_wsman_enumerate(self, mock_client_pywsman):
+        namespace = resource_uris.CIM_OrderedComponent
+        result_xml = test_utils.build_soap_xml(
+            [{'CIM_OrderedComponent': {'AssignedSequence': '1'}},
+             {'CIM_OrderedComponent': {'AssignedSequence': '2'}}],
+            namespace)
+        mock_doc = test_utils.mock_wsman_root(result_xml)
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        mock_pywsman.enumerate.return_value = mock_doc
+        options = mock_client_pywsman.ClientOptions.return_value
+        client = amt_common.Client(**self.info)
+
+        response = client.wsman_enumerate(namespace)
+        mock_pywsman.enumerate.assert_called_once_with(options, None,
+                                                       namespace)
+        options.set_flags.assert_called_once_with(
+            mock_client_pywsman.FLAG_ENUMERATION_OPTIMIZATION)
+        options.set_max_elements.assert_called_once_with(
+            amt_common.ENUMERATION_MAX_ELEMENTS)
+        self.assertEqual(['1', '2'],
+                         [element.text for element in
+                          response.findall(namespace, 'AssignedSequence')])
 
     def test_wsman_get_fail(self, mock_client_pywsman):
         namespace = amt_common._SOAP_ENVELOPE
@@ -177,39 +351,183 @@ class AMTCommonClientTestCase(base.TestCase):
         mock_pywsman.invoke.assert_called_once_with(options, namespace, method)
 
 
+@mock.patch.object(time, 'time', autospec=True)
+class CircuitBreakerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CircuitBreakerTestCase, self).setUp()
+        CONF.set_override('circuit_breaker_threshold', 2, 'amt_driver')
+        CONF.set_override('circuit_breaker_cooldown', 60, 'amt_driver')
+        self.breaker = amt_common.CircuitBreaker()
+        self.endpoint = ('1.2.3.4', 16992)
+
+    def test_open(self, mock_time):
+        mock_time.return_value = 1000
+        self.breaker.record_failure(self.endpoint)
+        self.assertFalse(self.breaker.is_open(self.endpoint))
+        self.breaker.record_failure(self.endpoint)
+        self.assertTrue(self.breaker.is_open(self.endpoint))
+        self.assertFalse(self.breaker.is_open(('1.2.3.5', 16992)))
+        self.assertRaises(exception.AMTConnectFailure,
+                          self.breaker.check, self.endpoint)
+
+    def test_cooldown(self, mock_time):
+        mock_time.return_value = 1000
+        self.breaker.record_failure(self.endpoint)
+        self.breaker.record_failure(self.endpoint)
+        mock_time.return_value = 1061
+        self.assertFalse(self.breaker.is_open(self.endpoint))
+        # A single failure after the cool-down opens the breaker again
+        self.breaker.record_failure(self.endpoint)
+        self.assertTrue(self.breaker.is_open(self.endpoint))
+
+    def test_success(self, mock_time):
+        mock_time.return_value = 1000
+        self.breaker.record_failure(self.endpoint)
+        self.breaker.record_success(self.endpoint)
+        self.breaker.record_failure(self.endpoint)
+        self.assertFalse(self.breaker.is_open(self.endpoint))
+
+    def test_disabled(self, mock_time):
+        mock_time.return_value = 1000
+        CONF.set_override('circuit_breaker_threshold', 0, 'amt_driver')
+        for i in range(5):
+            self.breaker.record_failure(self.endpoint)
+        self.assertFalse(self.breaker.is_open(self.endpoint))
+        self.breaker.check(self.endpoint)
+
+
+class AwakeCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(AwakeCacheTestCase, self).setUp()
+        CONF.set_override('awake_interval', 60, 'amt_driver')
+        self.cache = amt_common.AwakeCache(size=2)
+        self.now = time.time()
+
+    def test_get_set(self):
+        self.assertEqual(0, self.cache.get('node1'))
+        self.cache.set('node1', self.now)
+        self.assertEqual(self.now, self.cache.get('node1'))
+
+    def test_get_expired(self):
+        self.cache.set('node1', self.now - 61)
+        self.assertEqual(0, self.cache.get('node1'))
+        self.assertNotIn('node1', self.cache._times)
+
+    def test_set_bounded(self):
+        self.cache.set('node1', self.now)
+        self.cache.set('node2', self.now)
+        self.cache.set('node1', self.now)
+        self.cache.set('node3', self.now)
+        self.assertEqual(['node1', 'node3'], list(self.cache._times))
+
+    def test_shared(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        cache_dir = os.path.join(tempdir, 'awake')
+        CONF.set_override('awake_cache_dir', cache_dir, 'amt_driver')
+        other_worker_cache = amt_common.AwakeCache()
+
+        self.cache.set('node1', int(self.now))
+
+        self.assertEqual(int(self.now),
+                         os.stat(os.path.join(cache_dir, 'node1')).st_mtime)
+        self.assertEqual(int(self.now), other_worker_cache.get('node1'))
+        self.assertEqual(0, other_worker_cache.get('node2'))
+
+    def test_shared_expired(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        CONF.set_override('awake_cache_dir', tempdir, 'amt_driver')
+        self.cache.set('node1', int(self.now) - 61)
+        self.cache.clear()
+
+        self.assertEqual(0, self.cache.get('node1'))
+        self.assertFalse(os.path.exists(os.path.join(tempdir, 'node1')))
+
+
 class AwakeAMTInterfaceTestCase(db_base.DbTestCase):
     def setUp(self):
         super(AwakeAMTInterfaceTestCase, self).setUp()
-        amt_common.AMT_AWAKE_CACHE = {}
+        amt_common.AMT_AWAKE_CACHE.clear()
+        amt_common.AMT_CIRCUIT_BREAKER.clear()
         self.info = INFO_DICT
         self.node = obj_utils.create_test_node(self.context,
                                                driver='fake_amt',
                                                driver_info=self.info)
 
-    @mock.patch.object(utils, 'execute', spec_set=True, autospec=True)
-    def test_awake_amt_interface(self, mock_ex):
+    @mock.patch.object(wake, 'wake_interfaces', spec_set=True, autospec=True)
+    def test_awake_amt_interface(self, mock_wake):
+        mock_wake.return_value = {'1.2.3.4'}
+        amt_common.awake_amt_interface(self.node)
+        mock_wake.assert_called_once_with({'1.2.3.4': 16992})
+        self.assertNotEqual(0, amt_common.AMT_AWAKE_CACHE.get(self.node.uuid))
+
+    @mock.patch.object(wake, 'wake_interfaces', spec_set=True, autospec=True)
+    def test_awake_amt_interface_https(self, mock_wake):
+        mock_wake.return_value = {'1.2.3.4'}
+        self.node.driver_info['amt_protocol'] = 'https'
         amt_common.awake_amt_interface(self.node)
-        expected_args = ['ping', '-i', 0.2, '-c', 5, '1.2.3.4']
-        mock_ex.assert_called_once_with(*expected_args)
+        mock_wake.assert_called_once_with({'1.2.3.4': 16993})
 
-    @mock.patch.object(utils, 'execute', spec_set=True, autospec=True)
-    def test_awake_amt_interface_fail(self, mock_ex):
-        mock_ex.side_effect = processutils.ProcessExecutionError('x')
+    @mock.patch.object(wake, 'wake_interfaces', spec_set=True, autospec=True)
+    def test_awake_amt_interface_fail(self, mock_wake):
+        mock_wake.return_value = set()
         self.assertRaises(exception.AMTConnectFailure,
                           amt_common.awake_amt_interface,
                           self.node)
+        self.assertEqual(0, amt_common.AMT_AWAKE_CACHE.get(self.node.uuid))
 
-    @mock.patch.object(utils, 'execute', spec_set=True, autospec=True)
-    def test_awake_amt_interface_in_cache_time(self, mock_ex):
-        amt_common.AMT_AWAKE_CACHE[self.node.uuid] = time.time()
+    @mock.patch.object(wake, 'wake_interfaces', spec_set=True, autospec=True)
+    def test_awake_amt_interface_in_cache_time(self, mock_wake):
+        amt_common.AMT_AWAKE_CACHE.set(self.node.uuid, time.time())
         amt_common.awake_amt_interface(self.node)
-        self.assertFalse(mock_ex.called)
+        self.assertFalse(mock_wake.called)
 
-    @mock.patch.object(utils, 'execute', spec_set=True, autospec=True)
-    def test_awake_amt_interface_disable(self, mock_ex):
+    @mock.patch.object(wake, 'wake_interfaces', spec_set=True, autospec=True)
+    def test_awake_amt_interface_disable(self, mock_wake):
         CONF.set_override('awake_interval', 0, 'amt_driver')
         amt_common.awake_amt_interface(self.node)
-        self.assertFalse(mock_ex.called)
+        self.assertFalse(mock_wake.called)
+
+    @mock.patch.object(wake, 'wake_interfaces', spec_set=True, autospec=True)
+    def test_awake_amt_interfaces(self, mock_wake):
+        info = dict(self.info, amt_address='1.2.3.5')
+        node2 = obj_utils.create_test_node(self.context,
+                                           uuid=uuidutils.generate_uuid(),
+                                           driver='fake_amt',
+                                           driver_info=info)
+        node3 = obj_utils.create_test_node(self.context,
+                                           uuid=uuidutils.generate_uuid(),
+                                           driver='fake_amt',
+                                           driver_info=self.info)
+        amt_common.AMT_AWAKE_CACHE.set(node3.uuid, time.time())
+        mock_wake.return_value = {'1.2.3.4'}
+
+        failed = amt_common.awake_amt_interfaces([self.node, node2, node3])
+
+        self.assertEqual([node2], failed)
+        mock_wake.assert_called_once_with({'1.2.3.4': 16992,
+                                           '1.2.3.5': 16992})
+
+    @mock.patch.object(wake, 'wake_interfaces', spec_set=True, autospec=True)
+    def test_awake_amt_interfaces_circuit_open(self, mock_wake):
+        CONF.set_override('circuit_breaker_threshold', 1, 'amt_driver')
+        info = dict(self.info, amt_address='1.2.3.5')
+        node2 = obj_utils.create_test_node(self.context,
+                                           uuid=uuidutils.generate_uuid(),
+                                           driver='fake_amt',
+                                           driver_info=info)
+        mock_wake.return_value = {'1.2.3.4'}
+
+        self.assertEqual([node2], amt_common.awake_amt_interfaces(
+            [self.node, node2]))
+        amt_common.AMT_AWAKE_CACHE.clear()
+        mock_wake.reset_mock()
+        self.assertEqual([node2], amt_common.awake_amt_interfaces(
+            [self.node, node2]))
+        mock_wake.assert_called_once_with({'1.2.3.4': 16992})
 
     def test_out_range_protocol(self):
         self.assertRaises(ValueError, cfg.CONF.set_override,
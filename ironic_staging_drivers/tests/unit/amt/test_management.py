@@ -36,11 +36,50 @@ INFO_DICT = test_utils.get_test_amt_info()
 CONF = cfg.CONF
 
 
+def _ordered_components_xml(sources):
+    """Build the enumeration response of the AMT boot order.
+
+    :param sources: a list of (boot source InstanceID, assigned sequence).
+    """
+    namespace = resource_uris.CIM_OrderedComponent
+    items = []
+    for source, sequence in sources:
+        items.append(
+            '<h:CIM_OrderedComponent xmlns:h="%(ns)s">'
+            '<h:AssignedSequence>%(sequence)s</h:AssignedSequence>'
+            '<h:GroupComponent>%(group)s</h:GroupComponent>'
+            '<h:PartComponent>%(part)s</h:PartComponent>'
+            '</h:CIM_OrderedComponent>' % {
+                'ns': namespace, 'sequence': sequence,
+                'group': _reference(resource_uris.CIM_BootConfigSetting,
+                                    amt_mgmt._BOOT_CONFIG_ID),
+                'part': _reference(resource_uris.CIM_BootSourceSetting,
+                                   source)})
+    return ('<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope">'
+            '<s:Body><n:EnumerateResponse xmlns:n="%s"><w:Items '
+            'xmlns:w="%s">%s</w:Items></n:EnumerateResponse></s:Body>'
+            '</s:Envelope>' % (
+                'http://schemas.xmlsoap.org/ws/2004/09/enumeration',
+                amt_mgmt._WSMAN, ''.join(items)))
+
+
+def _reference(resource_uri, instance_id):
+    return ('<a:ReferenceParameters xmlns:a="%(address)s">'
+            '<w:ResourceURI xmlns:w="%(wsman)s">%(uri)s</w:ResourceURI>'
+            '<w:SelectorSet xmlns:w="%(wsman)s">'
+            '<w:Selector Name="InstanceID">%(id)s</w:Selector>'
+            '</w:SelectorSet></a:ReferenceParameters>' % {
+                'address': amt_mgmt._ADDRESS, 'wsman': amt_mgmt._WSMAN,
+                'uri': resource_uri, 'id': instance_id})
+
+
 @mock.patch.object(amt_common, 'pywsman', spec_set=mock_specs.PYWSMAN_SPEC)
 class AMTManagementInteralMethodsTestCase(db_base.DbTestCase):
 
     def setUp(self):
         super(AMTManagementInteralMethodsTestCase, self).setUp()
+        amt_common._CLIENT_CACHE.clear()
+        amt_common.AMT_CIRCUIT_BREAKER.clear()
         mgr_utils.mock_the_extension_manager(driver='fake_amt_fake')
         self.node = obj_utils.create_test_node(self.context,
                                                driver='fake_amt_fake',
@@ -125,6 +164,35 @@ class AMTManagementInteralMethodsTestCase(db_base.DbTestCase):
         self.assertTrue(mock_aw.called)
 
 
+    @mock.patch.object(amt_common, 'awake_amt_interface', spec_set=True,
+                       autospec=True)
+    def test__get_next_boot_source(self, mock_aw, mock_client_pywsman):
+        namespace = resource_uris.CIM_OrderedComponent
+        pxe = amt_common.BOOT_DEVICES_MAPPING[boot_devices.PXE]
+        disk = amt_common.BOOT_DEVICES_MAPPING[boot_devices.DISK]
+        mock_xml = test_utils.mock_wsman_root(
+            _ordered_components_xml([(disk, '2'), (pxe, '1')]))
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        mock_pywsman.enumerate.return_value = mock_xml
+
+        self.assertEqual(pxe, amt_mgmt._get_next_boot_source(self.node))
+
+        mock_pywsman.enumerate.assert_called_once_with(mock.ANY, None,
+                                                       namespace)
+        self.assertTrue(mock_aw.called)
+
+    @mock.patch.object(amt_common, 'awake_amt_interface', spec_set=True,
+                       autospec=True)
+    def test__get_next_boot_source_empty(self, mock_aw, mock_client_pywsman):
+        pxe = amt_common.BOOT_DEVICES_MAPPING[boot_devices.PXE]
+        mock_xml = test_utils.mock_wsman_root(
+            _ordered_components_xml([(pxe, '0')]))
+        mock_pywsman = mock_client_pywsman.Client.return_value
+        mock_pywsman.enumerate.return_value = mock_xml
+
+        self.assertIsNone(amt_mgmt._get_next_boot_source(self.node))
+
+
 class AMTManagementTestCase(db_base.DbTestCase):
 
     def setUp(self):
@@ -230,6 +298,115 @@ class AMTManagementTestCase(db_base.DbTestCase):
             mock_sbdo.assert_called_once_with(task.node, device)
             mock_ebc.assert_called_once_with(task.node)
 
+    @mock.patch.object(amt_mgmt, '_get_next_boot_source', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_enable_boot_config', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_set_boot_device_order', spec_set=True,
+                       autospec=True)
+    def test_ensure_next_boot_device_recorded(self, mock_sbdo, mock_ebc,
+                                              mock_gnbs):
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            device = boot_devices.PXE
+            task.driver.management.ensure_next_boot_device(task.node, device)
+            mock_sbdo.assert_called_once_with(task.node, device)
+            mock_ebc.assert_called_once_with(task.node)
+            # Nothing was applied before, the boot order is not read
+            self.assertFalse(mock_gnbs.called)
+        self.node.refresh()
+        self.assertEqual(
+            device, self.node.driver_internal_info['amt_applied_boot_device'])
+
+    @mock.patch.object(amt_mgmt, '_get_next_boot_source', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_enable_boot_config', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_set_boot_device_order', spec_set=True,
+                       autospec=True)
+    def test_ensure_next_boot_device_pending(self, mock_sbdo, mock_ebc,
+                                             mock_gnbs):
+        device = boot_devices.PXE
+        mock_gnbs.return_value = amt_common.BOOT_DEVICES_MAPPING[device]
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            task.node.driver_internal_info['amt_applied_boot_device'] = device
+            task.driver.management.ensure_next_boot_device(task.node, device)
+            mock_gnbs.assert_called_once_with(task.node)
+            self.assertFalse(mock_sbdo.called)
+            self.assertFalse(mock_ebc.called)
+
+    @mock.patch.object(amt_mgmt, '_get_next_boot_source', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_enable_boot_config', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_set_boot_device_order', spec_set=True,
+                       autospec=True)
+    def test_ensure_next_boot_device_used_by_boot(self, mock_sbdo, mock_ebc,
+                                                  mock_gnbs):
+        # The boot order was emptied by the firmware when the node booted
+        mock_gnbs.return_value = None
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            device = boot_devices.PXE
+            task.node.driver_internal_info['amt_applied_boot_device'] = device
+            task.driver.management.ensure_next_boot_device(task.node, device)
+            mock_gnbs.assert_called_once_with(task.node)
+            mock_sbdo.assert_called_once_with(task.node, device)
+            mock_ebc.assert_called_once_with(task.node)
+
+    @mock.patch.object(amt_mgmt, '_get_next_boot_source', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_enable_boot_config', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_set_boot_device_order', spec_set=True,
+                       autospec=True)
+    def test_ensure_next_boot_device_other_device(self, mock_sbdo, mock_ebc,
+                                                  mock_gnbs):
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            device = boot_devices.DISK
+            task.node.driver_internal_info['amt_applied_boot_device'] = (
+                boot_devices.PXE)
+            task.driver.management.ensure_next_boot_device(task.node, device)
+            self.assertFalse(mock_gnbs.called)
+            mock_sbdo.assert_called_once_with(task.node, device)
+            mock_ebc.assert_called_once_with(task.node)
+            self.assertEqual(
+                device,
+                task.node.driver_internal_info['amt_applied_boot_device'])
+
+    @mock.patch.object(amt_mgmt, '_get_next_boot_source', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_enable_boot_config', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_set_boot_device_order', spec_set=True,
+                       autospec=True)
+    def test_ensure_next_boot_device_read_fail(self, mock_sbdo, mock_ebc,
+                                               mock_gnbs):
+        mock_gnbs.side_effect = exception.AMTFailure('x')
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            device = boot_devices.PXE
+            task.node.driver_internal_info['amt_applied_boot_device'] = device
+            task.driver.management.ensure_next_boot_device(task.node, device)
+            mock_sbdo.assert_called_once_with(task.node, device)
+            mock_ebc.assert_called_once_with(task.node)
+
+    @mock.patch.object(amt_mgmt, '_enable_boot_config', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt, '_set_boot_device_order', spec_set=True,
+                       autospec=True)
+    def test_ensure_next_boot_device_apply_fail(self, mock_sbdo, mock_ebc):
+        mock_ebc.side_effect = exception.AMTFailure('x')
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertRaises(exception.AMTFailure,
+                              task.driver.management.ensure_next_boot_device,
+                              task.node, boot_devices.PXE)
+            self.assertNotIn('amt_applied_boot_device',
+                             task.node.driver_internal_info)
+
     def test_get_boot_device(self):
         expected = {'boot_device': boot_devices.DISK, 'persistent': True}
         with task_manager.acquire(self.context, self.node.uuid,
@@ -15,6 +15,8 @@
 Test class for AMT ManagementInterface
 """
 
+import time
+
 from ironic.common import boot_devices
 from ironic.common import exception
 from ironic.common import states
@@ -24,6 +26,7 @@ from ironic.tests.unit.db import base as db_base
 from ironic.tests.unit.objects import utils as obj_utils
 import mock
 from oslo_config import cfg
+from oslo_service import loopingcall
 
 from ironic_staging_drivers.amt import common as amt_common
 from ironic_staging_drivers.amt import management as amt_mgmt
@@ -215,6 +218,143 @@ class AMTPowerInteralMethodsTestCase(db_base.DbTestCase):
             mock_ps.assert_called_with(task.node)
 
 
+class FakeDynamicLoopingCall(object):
+    """Runs the function in a loop, advancing a fake clock."""
+
+    def __init__(self, clock, f, *args, **kwargs):
+        self.clock = clock
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.intervals = []
+
+    def start(self, *args, **kwargs):
+        try:
+            while True:
+                interval = self.f(*self.args, **self.kwargs)
+                self.intervals.append(interval)
+                self.clock[0] += interval
+        except loopingcall.LoopingCallDone:
+            pass
+        return mock.Mock(spec_set=['wait'])
+
+
+@mock.patch.object(amt_power, '_power_status', spec_set=True, autospec=True)
+@mock.patch.object(amt_power, '_set_power_state', spec_set=True,
+                   autospec=True)
+class AMTPowerAdaptivePollingTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(AMTPowerAdaptivePollingTestCase, self).setUp()
+        mgr_utils.mock_the_extension_manager(driver='fake_amt_fake')
+        self.node = obj_utils.create_test_node(self.context,
+                                               driver='fake_amt_fake',
+                                               driver_info=INFO_DICT)
+        CONF.set_override('action_wait_min', 1, 'amt_driver')
+        self.clock = [1000.0]
+        time_patcher = mock.patch.object(time, 'time',
+                                         lambda: self.clock[0])
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        self.timers = []
+
+        def _fake_timer(f, *args, **kwargs):
+            timer = FakeDynamicLoopingCall(self.clock, f, *args, **kwargs)
+            self.timers.append(timer)
+            return timer
+
+        timer_patcher = mock.patch.object(loopingcall, 'DynamicLoopingCall',
+                                          _fake_timer)
+        timer_patcher.start()
+        self.addCleanup(timer_patcher.stop)
+
+    def test_backoff(self, mock_sps, mock_ps):
+        CONF.set_override('max_attempts', 3, 'amt_driver')
+        CONF.set_override('action_wait', 10, 'amt_driver')
+        mock_ps.side_effect = [states.POWER_OFF] * 3 + [states.POWER_ON]
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            self.assertEqual(states.POWER_ON,
+                             amt_power._set_and_wait(task, states.POWER_ON))
+        mock_sps.assert_called_once_with(task.node, states.POWER_ON)
+        self.assertEqual([1, 2, 4], self.timers[0].intervals)
+
+    def test_retry_after_action_wait(self, mock_sps, mock_ps):
+        CONF.set_override('max_attempts', 2, 'amt_driver')
+        CONF.set_override('action_wait', 4, 'amt_driver')
+        mock_ps.return_value = states.POWER_OFF
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            self.assertRaises(exception.PowerStateFailure,
+                              amt_power._set_and_wait, task, states.POWER_ON)
+        self.assertEqual(2, mock_sps.call_count)
+        # The last check of each attempt is done when it times out
+        self.assertEqual([1, 2, 1, 1, 2, 1], self.timers[0].intervals)
+        self.assertEqual(1008.0, self.clock[0])
+
+    def test_action_wait_min_not_zero(self, mock_sps, mock_ps):
+        # A zero interval would never grow, and poll AMT in a tight loop
+        self.assertRaises(ValueError, CONF.set_override, 'action_wait_min',
+                          0, 'amt_driver')
+
+    def test_reboot_power_cycle_stale_on(self, mock_sps, mock_ps):
+        CONF.set_override('reboot_method', 'power_cycle', 'amt_driver')
+        CONF.set_override('action_wait', 10, 'amt_driver')
+        # Still on right after the request, then off and on again
+        mock_ps.side_effect = [states.POWER_ON, states.POWER_ON,
+                               states.POWER_OFF, states.POWER_ON]
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            task.driver.power.reboot(task)
+        mock_sps.assert_called_once_with(task.node, states.REBOOT)
+        self.assertEqual(4, mock_ps.call_count)
+
+    def test_reboot_power_cycle_never_off(self, mock_sps, mock_ps):
+        CONF.set_override('reboot_method', 'power_cycle', 'amt_driver')
+        CONF.set_override('max_attempts', 2, 'amt_driver')
+        CONF.set_override('action_wait', 4, 'amt_driver')
+        # The power cycle request is accepted but the node is not reset
+        power = [states.POWER_ON]
+        mock_ps.side_effect = lambda node: power[0]
+
+        def _set_power_state(node, target_state):
+            if target_state != states.REBOOT:
+                power[0] = target_state
+
+        mock_sps.side_effect = _set_power_state
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            task.driver.power.reboot(task)
+        # Still on after max_attempts times action_wait, the node is
+        # powered off and on instead
+        self.assertEqual([2, 4, 2], self.timers[0].intervals)
+        self.assertEqual([mock.call(task.node, states.REBOOT),
+                          mock.call(task.node, states.POWER_OFF),
+                          mock.call(task.node, states.POWER_ON)],
+                         mock_sps.call_args_list)
+
+    @mock.patch.object(amt_power, '_ensure_boot_device', spec_set=True,
+                       autospec=True)
+    def test_reboot_power_cycle_not_on(self, mock_ebd, mock_sps, mock_ps):
+        CONF.set_override('reboot_method', 'power_cycle', 'amt_driver')
+        CONF.set_override('max_attempts', 2, 'amt_driver')
+        CONF.set_override('action_wait', 4, 'amt_driver')
+        power = [states.POWER_ON]
+        mock_ps.side_effect = lambda node: power[0]
+
+        def _set_power_state(node, target_state):
+            if target_state == states.REBOOT:
+                power[0] = states.POWER_OFF
+            else:
+                power[0] = target_state
+
+        mock_sps.side_effect = _set_power_state
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            task.driver.power.reboot(task)
+        # Falls back to powering the node on, with its boot device
+        self.assertEqual([mock.call(task.node, states.REBOOT),
+                          mock.call(task.node, states.POWER_ON)],
+                         mock_sps.call_args_list)
+        self.assertEqual([mock.call(task)] * 2, mock_ebd.call_args_list)
+        self.assertEqual(states.POWER_ON, power[0])
+
+
 class AMTPowerTestCase(db_base.DbTestCase):
 
     def setUp(self):
@@ -284,10 +424,91 @@ class AMTPowerTestCase(db_base.DbTestCase):
 
     @mock.patch.object(amt_power, '_set_and_wait', spec_set=True,
                        autospec=True)
-    def test_reboot(self, mock_saw):
+    def test_reboot_power_off_on(self, mock_saw):
         with task_manager.acquire(self.context, self.node.uuid,
                                   shared=False) as task:
             task.driver.power.reboot(task)
             calls = [mock.call(task, states.POWER_OFF),
                      mock.call(task, states.POWER_ON)]
             mock_saw.assert_has_calls(calls)
+
+    @mock.patch.object(amt_power, '_set_power_state', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_power_status', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_mgmt.AMTManagement, 'ensure_next_boot_device',
+                       spec_set=True, autospec=True)
+    @mock.patch.object(amt_power, '_wait_for_power_cycle', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_set_and_wait', spec_set=True,
+                       autospec=True)
+    def test_reboot_power_cycle(self, mock_saw, mock_wfpc, mock_enbd,
+                                mock_ps, mock_sps):
+        CONF.set_override('reboot_method', 'power_cycle', 'amt_driver')
+        mock_ps.return_value = states.POWER_ON
+        mock_wfpc.return_value = True
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            task.node.driver_internal_info['amt_boot_device'] = (
+                boot_devices.PXE)
+            task.driver.power.reboot(task)
+            mock_enbd.assert_called_once_with(task.driver.management,
+                                              task.node, boot_devices.PXE)
+            mock_sps.assert_called_once_with(task.node, states.REBOOT)
+            mock_wfpc.assert_called_once_with(task.node)
+            self.assertFalse(mock_saw.called)
+
+    @mock.patch.object(amt_power, '_set_power_state', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_power_status', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_wait_for_power_cycle', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_set_and_wait', spec_set=True,
+                       autospec=True)
+    def test_reboot_power_cycle_timeout(self, mock_saw, mock_wfpc, mock_ps,
+                                        mock_sps):
+        CONF.set_override('reboot_method', 'power_cycle', 'amt_driver')
+        mock_ps.return_value = states.POWER_ON
+        mock_wfpc.return_value = False
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            task.driver.power.reboot(task)
+            mock_sps.assert_called_once_with(task.node, states.REBOOT)
+            calls = [mock.call(task, states.POWER_OFF),
+                     mock.call(task, states.POWER_ON)]
+            self.assertEqual(calls, mock_saw.call_args_list)
+
+    @mock.patch.object(amt_power, '_set_power_state', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_power_status', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_set_and_wait', spec_set=True,
+                       autospec=True)
+    def test_reboot_power_cycle_rejected(self, mock_saw, mock_ps, mock_sps):
+        CONF.set_override('reboot_method', 'power_cycle', 'amt_driver')
+        mock_ps.return_value = states.POWER_ON
+        mock_sps.side_effect = exception.AMTFailure('x')
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            task.driver.power.reboot(task)
+            mock_sps.assert_called_once_with(task.node, states.REBOOT)
+            calls = [mock.call(task, states.POWER_OFF),
+                     mock.call(task, states.POWER_ON)]
+            self.assertEqual(calls, mock_saw.call_args_list)
+
+    @mock.patch.object(amt_power, '_set_power_state', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_power_status', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(amt_power, '_set_and_wait', spec_set=True,
+                       autospec=True)
+    def test_reboot_power_cycle_powered_off(self, mock_saw, mock_ps,
+                                            mock_sps):
+        CONF.set_override('reboot_method', 'power_cycle', 'amt_driver')
+        mock_ps.return_value = states.POWER_OFF
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            task.driver.power.reboot(task)
+            self.assertFalse(mock_sps.called)
+            mock_saw.assert_called_once_with(task, states.POWER_ON)
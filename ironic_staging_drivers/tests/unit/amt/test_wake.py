@@ -0,0 +1,242 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Test class for the AMT interfaces waking
+"""
+
+import collections
+import errno
+import socket
+import time
+
+from ironic.tests import base
+import mock
+
+from ironic_staging_drivers.amt import wake
+
+
+def _echo_reply(ident, seq, ip_header=b''):
+    packet = wake._echo_request(ident, seq)
+    packet = b'\x00' + packet[1:]
+    return ip_header + packet
+
+
+class _FakeSocket(object):
+    """A TCP socket whose connections stay in progress."""
+
+    def __init__(self, *args):
+        self.address = None
+
+    def setblocking(self, flag):
+        pass
+
+    def connect_ex(self, target):
+        self.address = target[0]
+        return errno.EINPROGRESS
+
+    def getsockopt(self, level, option):
+        return 0
+
+    def close(self):
+        pass
+
+
+class WakeICMPTestCase(base.TestCase):
+
+    def test__checksum(self):
+        # A packet including its checksum sums to zero
+        packet = wake._echo_request(0x1234, 3)
+        self.assertEqual(0, wake._checksum(packet))
+        self.assertEqual(0xffff, wake._checksum(b''))
+        self.assertEqual(0xfefe, wake._checksum(b'\x01\x01'))
+        self.assertEqual(0xfeff, wake._checksum(b'\x01'))
+
+    def test__echo_request(self):
+        packet = wake._echo_request(0x1234, 3)
+        self.assertEqual(b'\x08\x00', packet[:2])
+        self.assertEqual(b'\x12\x34\x00\x03', packet[4:8])
+        self.assertEqual(wake._ECHO_PAYLOAD, packet[8:])
+
+    def test__parse_echo_reply(self):
+        self.assertEqual(0x1234,
+                         wake._parse_echo_reply(_echo_reply(0x1234, 1),
+                                                False))
+
+    def test__parse_echo_reply_raw(self):
+        ip_header = b'\x45' + b'\x00' * 19
+        self.assertEqual(0x1234,
+                         wake._parse_echo_reply(
+                             _echo_reply(0x1234, 1, ip_header), True))
+
+    def test__parse_echo_reply_not_reply(self):
+        self.assertIsNone(
+            wake._parse_echo_reply(wake._echo_request(0x1234, 1), False))
+        self.assertIsNone(wake._parse_echo_reply(b'\x00\x00', False))
+        self.assertIsNone(wake._parse_echo_reply(b'', True))
+
+    @mock.patch.object(wake.select, 'select', autospec=True)
+    def test__icmp_wake(self, mock_select):
+        sock = mock.Mock(spec_set=['sendto', 'recvfrom'])
+        ident = 0x1234
+        mock_select.return_value = ([sock], [], [])
+        sock.recvfrom.side_effect = [
+            (_echo_reply(ident, 0), ('1.2.3.4', 0)),
+            socket.error(errno.EAGAIN, 'again'),
+        ]
+
+        with mock.patch.object(wake, '_idents', iter([ident])):
+            awake = wake._icmp_wake(sock, False, {'1.2.3.4'},
+                                    time.time() + 10)
+
+        self.assertEqual({'1.2.3.4'}, awake)
+        sock.sendto.assert_called_once_with(wake._echo_request(ident, 0),
+                                            ('1.2.3.4', 0))
+
+    @mock.patch.object(wake.select, 'select', autospec=True)
+    def test__icmp_wake_raw_other_ident(self, mock_select):
+        sock = mock.Mock(spec_set=['sendto', 'recvfrom'])
+        ip_header = b'\x45' + b'\x00' * 19
+        mock_select.return_value = ([sock], [], [])
+        sock.recvfrom.side_effect = [
+            (_echo_reply(0x4321, 0, ip_header), ('1.2.3.4', 0)),
+            socket.error(errno.EAGAIN, 'again'),
+            (_echo_reply(0x1234, 1, ip_header), ('1.2.3.4', 0)),
+            socket.error(errno.EAGAIN, 'again'),
+        ]
+
+        with mock.patch.object(wake, '_idents', iter([0x1234])):
+            awake = wake._icmp_wake(sock, True, {'1.2.3.4'},
+                                    time.time() + 10)
+
+        self.assertEqual({'1.2.3.4'}, awake)
+
+    @mock.patch.object(wake.select, 'select', autospec=True)
+    def test__icmp_wake_timeout(self, mock_select):
+        sock = mock.Mock(spec_set=['sendto', 'recvfrom'])
+        mock_select.return_value = ([], [], [])
+
+        awake = wake._icmp_wake(sock, False, {'1.2.3.4'}, time.time() - 1)
+
+        self.assertEqual(set(), awake)
+        self.assertFalse(sock.sendto.called)
+
+
+class WakeTCPTestCase(base.TestCase):
+
+    def test__tcp_wake_listening(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+
+        awake = wake._tcp_wake([('127.0.0.1', port)], 5)
+        self.assertEqual({'127.0.0.1'}, awake)
+
+    def test__tcp_wake_refused(self):
+        # A closed port still proves that the interface is awake
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        awake = wake._tcp_wake([('127.0.0.1', port)], 5)
+        self.assertEqual({'127.0.0.1'}, awake)
+
+    @mock.patch.object(wake.select, 'select', autospec=True)
+    @mock.patch.object(wake.socket, 'socket', autospec=True)
+    def test__tcp_wake_no_answer(self, mock_socket, mock_select):
+        sock = mock_socket.return_value
+        sock.connect_ex.return_value = errno.EINPROGRESS
+        mock_select.return_value = ([], [], [])
+
+        awake = wake._tcp_wake([('1.2.3.4', 16992)], 0)
+
+        self.assertEqual(set(), awake)
+        sock.close.assert_called_once_with()
+
+    @mock.patch.object(wake.time, 'time', autospec=True)
+    @mock.patch.object(wake.select, 'select', autospec=True)
+    @mock.patch.object(wake.socket, 'socket', autospec=True)
+    def test__tcp_wake_many_targets(self, mock_socket, mock_select,
+                                    mock_time):
+        # The first MAX_CONNECTIONS interfaces never answer, the others
+        # answer at once, and must not be timed out with the first ones
+        targets = [('10.0.%d.%d' % (i >> 8, i & 0xff), 16992)
+                   for i in range(wake.MAX_CONNECTIONS + 44)]
+        silent = set(address for address, port
+                     in targets[:wake.MAX_CONNECTIONS])
+        clock = [100.0]
+        mock_time.side_effect = lambda: clock[0]
+
+        def select(rlist, wlist, xlist, timeout):
+            self.assertLessEqual(len(wlist), wake.MAX_CONNECTIONS)
+            writable = [sock for sock in wlist if sock.address not in silent]
+            if not writable:
+                clock[0] += timeout
+            return [], writable, []
+
+        mock_socket.side_effect = _FakeSocket
+        mock_select.side_effect = select
+
+        awake = wake._tcp_wake(targets, 2)
+
+        self.assertEqual(set(address for address, port
+                             in targets[wake.MAX_CONNECTIONS:]), awake)
+        self.assertEqual(len(targets), mock_socket.call_count)
+
+
+@mock.patch.object(wake, '_tcp_wake', autospec=True)
+@mock.patch.object(wake, '_icmp_wake', autospec=True)
+@mock.patch.object(wake, '_open_icmp_socket', autospec=True)
+class WakeInterfacesTestCase(base.TestCase):
+
+    def test_wake_interfaces_icmp(self, mock_open, mock_icmp, mock_tcp):
+        sock = mock.Mock(spec_set=['close'])
+        mock_open.return_value = (sock, True)
+        mock_icmp.return_value = {'1.2.3.4'}
+
+        awake = wake.wake_interfaces({'1.2.3.4': 16992, '1.2.3.5': 16993})
+
+        self.assertEqual({'1.2.3.4'}, awake)
+        mock_icmp.assert_called_once_with(sock, True, {'1.2.3.4', '1.2.3.5'},
+                                          mock.ANY)
+        sock.close.assert_called_once_with()
+        self.assertFalse(mock_tcp.called)
+
+    def test_wake_interfaces_tcp(self, mock_open, mock_icmp, mock_tcp):
+        mock_open.return_value = (None, False)
+        mock_tcp.return_value = {'1.2.3.5'}
+
+        awake = wake.wake_interfaces({'1.2.3.5': 16993})
+
+        self.assertEqual({'1.2.3.5'}, awake)
+        mock_tcp.assert_called_once_with([('1.2.3.5', 16993)],
+                                         wake.WAKE_TIMEOUT)
+        self.assertFalse(mock_icmp.called)
+
+    @mock.patch.object(wake.socket, 'gethostbyname', autospec=True)
+    def test_wake_interfaces_host_names(self, mock_resolve, mock_open,
+                                        mock_icmp, mock_tcp):
+        mock_resolve.side_effect = [
+            '1.2.3.4', socket.gaierror(-2, 'Name or service not known')]
+        mock_open.return_value = (None, False)
+        mock_tcp.return_value = {'1.2.3.4'}
+
+        awake = wake.wake_interfaces(
+            collections.OrderedDict([('amt1', 16992), ('amt2', 16992)]))
+
+        self.assertEqual({'amt1'}, awake)
+        mock_tcp.assert_called_once_with([('1.2.3.4', 16992)],
+                                         wake.WAKE_TIMEOUT)
@@ -0,0 +1,95 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Test class for the common utilities
+"""
+
+from ironic.common import exception as ironic_exception
+from ironic.tests import base
+import mock
+
+from ironic_staging_drivers.common import utils
+
+
+class CacheDriverInfoTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CacheDriverInfoTestCase, self).setUp()
+        self.parser = mock.Mock(side_effect=lambda node: {
+            'address': node.driver_info['address']})
+        self.parse = utils.cache_driver_info(size=2)(self.parser)
+
+    def _node(self, uuid, address):
+        return mock.Mock(uuid=uuid, driver_info={'address': address})
+
+    def test_cached(self):
+        node = self._node('node1', '1.2.3.4')
+        self.assertEqual({'address': '1.2.3.4'}, self.parse(node))
+        self.assertEqual({'address': '1.2.3.4'}, self.parse(node))
+        self.assertEqual(1, self.parser.call_count)
+
+    def test_copies(self):
+        node = self._node('node1', '1.2.3.4')
+        self.parse(node)['address'] = 'changed'
+        self.assertEqual({'address': '1.2.3.4'}, self.parse(node))
+
+    def test_driver_info_changed(self):
+        node = self._node('node1', '1.2.3.4')
+        self.parse(node)
+        node.driver_info['address'] = '1.2.3.5'
+        self.assertEqual({'address': '1.2.3.5'}, self.parse(node))
+        self.assertEqual(2, self.parser.call_count)
+
+    def test_evicted(self):
+        node1 = self._node('node1', '1.2.3.4')
+        node2 = self._node('node2', '1.2.3.5')
+        node3 = self._node('node3', '1.2.3.6')
+        self.parse(node1)
+        self.parse(node2)
+        self.parse(node1)
+        self.parse(node3)
+        self.assertEqual(3, self.parser.call_count)
+        # node2 was the least recently used one
+        self.parse(node1)
+        self.assertEqual(3, self.parser.call_count)
+        self.parse(node2)
+        self.assertEqual(4, self.parser.call_count)
+
+    def test_errors_not_cached(self):
+        node = self._node('node1', '1.2.3.4')
+        self.parser.side_effect = [
+            ironic_exception.InvalidParameterValue('invalid'),
+            {'address': '1.2.3.4'}]
+        self.assertRaises(ironic_exception.InvalidParameterValue,
+                          self.parse, node)
+        self.assertEqual({'address': '1.2.3.4'}, self.parse(node))
+
+    def test_cache_clear(self):
+        node = self._node('node1', '1.2.3.4')
+        self.parse(node)
+        self.parse.cache_clear()
+        self.parse(node)
+        self.assertEqual(2, self.parser.call_count)
+
+    def test_defaults_changed(self):
+        defaults = {'protocol': 'http'}
+        parse = utils.cache_driver_info(defaults=lambda: defaults['protocol'])(
+            self.parser)
+        node = self._node('node1', '1.2.3.4')
+        parse(node)
+        parse(node)
+        self.assertEqual(1, self.parser.call_count)
+        defaults['protocol'] = 'https'
+        parse(node)
+        self.assertEqual(2, self.parser.call_count)
@@ -0,0 +1,301 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+A minimal IPMI v2.0 BMC, answering RMCP+ sessions on a local UDP port
+"""
+
+import hashlib
+import hmac
+import os
+import socket
+import struct
+import threading
+
+from oslo_utils import importutils
+
+ciphers = importutils.try_import('cryptography.hazmat.primitives.ciphers')
+backends = importutils.try_import('cryptography.hazmat.backends')
+
+RMCP_HEADER = b'\x06\x00\xff\x07'
+SESSION_HEADER = struct.Struct('<BBIIH')
+BMC_SESSION_ID = 0x0badcafe
+BMC_GUID = b'0123456789abcdef'
+
+# Completion codes
+CC_OK = 0x00
+CC_INVALID_COMMAND = 0xc1
+CC_NAK_ON_WRITE = 0x83
+CC_RESERVATION_CANCELLED = 0xc5
+CC_NOT_PRESENT = 0xcb
+
+
+def _checksum(data):
+    return -sum(bytearray(data)) & 0xff
+
+
+def _hmac(key, data, length=None):
+    digest = hmac.new(key, data, hashlib.sha1).digest()
+    return digest[:length] if length else digest
+
+
+def _aes(key, iv, data, encrypt):
+    cipher = ciphers.Cipher(ciphers.algorithms.AES(key), ciphers.modes.CBC(iv),
+                            backend=backends.default_backend())
+    context = cipher.encryptor() if encrypt else cipher.decryptor()
+    return context.update(data) + context.finalize()
+
+
+def _response(rq_addr, netfn, rs_addr, seq, cmd, code, data=b''):
+    header = bytearray([rq_addr, (netfn + 1) << 2])
+    header.append(_checksum(header))
+    body = bytearray([rs_addr, seq << 2, cmd, code]) + bytearray(data)
+    body.append(_checksum(body))
+    return bytes(header + body)
+
+
+def _parse_request(message):
+    message = bytearray(message)
+    assert _checksum(message[:2]) == message[2]
+    assert _checksum(message[3:-1]) == message[-1]
+    return (message[0], message[1] >> 2, message[3], message[4] >> 2,
+            message[5], bytes(message[6:-1]))
+
+
+class BMCSimulator(object):
+    """A BMC bridging requests to a Node Manager.
+
+    :param username: the name of the only user.
+    :param password: the password of the user.
+    :param responses: a dict mapping (netfn, cmd) tuples of the BMC commands
+        to their response data, or to a completion code for failures.
+    :param nm_responses: the same for the Node Manager commands.
+    :param nm_channel: the channel of the Node Manager.
+    :param nm_address: the slave address of the Node Manager.
+    :param sdr: a list of the SDR records, as bytes with their header.
+    """
+
+    def __init__(self, username, password, responses=None, nm_responses=None,
+                 nm_channel=0x06, nm_address=0x2c, sdr=None):
+        self.username = username.encode('utf-8')
+        self.kuid = password.encode('utf-8').ljust(20, b'\0')
+        self.responses = responses or {}
+        self.nm_responses = nm_responses or {}
+        self.nm_channel = nm_channel
+        self.nm_address = nm_address
+        self.sdr = sdr or []
+        # Changing it cancels the current SDR repository reservation
+        self.reservation = 0
+        # Number of incoming packets to ignore, to test retries
+        self.drop = 0
+        self.sessions_opened = 0
+        self.requests = []
+        self._session = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.settimeout(0.05)
+        self.port = self._sock.getsockname()[1]
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self._sock.close()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                packet, peer = self._sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            if self.drop:
+                self.drop -= 1
+                continue
+            for reply in self._handle(packet):
+                self._sock.sendto(reply, peer)
+
+    # Framing
+
+    def _pack(self, payload_type, payload):
+        session = self._session
+        if session is None or not session.get('established'):
+            return (RMCP_HEADER + SESSION_HEADER.pack(
+                0x06, payload_type, 0, 0, len(payload)) + payload)
+        integrity, confidentiality = session['algorithms'][1:]
+        if confidentiality:
+            payload_type |= 0x80
+            pad_length = (-len(payload) - 1) % 16
+            pad = bytearray(range(1, pad_length + 1))
+            pad.append(pad_length)
+            iv = os.urandom(16)
+            payload = iv + _aes(session['k2'][:16], iv, payload + bytes(pad),
+                                True)
+        if integrity:
+            payload_type |= 0x40
+        session['seq'] += 1
+        data = SESSION_HEADER.pack(0x06, payload_type, session['console_id'],
+                                   session['seq'], len(payload)) + payload
+        if integrity:
+            pad_length = (-len(data) - 2) % 4
+            data += b'\xff' * pad_length + struct.pack('BB', pad_length, 0x07)
+            data += _hmac(session['k1'], data, 12)
+        return RMCP_HEADER + data
+
+    def _unpack(self, packet):
+        assert packet[:4] == RMCP_HEADER
+        data = packet[4:]
+        auth_type, payload_type, session_id, seq, length = (
+            SESSION_HEADER.unpack(data[:SESSION_HEADER.size]))
+        payload = data[SESSION_HEADER.size:SESSION_HEADER.size + length]
+        if payload_type & 0x40:
+            signed, code = data[:-12], data[-12:]
+            assert _hmac(self._session['k1'], signed, 12) == code
+        if payload_type & 0x80:
+            payload = _aes(self._session['k2'][:16], payload[:16],
+                           payload[16:], False)
+            payload = payload[:-bytearray(payload[-1:])[0] - 1]
+        return payload_type & 0x3f, session_id, payload
+
+    # Session establishment
+
+    def _handle(self, packet):
+        payload_type, session_id, payload = self._unpack(packet)
+        if payload_type == 0x10:
+            return [self._open_session(payload)]
+        if payload_type == 0x12:
+            return [self._rakp2(payload)]
+        if payload_type == 0x14:
+            return [self._rakp4(payload)]
+        if payload_type == 0x00:
+            assert session_id == BMC_SESSION_ID
+            return self._ipmi(payload)
+        return []
+
+    def _open_session(self, request):
+        console_id = struct.unpack('<I', request[4:8])[0]
+        algorithms = (bytearray(request[12:13])[0],
+                      bytearray(request[20:21])[0],
+                      bytearray(request[28:29])[0])
+        self._session = {'console_id': console_id, 'algorithms': algorithms,
+                         'seq': 0}
+        self.sessions_opened += 1
+        return self._pack(0x11, b''.join([
+            request[:1], b'\x00\x04\x00',
+            struct.pack('<II', console_id, BMC_SESSION_ID), request[8:32]]))
+
+    def _rakp2(self, request):
+        session = self._session
+        session['console_random'] = request[8:24]
+        role = bytearray(request[24:25])[0]
+        length = bytearray(request[27:28])[0]
+        username = request[28:28 + length]
+        session['user'] = struct.pack('BB', role, length) + username
+        console_id = struct.pack('<I', session['console_id'])
+        if username != self.username:
+            return self._pack(0x13, b''.join([request[:1], b'\x0d\x00\x00',
+                                              console_id]))
+        session['bmc_random'] = os.urandom(16)
+        code = _hmac(self.kuid, b''.join([
+            console_id, struct.pack('<I', BMC_SESSION_ID),
+            session['console_random'], session['bmc_random'], BMC_GUID,
+            session['user']]))
+        return self._pack(0x13, b''.join([
+            request[:1], b'\x00\x00\x00', console_id, session['bmc_random'],
+            BMC_GUID, code]))
+
+    def _rakp4(self, request):
+        session = self._session
+        console_id = struct.pack('<I', session['console_id'])
+        expected = _hmac(self.kuid, b''.join([
+            session['bmc_random'], console_id, session['user']]))
+        if request[8:28] != expected:
+            return self._pack(0x15, b''.join([request[:1], b'\x0f\x00\x00',
+                                              console_id]))
+        sik = _hmac(self.kuid, b''.join([
+            session['console_random'], session['bmc_random'],
+            session['user']]))
+        icv = _hmac(sik, b''.join([session['console_random'],
+                                   struct.pack('<I', BMC_SESSION_ID),
+                                   BMC_GUID]), 12)
+        reply = self._pack(0x15, b''.join([request[:1], b'\x00\x00\x00',
+                                           console_id, icv]))
+        session['k1'] = _hmac(sik, b'\x01' * 20)
+        session['k2'] = _hmac(sik, b'\x02' * 20)
+        session['established'] = True
+        return reply
+
+    # IPMI messages
+
+    def _ipmi(self, message):
+        rs_addr, netfn, rq_addr, seq, cmd, data = _parse_request(message)
+        self.requests.append((netfn, cmd, data))
+        if (netfn, cmd) == (0x06, 0x3b):
+            return [self._pack(0x00, _response(rq_addr, netfn, rs_addr, seq,
+                                               cmd, CC_OK, data))]
+        if (netfn, cmd) == (0x06, 0x3c):
+            return [self._pack(0x00, _response(rq_addr, netfn, rs_addr, seq,
+                                               cmd, CC_OK))]
+        if (netfn, cmd) == (0x06, 0x34):
+            return self._send_message(rq_addr, rs_addr, seq, data)
+        if (netfn, cmd) == (0x0a, 0x22):
+            self.reservation += 1
+            return [self._pack(0x00, _response(
+                rq_addr, netfn, rs_addr, seq, cmd, CC_OK,
+                struct.pack('<H', self.reservation)))]
+        if (netfn, cmd) == (0x0a, 0x23):
+            code, data = self._get_sdr(data)
+            return [self._pack(0x00, _response(rq_addr, netfn, rs_addr, seq,
+                                               cmd, code, data))]
+        return [self._pack(0x00, self._answer(
+            self.responses, rq_addr, netfn, rs_addr, seq, cmd, data))]
+
+    def _get_sdr(self, data):
+        reservation, record_id, offset, length = struct.unpack('<HHBB', data)
+        if offset and reservation != self.reservation:
+            return CC_RESERVATION_CANCELLED, b''
+        ids = [struct.unpack('<H', record[:2])[0] for record in self.sdr]
+        if record_id == 0 and ids:
+            record_id = ids[0]
+        if record_id not in ids:
+            return CC_NOT_PRESENT, b''
+        index = ids.index(record_id)
+        next_id = ids[index + 1] if index + 1 < len(ids) else 0xffff
+        record = self.sdr[index][offset:offset + length]
+        return CC_OK, struct.pack('<H', next_id) + record
+
+    def _answer(self, responses, rq_addr, netfn, rs_addr, seq, cmd, data):
+        response = responses.get((netfn, cmd), CC_INVALID_COMMAND)
+        if isinstance(response, int):
+            return _response(rq_addr, netfn, rs_addr, seq, cmd, response)
+        return _response(rq_addr, netfn, rs_addr, seq, cmd, CC_OK, response)
+
+    def _send_message(self, rq_addr, rs_addr, seq, data):
+        channel = bytearray(data[:1])[0] & 0x0f
+        target, netfn, requester, inner_seq, cmd, inner_data = (
+            _parse_request(data[1:]))
+        if (channel, target) != (self.nm_channel, self.nm_address):
+            return [self._pack(0x00, _response(rq_addr, 0x06, rs_addr, seq,
+                                               0x34, CC_NAK_ON_WRITE))]
+        self.requests.append((netfn, cmd, inner_data))
+        # The Send Message command is acknowledged first, and the response of
+        # the Node Manager comes in a second message
+        ack = _response(rq_addr, 0x06, rs_addr, seq, 0x34, CC_OK)
+        embedded = self._answer(self.nm_responses, requester, netfn, target,
+                                inner_seq, cmd, inner_data)
+        bridged = _response(rq_addr, 0x06, rs_addr, seq, 0x34, CC_OK,
+                            embedded)
+        return [self._pack(0x00, ack), self._pack(0x00, bridged)]
@@ -0,0 +1,89 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Microbenchmarks of the Intel NM vendor methods parameters validation and
+of the vendor interface creation, with and without the shared validators
+"""
+
+import json
+import os
+import timeit
+
+from ironic.tests import base
+import jsonschema
+from testtools import content
+
+from ironic_staging_drivers.intel_nm import nm_vendor
+
+# (schema name, parameters) of a passthru call of each schema
+CALLS = [
+    ('main_ids_schema', {'domain_id': 'platform', 'policy_id': 111}),
+    ('policy_schema', {'domain_id': 'platform', 'enable': True,
+                       'policy_id': 111, 'policy_trigger': 'none',
+                       'action': 'alert', 'power_domain': 'primary',
+                       'target_limit': 100, 'correction_time': 200,
+                       'reporting_period': 600}),
+    ('suspend_schema', {'domain_id': 'platform', 'policy_id': 121,
+                        'periods': [{'start': 10, 'stop': 30,
+                                     'days': ['monday']}]}),
+    ('get_cap_schema', {'domain_id': 'platform', 'policy_trigger': 'none',
+                        'power_domain': 'primary'}),
+    ('control_schema', {'scope': 'global', 'enable': True}),
+    ('statistics_schema', {'scope': 'global', 'domain_id': 'platform',
+                           'parameter_name': 'response_time'}),
+]
+ROUNDS = 200
+
+
+def _legacy_load_schemas():
+    """Schemas loading done by each vendor interface before the cache."""
+    schemas = {}
+    schemas_dir = os.path.dirname(nm_vendor.__file__)
+    for schema in nm_vendor.SCHEMAS:
+        filename = os.path.join(schemas_dir, schema + '.json')
+        with open(filename, 'r') as sf:
+            schemas[schema] = json.load(sf)
+    return schemas
+
+
+class ValidationBenchmarkTestCase(base.TestCase):
+
+    def _time(self, name, func, unit):
+        elapsed = min(timeit.repeat(func, number=ROUNDS, repeat=3))
+        self.addDetail(name, content.text_content(
+            '%.3f us per %s' % (elapsed / ROUNDS * 1e6, unit)))
+
+    def test_validate(self):
+        schemas = _legacy_load_schemas()
+        validators = nm_vendor._get_validators()
+        for name, data in CALLS:
+            jsonschema.validate(data, schemas[name])
+            validators[name].validate(data)
+
+        def legacy():
+            for name, data in CALLS:
+                jsonschema.validate(data, schemas[name])
+
+        def cached():
+            for name, data in CALLS:
+                validators[name].validate(data)
+
+        unit = '%d calls' % len(CALLS)
+        self._time('legacy-validate', legacy, unit)
+        self._time('cached-validate', cached, unit)
+
+    def test_instantiate(self):
+        nm_vendor._get_validators()
+        self._time('legacy-init', _legacy_load_schemas, 'interface')
+        self._time('cached-init', nm_vendor.IntelNMVendorPassthru,
+                   'interface')
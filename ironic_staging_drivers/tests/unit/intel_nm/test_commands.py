@@ -14,6 +14,7 @@
 Tests for Intel NM policies commands
 """
 
+import os
 import tempfile
 
 from ironic.common import exception
@@ -300,6 +301,15 @@ class IntelNMPoliciesCommandTestCase(base.TestCase):
         result = commands.parse_statistics(raw_data)
         self.assertEqual(expected, result)
 
+    def test_parse_statistics_buffer(self):
+        raw_data = memoryview(bytearray([
+            0x57, 0x01, 0x00, 0x80, 0x00, 0x20, 0x00, 0xF0, 0x00, 0x60, 0x00,
+            0x00, 0x01, 0x20, 0x40, 0x01, 0x01, 0x00, 0x00, 0xF0]))
+        result = commands.parse_statistics(raw_data)
+        self.assertEqual(128, result['current_value'])
+        self.assertEqual(257, result['reporting_period'])
+        self.assertEqual('2004-02-03T20:13:52', result['timestamp'])
+
     def test_parse_statistics_invalid_timestamp(self):
         raw_data = ['0x00', '0x00', '0x00', '0x80', '0x00', '0x20', '0x00',
                     '0xF0', '0x00', '0x60', '0x00', '0xFF', '0xFF', '0xFF',
@@ -308,22 +318,97 @@ class IntelNMPoliciesCommandTestCase(base.TestCase):
         self.assertEqual(commands._INVALID_TIME, result['timestamp'])
 
 
+# Full sensor record of a temperature sensor
+_SDR_FULL_SENSOR = (
+    b'\x01\x00\x51\x01\x30'
+    b'\x20\x00\x01\x07\x01\x7f\x68\x01\x01\x00\x00\x00\x00\x00\x00'
+    b'\x80\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\xc8\x43\x50\x55\x20\x54'
+    b'\x65\x6d\x70')
+# Intel OEM record which is not an Intel NM discovery record
+_SDR_INTEL_OEM = b'\x02\x00\x51\xc0\x07\x57\x01\x00\x0c\x02\x00\x00'
+# Intel NM discovery record: NM at slave address 2Ch on channel 6
+_SDR_NM_DISCOVERY = (b'\x03\x00\x51\xc0\x0b\x57\x01\x00\x0d\x01\x2c'
+                     b'\x60\xb2\xb3\xb4\xb5')
+# Compact sensor record whose ID string contains the Intel NM discovery
+# record prefix
+_SDR_COMPACT_SENSOR = (b'\x04\x00\x51\x02\x0c\x20\x00\x02\x03\x01'
+                       b'\x57\x01\x00\x0d\x01\x6a\xb2')
+
+
 class ParsingFromFileTestCase(base.TestCase):
 
     def setUp(self):
         super(ParsingFromFileTestCase, self).setUp()
         self.temp_file = tempfile.NamedTemporaryFile().name
 
-    def test_parsing_found(self):
-        data = b'\x00\xFF\x00\xFF\x57\x01\x00\x0D\x01\x6A\xB2\x00\xFF'
+    def _write(self, data):
         with open(self.temp_file, 'wb') as f:
             f.write(data)
+        self.addCleanup(os.remove, self.temp_file)
+
+    def test_parsing_found(self):
+        self._write(_SDR_FULL_SENSOR + _SDR_INTEL_OEM + _SDR_NM_DISCOVERY)
         result = commands.parse_slave_and_channel(self.temp_file)
-        self.assertEqual(('0x6a', '0x0b'), result)
+        self.assertEqual(('0x2c', '0x06'), result)
 
     def test_parsing_not_found(self):
-        data = b'\x00\xFF\x00\xFF\x52\x01\x80\x0D\x01\x6A\xB7\x00\xFF'
-        with open(self.temp_file, 'wb') as f:
-            f.write(data)
+        self._write(_SDR_FULL_SENSOR + _SDR_INTEL_OEM)
         result = commands.parse_slave_and_channel(self.temp_file)
         self.assertIsNone(result)
+
+    def test_parsing_prefix_in_other_record(self):
+        self._write(_SDR_COMPACT_SENSOR + _SDR_FULL_SENSOR)
+        result = commands.parse_slave_and_channel(self.temp_file)
+        self.assertIsNone(result)
+
+    def test_parsing_empty_file(self):
+        self._write(b'')
+        result = commands.parse_slave_and_channel(self.temp_file)
+        self.assertIsNone(result)
+
+
+class ParsingFromBufferTestCase(base.TestCase):
+
+    def test_parsing_bytes(self):
+        data = _SDR_FULL_SENSOR + _SDR_NM_DISCOVERY
+        self.assertEqual(('0x2c', '0x06'),
+                         commands.parse_sdr_records(data))
+
+    def test_parsing_bytearray(self):
+        data = bytearray(_SDR_NM_DISCOVERY)
+        self.assertEqual(('0x2c', '0x06'),
+                         commands.parse_sdr_records(data))
+
+    def test_parsing_memoryview(self):
+        data = memoryview(_SDR_COMPACT_SENSOR + _SDR_NM_DISCOVERY)
+        self.assertEqual(('0x2c', '0x06'),
+                         commands.parse_sdr_records(data))
+
+    def test_parsing_first_record(self):
+        other = _SDR_NM_DISCOVERY.replace(b'\x2c\x60', b'\x2e\x70')
+        data = _SDR_NM_DISCOVERY + other
+        self.assertEqual(('0x2c', '0x06'),
+                         commands.parse_sdr_records(data))
+
+    def test_parsing_truncated(self):
+        data = _SDR_FULL_SENSOR + _SDR_NM_DISCOVERY[:-1]
+        self.assertIsNone(commands.parse_sdr_records(data))
+
+    def test_parse_sdr_record(self):
+        # A raw record is bytes, which is str on python 2, it must not be
+        # taken for a file path
+        self.assertEqual(('0x2c', '0x06'),
+                         commands.parse_sdr_record(_SDR_NM_DISCOVERY))
+
+    def test_parse_sdr_record_other(self):
+        for record in (_SDR_FULL_SENSOR, _SDR_INTEL_OEM, _SDR_COMPACT_SENSOR,
+                       _SDR_NM_DISCOVERY[:3]):
+            self.assertIsNone(commands.parse_sdr_record(record))
+
+    def test_iter_sdr_records(self):
+        data = _SDR_FULL_SENSOR + _SDR_INTEL_OEM + _SDR_NM_DISCOVERY
+        records = list(commands.iter_sdr_records(data))
+        self.assertEqual([0x01, 0xc0, 0xc0],
+                         [record_type for record_type, body in records])
+        self.assertEqual(_SDR_NM_DISCOVERY[5:], records[2][1])
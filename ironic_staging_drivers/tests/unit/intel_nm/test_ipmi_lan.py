@@ -0,0 +1,308 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Tests for the RMCP+ transport
+"""
+
+from ironic.common import exception
+from ironic.conductor import task_manager
+from ironic.drivers.modules import ipmitool
+from ironic.tests import base
+from ironic.tests.unit.conductor import mgr_utils
+from ironic.tests.unit.db import base as db_base
+from ironic.tests.unit.objects import utils as obj_utils
+import mock
+from oslo_config import cfg
+import testtools
+
+from ironic_staging_drivers.intel_nm import ipmi_lan
+from ironic_staging_drivers.intel_nm import nm_vendor
+from ironic_staging_drivers.tests.unit.intel_nm import bmc_simulator
+
+
+CONF = cfg.CONF
+
+_GET_DEVICE_ID = (0x06, 0x01)
+_GET_NM_VERSION = (0x2e, 0xca)
+
+_BMC_RESPONSES = {_GET_DEVICE_ID: b'\x20\x01\x02\x03'}
+_NM_RESPONSES = {_GET_NM_VERSION: b'\x57\x01\x00\x05\x03\x02\x04\x07\x00',
+                 (0x2e, 0xcb): 0xd5}
+
+
+class IPMIMessageTestCase(base.TestCase):
+
+    def test_build_ipmi_message(self):
+        self.assertEqual(b'\x20\x18\xc8\x81\x04\x01\x7a',
+                         ipmi_lan.build_ipmi_message(0x20, 0x06, 0x81, 1,
+                                                     0x01))
+
+    def test_parse_ipmi_response(self):
+        message = bmc_simulator._response(0x81, 0x06, 0x20, 1, 0x01, 0x00,
+                                          b'\x20\x01')
+        self.assertEqual((0x07, 1, 0x01, bytearray(b'\x00\x20\x01')),
+                         ipmi_lan.parse_ipmi_response(message))
+
+    def test_parse_ipmi_response_bad_checksum(self):
+        message = bytearray(bmc_simulator._response(0x81, 0x06, 0x20, 1,
+                                                    0x01, 0x00, b'\x20'))
+        message[-1] ^= 0xff
+        self.assertRaises(ipmi_lan._ProtocolError,
+                          ipmi_lan.parse_ipmi_response, bytes(message))
+
+    def test_parse_ipmi_response_too_short(self):
+        self.assertRaises(ipmi_lan._ProtocolError,
+                          ipmi_lan.parse_ipmi_response, b'\x81\x1c\x63')
+
+
+class LanSessionTestCase(base.TestCase):
+
+    cipher_suite = 2
+
+    def setUp(self):
+        super(LanSessionTestCase, self).setUp()
+        CONF.set_override('lan_timeout', 0.2, 'intel_nm_driver')
+        self.bmc = bmc_simulator.BMCSimulator('admin', 'secret',
+                                              _BMC_RESPONSES, _NM_RESPONSES)
+        self.bmc.start()
+        self.addCleanup(self.bmc.stop)
+        self.session = self._session()
+        self.addCleanup(self.session.close)
+
+    def _session(self, username='admin', password='secret'):
+        return ipmi_lan.LanSession('127.0.0.1', self.bmc.port, username,
+                                   password, 'ADMINISTRATOR',
+                                   self.cipher_suite)
+
+    def test_raw(self):
+        self.session.open()
+        self.assertTrue(self.session.active)
+        self.assertEqual(b'\x20\x01\x02\x03',
+                         self.session.raw(0x06, 0x01, b''))
+        self.assertIn((0x06, 0x3b, b'\x04'), self.bmc.requests)
+
+    def test_raw_bridged(self):
+        self.session.open()
+        self.assertEqual(_NM_RESPONSES[_GET_NM_VERSION],
+                         self.session.raw(0x2e, 0xca, b'\x57\x01\x00',
+                                          channel=0x06, target=0x2c))
+        self.assertIn((0x2e, 0xca, b'\x57\x01\x00'), self.bmc.requests)
+
+    def test_raw_completion_code(self):
+        self.session.open()
+        self.assertRaises(exception.IPMIFailure, self.session.raw,
+                          0x2e, 0xcb, b'\x57\x01\x00', channel=0x06,
+                          target=0x2c)
+
+    def test_raw_wrong_target(self):
+        self.session.open()
+        self.assertRaises(exception.IPMIFailure, self.session.raw,
+                          0x2e, 0xca, b'\x57\x01\x00', channel=0x06,
+                          target=0x2e)
+
+    def test_raw_retry(self):
+        self.session.open()
+        self.bmc.drop = 1
+        self.assertEqual(b'\x20\x01\x02\x03',
+                         self.session.raw(0x06, 0x01, b''))
+
+    def test_raw_no_answer(self):
+        CONF.set_override('lan_retries', 1, 'intel_nm_driver')
+        self.session.open()
+        self.bmc.drop = 2
+        self.assertRaises(exception.IPMIFailure, self.session.raw,
+                          0x06, 0x01, b'')
+
+    def test_open_wrong_password(self):
+        session = self._session(password='wrong')
+        self.assertRaises(exception.IPMIFailure, session.open)
+        self.assertFalse(session.active)
+
+    def test_open_unknown_user(self):
+        session = self._session(username='nobody')
+        self.assertRaises(exception.IPMIFailure, session.open)
+        self.assertFalse(session.active)
+
+    def test_close(self):
+        self.session.open()
+        self.session.close()
+        self.assertFalse(self.session.active)
+
+
+class LanSessionNoIntegrityTestCase(LanSessionTestCase):
+
+    cipher_suite = 1
+
+
+@testtools.skipUnless(ipmi_lan.ciphers, 'cryptography is not installed')
+class LanSessionEncryptedTestCase(LanSessionTestCase):
+
+    cipher_suite = 3
+
+
+class LanSessionNoCryptographyTestCase(base.TestCase):
+
+    @mock.patch.object(ipmi_lan, 'ciphers', None)
+    def test_open(self):
+        session = ipmi_lan.LanSession('127.0.0.1', 623, 'admin', 'secret',
+                                      'ADMINISTRATOR', 3)
+        self.assertRaises(exception.IPMIFailure, session.open)
+        self.assertFalse(session.active)
+
+
+class LanSessionPoolTestCase(base.TestCase):
+
+    def setUp(self):
+        super(LanSessionPoolTestCase, self).setUp()
+        CONF.set_override('lan_timeout', 0.2, 'intel_nm_driver')
+        CONF.set_override('lan_cipher_suite', 2, 'intel_nm_driver')
+        self.bmc = bmc_simulator.BMCSimulator('admin', 'secret',
+                                              _BMC_RESPONSES, _NM_RESPONSES)
+        self.bmc.start()
+        self.addCleanup(self.bmc.stop)
+        self.pool = ipmi_lan._LanSessionPool()
+        self.addCleanup(self.pool.close)
+        self.driver_info = {'address': '127.0.0.1', 'username': 'admin',
+                            'password': 'secret',
+                            'priv_level': 'ADMINISTRATOR',
+                            'protocol_version': '2.0',
+                            'dest_port': self.bmc.port,
+                            'local_address': None, 'transit_channel': None,
+                            'transit_address': None, 'target_channel': '0x06',
+                            'target_address': '0x2c'}
+
+    def test_execute_reuses_session(self):
+        for i in range(3):
+            self.assertEqual(_NM_RESPONSES[_GET_NM_VERSION],
+                             self.pool.execute(self.driver_info, 0x2e, 0xca,
+                                               b'\x57\x01\x00'))
+        self.assertEqual(1, self.bmc.sessions_opened)
+
+    def test_execute_not_bridged(self):
+        driver_info = dict(self.driver_info, target_channel=None,
+                           target_address=None)
+        self.assertEqual(b'\x20\x01\x02\x03',
+                         self.pool.execute(driver_info, 0x06, 0x01, b''))
+
+    def test_execute_failure_closes_session(self):
+        self.assertRaises(exception.IPMIFailure, self.pool.execute,
+                          self.driver_info, 0x2e, 0xcb, b'\x57\x01\x00')
+        self.pool.execute(self.driver_info, 0x2e, 0xca, b'\x57\x01\x00')
+        self.assertEqual(2, self.bmc.sessions_opened)
+
+    def test_execute_reopens_idle_session(self):
+        self.pool.execute(self.driver_info, 0x2e, 0xca, b'\x57\x01\x00')
+        idle = ipmi_lan.SESSION_IDLE_TIMEOUT + 1
+        for session in self.pool._sessions.values():
+            session.last_used -= idle
+        self.pool.execute(self.driver_info, 0x2e, 0xca, b'\x57\x01\x00')
+        self.assertEqual(2, self.bmc.sessions_opened)
+
+
+# A compact sensor record, and an Intel NM discovery record longer than an
+# SDR read chunk
+_SDR = [b'\x01\x00\x51\x02\x0c\x20\x00\x02\x03\x01\x00\x00\x00\x00'
+        b'\x00\x00\x00',
+        b'\x05\x00\x51\xc0\x14\x57\x01\x00\x0d\x01\x2c\x60\xb2\xb3'
+        b'\xb4\xb5\x00\x00\x00\x00\x00\x00\x00\x00\x00',
+        b'\x09\x00\x51\x12\x00']
+
+
+@mock.patch.object(ipmitool, '_parse_driver_info', spec_set=True,
+                   autospec=True)
+class IterSDRTestCase(base.TestCase):
+
+    def setUp(self):
+        super(IterSDRTestCase, self).setUp()
+        CONF.set_override('lan_timeout', 0.2, 'intel_nm_driver')
+        CONF.set_override('lan_cipher_suite', 2, 'intel_nm_driver')
+        self.bmc = bmc_simulator.BMCSimulator('admin', 'secret', sdr=_SDR)
+        self.bmc.start()
+        self.addCleanup(self.bmc.stop)
+        self.addCleanup(ipmi_lan._SESSIONS.close)
+        self.task = mock.Mock(spec=['node'])
+        self.driver_info = {'address': '127.0.0.1', 'username': 'admin',
+                            'password': 'secret',
+                            'priv_level': 'ADMINISTRATOR',
+                            'protocol_version': '2.0',
+                            'dest_port': self.bmc.port,
+                            'local_address': None, 'transit_channel': None,
+                            'transit_address': None, 'target_channel': '0x06',
+                            'target_address': '0x2c'}
+
+    def test_iter_sdr(self, parse_mock):
+        parse_mock.return_value = self.driver_info
+        self.assertEqual(_SDR, list(ipmi_lan.iter_sdr(self.task)))
+        parse_mock.assert_called_once_with(self.task.node)
+        # Not bridged to the Node Manager
+        self.assertNotIn((0x06, 0x34), [request[:2]
+                                        for request in self.bmc.requests])
+
+    def test_iter_sdr_stop(self, parse_mock):
+        parse_mock.return_value = self.driver_info
+        records = ipmi_lan.iter_sdr(self.task)
+        self.assertEqual(_SDR[0], next(records))
+        records.close()
+        get_sdr = [request for request in self.bmc.requests
+                   if request[:2] == (0x0a, 0x23)]
+        self.assertEqual(2, len(get_sdr))
+
+    def test_iter_sdr_reservation_cancelled(self, parse_mock):
+        parse_mock.return_value = self.driver_info
+        records = ipmi_lan.iter_sdr(self.task)
+        self.assertEqual(_SDR[0], next(records))
+        self.bmc.reservation += 1
+        self.assertEqual(_SDR[1:], list(records))
+        reserve = [request for request in self.bmc.requests
+                   if request[:2] == (0x0a, 0x22)]
+        self.assertEqual(2, len(reserve))
+
+    def test_iter_sdr_empty(self, parse_mock):
+        parse_mock.return_value = self.driver_info
+        self.bmc.sdr = []
+        self.assertRaises(exception.IPMIFailure, list,
+                          ipmi_lan.iter_sdr(self.task))
+
+
+class LanTransportTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(LanTransportTestCase, self).setUp()
+        mgr_utils.mock_the_extension_manager(driver='fake_nm')
+        self.node = obj_utils.create_test_node(self.context, driver='fake_nm')
+
+    @mock.patch.object(ipmi_lan._SESSIONS, 'execute', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(ipmitool, '_parse_driver_info', spec_set=True,
+                       autospec=True)
+    def test_send_raw(self, parse_mock, execute_mock):
+        execute_mock.return_value = b'\x57\x01\x00'
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            self.assertEqual(b'\x57\x01\x00',
+                             ipmi_lan.send_raw(task, '0x2e 0xca 0x57 0x01 '
+                                                     '0x00'))
+            parse_mock.assert_called_once_with(task.node)
+        execute_mock.assert_called_once_with(parse_mock.return_value, 0x2e,
+                                             0xca, b'\x57\x01\x00')
+
+    @mock.patch.object(ipmitool, 'send_raw', spec_set=True, autospec=True)
+    @mock.patch.object(ipmi_lan, 'send_raw', spec_set=True, autospec=True)
+    def test__send_raw_lan(self, lan_mock, ipmitool_mock):
+        CONF.set_override('transport', 'lan', 'intel_nm_driver')
+        lan_mock.return_value = b'\x57\x01\x00'
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            out = nm_vendor._send_raw(task, '0x2e 0xca')
+            lan_mock.assert_called_once_with(task, '0x2e 0xca')
+        self.assertIsInstance(out, memoryview)
+        self.assertEqual(b'\x57\x01\x00', out.tobytes())
+        self.assertFalse(ipmitool_mock.called)
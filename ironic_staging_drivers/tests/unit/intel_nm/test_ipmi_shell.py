@@ -0,0 +1,256 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Tests for the ipmitool shell sessions
+"""
+
+import hashlib
+import sys
+import threading
+import time
+
+from ironic.common import exception
+from ironic.conductor import task_manager
+from ironic.drivers.modules import ipmitool
+from ironic.tests import base
+from ironic.tests.unit.conductor import mgr_utils
+from ironic.tests.unit.db import base as db_base
+from ironic.tests.unit.objects import utils as obj_utils
+import mock
+from oslo_config import cfg
+
+from ironic_staging_drivers.intel_nm import ipmi_shell
+from ironic_staging_drivers.intel_nm import nm_vendor
+
+
+CONF = cfg.CONF
+
+# Mimics "ipmitool shell": prints a prompt before reading each command,
+# answers raw commands with "57 01 00", fails "raw 0x2e 0xff" and hangs on
+# "raw 0x2e 0xfe"
+_FAKE_SHELL = r'''
+import sys
+import time
+while True:
+    sys.stdout.write('ipmitool> ')
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        break
+    args = line.split()
+    if args[0] == 'echo':
+        sys.stdout.write(' '.join(args[1:]) + '\n')
+    elif args[1:] == ['0x2e', '0xff']:
+        sys.stderr.write('Unable to send RAW command: Invalid command\n')
+        sys.stderr.flush()
+    elif args[1:] == ['0x2e', '0xfe']:
+        time.sleep(60)
+    else:
+        sys.stdout.write(' 57 01 00\n')
+'''
+
+_DRIVER_INFO = {'address': '1.2.3.4', 'username': 'admin',
+                'password': 'secret', 'priv_level': 'ADMINISTRATOR',
+                'protocol_version': '2.0', 'dest_port': None,
+                'local_address': None, 'transit_channel': None,
+                'transit_address': None, 'target_channel': '0x06',
+                'target_address': '0x2c'}
+
+
+class ShellSessionTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ShellSessionTestCase, self).setUp()
+        self.session = ipmi_shell._ShellSession(
+            [sys.executable, '-c', _FAKE_SHELL], 'secret')
+        self.addCleanup(self.session.close)
+
+    def test_execute(self):
+        self.assertEqual('57 01 00',
+                         self.session.execute('0x2e 0xca 0x57 0x01 0x00', 5))
+        # The session is reused for the next commands
+        self.assertEqual('57 01 00',
+                         self.session.execute('0x2e 0xcb 0x57 0x01 0x00', 5))
+        self.assertTrue(self.session.alive)
+
+    def test_execute_error(self):
+        self.assertRaises(exception.IPMIFailure,
+                          self.session.execute, '0x2e 0xff', 5)
+
+    def test_execute_timeout(self):
+        self.assertRaises(exception.IPMIFailure,
+                          self.session.execute, '0x2e 0xfe', 1)
+
+    def test_execute_exited(self):
+        self.session.close()
+        self.assertFalse(self.session.alive)
+        self.assertRaises(exception.IPMIFailure,
+                          self.session.execute, '0x2e 0xca', 5)
+
+
+@mock.patch.object(ipmi_shell, '_shell_args', autospec=True)
+@mock.patch.object(ipmitool, '_parse_driver_info', autospec=True)
+class ShellBatchTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ShellBatchTestCase, self).setUp()
+        self.task = mock.Mock(spec=['node'])
+
+    def test_send_raw_batch(self, parse_mock, args_mock):
+        parse_mock.return_value = _DRIVER_INFO
+        args_mock.return_value = [sys.executable, '-c', _FAKE_SHELL]
+        self.assertEqual(['57 01 00', '57 01 00'],
+                         ipmi_shell.send_raw_batch(
+                             self.task, ['0x2e 0xc8 0x57 0x01 0x00',
+                                         '0x2e 0xc8 0x57 0x01 0x00']))
+        parse_mock.assert_called_once_with(self.task.node)
+        args_mock.assert_called_once_with(_DRIVER_INFO)
+
+    def test_send_raw_batch_error(self, parse_mock, args_mock):
+        parse_mock.return_value = _DRIVER_INFO
+        args_mock.return_value = [sys.executable, '-c', _FAKE_SHELL]
+        self.assertRaises(exception.IPMIFailure, ipmi_shell.send_raw_batch,
+                          self.task, ['0x2e 0xc8 0x57 0x01 0x00',
+                                      '0x2e 0xff'])
+
+
+@mock.patch.object(ipmi_shell, '_ShellSession', autospec=True)
+class ShellSessionPoolTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ShellSessionPoolTestCase, self).setUp()
+        self.pool = ipmi_shell._ShellSessionPool()
+
+    def _mock_session(self, mock_session, last_used=None):
+        session = mock_session.return_value
+        session.lock = threading.Lock()
+        session.last_used = time.time() if last_used is None else last_used
+        return session
+
+    def test__shell_args(self, mock_session):
+        self.assertEqual(['ipmitool', '-I', 'lanplus', '-H', '1.2.3.4',
+                          '-L', 'ADMINISTRATOR', '-U', 'admin',
+                          '-b', '0x06', '-t', '0x2c', '-E', 'shell'],
+                         ipmi_shell._shell_args(_DRIVER_INFO))
+
+    def test_execute_reuses_session(self, mock_session):
+        session = self._mock_session(mock_session, last_used=0)
+        session.execute.return_value = '57 01 00'
+
+        with mock.patch.object(ipmi_shell.time, 'time', return_value=0):
+            self.assertEqual('57 01 00',
+                             self.pool.execute(_DRIVER_INFO, '0x2e 0xca'))
+            self.pool.execute(_DRIVER_INFO, '0x2e 0xca')
+
+        mock_session.assert_called_once_with(
+            ipmi_shell._shell_args(_DRIVER_INFO), 'secret')
+        session.execute.assert_called_with(
+            '0x2e 0xca', CONF.intel_nm_driver.shell_command_timeout)
+
+    def test_execute_other_bmc(self, mock_session):
+        self._mock_session(mock_session)
+        self.pool.execute(_DRIVER_INFO, '0x2e 0xca')
+        self.pool.execute(dict(_DRIVER_INFO, address='1.2.3.5'), '0x2e 0xca')
+        self.assertEqual(2, mock_session.call_count)
+
+    def test_execute_failure_discards_session(self, mock_session):
+        session = self._mock_session(mock_session)
+        session.execute.side_effect = exception.IPMIFailure(cmd='raw')
+
+        self.assertRaises(exception.IPMIFailure,
+                          self.pool.execute, _DRIVER_INFO, '0x2e 0xca')
+
+        session.close.assert_called_once_with()
+        self.pool.execute(_DRIVER_INFO, '0x2e 0xca')
+        self.assertEqual(2, mock_session.call_count)
+
+    def _reused_session(self):
+        key = (tuple(ipmi_shell._shell_args(_DRIVER_INFO)),
+               hashlib.sha256(b'secret').hexdigest())
+        session = mock.Mock(last_used=time.time(), lock=threading.Lock())
+        session.execute.side_effect = exception.IPMIFailure(cmd='raw')
+        self.pool._sessions = {key: session}
+        return key, session
+
+    def test_execute_failure_reused_session(self, mock_session):
+        key, expired = self._reused_session()
+        new = self._mock_session(mock_session)
+        new.execute.return_value = '57 01 00'
+
+        self.assertEqual('57 01 00',
+                         self.pool.execute(_DRIVER_INFO, '0x2e 0xca'))
+
+        expired.close.assert_called_once_with()
+        new.execute.assert_called_once_with(
+            '0x2e 0xca', CONF.intel_nm_driver.shell_command_timeout)
+        self.assertIs(new, self.pool._sessions[key])
+
+    def test_execute_failure_retried_once(self, mock_session):
+        key, expired = self._reused_session()
+        new = self._mock_session(mock_session)
+        new.execute.side_effect = exception.IPMIFailure(cmd='raw')
+
+        self.assertRaises(exception.IPMIFailure,
+                          self.pool.execute, _DRIVER_INFO, '0x2e 0xca')
+
+        expired.close.assert_called_once_with()
+        new.close.assert_called_once_with()
+        mock_session.assert_called_once_with(
+            ipmi_shell._shell_args(_DRIVER_INFO), 'secret')
+        self.assertEqual({}, self.pool._sessions)
+
+    def test_execute_closes_idle_sessions(self, mock_session):
+        CONF.set_override('shell_idle_timeout', 60, 'intel_nm_driver')
+        self._mock_session(mock_session, last_used=61)
+        idle = mock.Mock(last_used=0)
+        idle.lock.locked.return_value = False
+        busy = mock.Mock(last_used=0)
+        busy.lock.locked.return_value = True
+        self.pool._sessions = {'idle': idle, 'busy': busy}
+
+        with mock.patch.object(ipmi_shell.time, 'time', return_value=61):
+            self.pool.execute(_DRIVER_INFO, '0x2e 0xca')
+
+        idle.close.assert_called_once_with()
+        self.assertFalse(busy.close.called)
+        self.assertNotIn('idle', self.pool._sessions)
+        self.assertIn('busy', self.pool._sessions)
+
+
+class ShellTransportTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(ShellTransportTestCase, self).setUp()
+        mgr_utils.mock_the_extension_manager(driver='fake_nm')
+        self.node = obj_utils.create_test_node(self.context, driver='fake_nm')
+
+    @mock.patch.object(ipmitool, 'send_raw', spec_set=True, autospec=True)
+    @mock.patch.object(ipmi_shell, 'send_raw', spec_set=True, autospec=True)
+    def test__send_raw_shell(self, shell_mock, ipmitool_mock):
+        CONF.set_override('transport', 'shell', 'intel_nm_driver')
+        shell_mock.return_value = '57 01 00'
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            self.assertEqual(['57', '01', '00'],
+                             nm_vendor._send_raw(task, '0x2e 0xca'))
+            shell_mock.assert_called_once_with(task, '0x2e 0xca')
+        self.assertFalse(ipmitool_mock.called)
+
+    @mock.patch.object(ipmitool, 'send_raw', spec_set=True, autospec=True)
+    @mock.patch.object(ipmi_shell, 'send_raw', spec_set=True, autospec=True)
+    def test__send_raw_ipmitool(self, shell_mock, ipmitool_mock):
+        ipmitool_mock.return_value = ('57 01 00', '')
+        with task_manager.acquire(self.context, self.node.uuid) as task:
+            self.assertEqual(['57', '01', '00'],
+                             nm_vendor._send_raw(task, '0x2e 0xca'))
+            ipmitool_mock.assert_called_once_with(task, '0x2e 0xca')
+        self.assertFalse(shell_mock.called)
@@ -0,0 +1,113 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Tests for the Intel NM telemetry history
+"""
+
+from ironic.tests import base
+from oslo_config import cfg
+
+from ironic_staging_drivers.intel_nm import telemetry
+
+
+CONF = cfg.CONF
+
+
+class RingBufferTestCase(base.TestCase):
+
+    def setUp(self):
+        super(RingBufferTestCase, self).setUp()
+        self.buf = telemetry.RingBuffer(3)
+
+    def test_empty(self):
+        self.assertEqual(0, len(self.buf))
+        self.assertEqual([], self.buf.values())
+        self.assertIsNone(self.buf.last_timestamp)
+
+    def test_append(self):
+        self.buf.append(10, 100)
+        self.buf.append(20, 200)
+        self.assertEqual(2, len(self.buf))
+        self.assertEqual([100, 200], self.buf.values())
+        self.assertEqual(20, self.buf.last_timestamp)
+
+    def test_append_full(self):
+        for i in range(1, 6):
+            self.buf.append(i * 10, i * 100)
+        self.assertEqual(3, len(self.buf))
+        self.assertEqual([300, 400, 500], self.buf.values())
+        self.assertEqual(50, self.buf.last_timestamp)
+
+    def test_values_since(self):
+        for i in range(1, 5):
+            self.buf.append(i * 10, i * 100)
+        self.assertEqual([300, 400], self.buf.values(since=30))
+        self.assertEqual([], self.buf.values(since=41))
+
+
+class TelemetryHistoryTestCase(base.TestCase):
+
+    def setUp(self):
+        super(TelemetryHistoryTestCase, self).setUp()
+        CONF.set_override('telemetry_history', 2, 'intel_nm_driver')
+        self.history = telemetry.TelemetryHistory()
+
+    def test_record(self):
+        for i in range(3):
+            self.history.record('uuid', 'platform', 'power', i, i * 10)
+        self.history.record('uuid', 'cpu', 'power', 1, 5)
+        self.assertEqual([10, 20],
+                         self.history.values('uuid', 'platform', 'power'))
+        self.assertEqual([20], self.history.values('uuid', 'platform',
+                                                   'power', since=2))
+        self.assertEqual([5], self.history.values('uuid', 'cpu', 'power'))
+        self.assertEqual([], self.history.values('uuid', 'io', 'power'))
+        self.assertEqual([], self.history.values('other', 'cpu', 'power'))
+
+    def test_expire(self):
+        self.history.record('old', 'platform', 'power', 10, 100)
+        self.history.record('new', 'platform', 'power', 30, 100)
+        self.history.expire(20)
+        self.assertEqual([], self.history.values('old', 'platform', 'power'))
+        self.assertEqual([100],
+                         self.history.values('new', 'platform', 'power'))
+
+    def test_clear(self):
+        self.history.record('uuid', 'platform', 'power', 10, 100)
+        self.history.clear()
+        self.assertEqual([], self.history.values('uuid', 'platform',
+                                                 'power'))
+
+
+class SummarizeTestCase(base.TestCase):
+
+    def test_summarize(self):
+        values = [float(v) for v in (40, 10, 30, 20, 50)]
+        summary = telemetry.summarize(values, (0, 50, 90, 100))
+        self.assertEqual({'samples': 5, 'current_value': 50.0,
+                          'minimum_value': 10.0, 'maximum_value': 50.0,
+                          'average_value': 30.0,
+                          'percentiles': {'0': 10.0, '50': 30.0,
+                                          '90': 46.0, '100': 50.0}},
+                         summary)
+
+    def test_summarize_one_value(self):
+        summary = telemetry.summarize([42.0], (50, 99.9))
+        self.assertEqual({'50': 42.0, '99.9': 42.0}, summary['percentiles'])
+
+    def test_summarize_empty(self):
+        summary = telemetry.summarize([])
+        self.assertEqual(0, summary['samples'])
+        self.assertIsNone(summary['average_value'])
+        self.assertEqual({'50': None, '90': None, '99': None},
+                         summary['percentiles'])
@@ -15,7 +15,10 @@ Tests for Intel NM vendor interface
 """
 
 import os
+import time
 
+from futurist import periodics
+from ironic.common import driver_factory
 from ironic.common import exception
 from ironic.conductor import task_manager
 from ironic.drivers.modules import ipmitool
@@ -25,9 +28,13 @@ from ironic.tests.unit.objects import utils as obj_utils
 from ironic_lib import utils as ironic_utils
 import mock
 from oslo_config import cfg
+from oslo_utils import uuidutils
 
+from ironic_staging_drivers.intel_nm import ipmi_lan
+from ironic_staging_drivers.intel_nm import ipmi_shell
 from ironic_staging_drivers.intel_nm import nm_commands
 from ironic_staging_drivers.intel_nm import nm_vendor
+from ironic_staging_drivers.intel_nm import telemetry
 
 
 CONF = cfg.CONF
@@ -50,6 +57,15 @@ _CONTROL = {'scope': 'global', 'enable': True}
 _STATISTICS = {'scope': 'global', 'domain_id': 'platform',
                'parameter_name': 'response_time'}
 
+_STATISTICS_BULK = {'scope': 'global', 'domain_id': 'platform',
+                    'parameter_names': ['power', 'temperature']}
+
+_TELEMETRY = {'domain_id': 'platform', 'parameter_name': 'power',
+              'window': 3600, 'percentiles': [50, 99.9]}
+
+_RAW_STATISTICS = ('00 00 00 80 00 20 00 F0 00 60 00 00 01 20 40 01 01 00 00 '
+                   'F0')
+
 _VENDOR_METHODS_DATA = {'get_nm_policy': _MAIN_IDS,
                         'remove_nm_policy': _MAIN_IDS,
                         'get_nm_policy_suspend': _MAIN_IDS,
@@ -59,7 +75,64 @@ _VENDOR_METHODS_DATA = {'get_nm_policy': _MAIN_IDS,
                         'get_nm_capabilities': _GET_CAP,
                         'control_nm_policy': _CONTROL,
                         'get_nm_statistics': _STATISTICS,
-                        'reset_nm_statistics': _STATISTICS}
+                        'get_nm_statistics_bulk': _STATISTICS_BULK,
+                        'reset_nm_statistics': _STATISTICS,
+                        'get_nm_telemetry': _TELEMETRY}
+
+
+class IntelNMMixinVendorTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(IntelNMMixinVendorTestCase, self).setUp()
+        mgr_utils.mock_the_extension_manager(driver='agent_ipmitool_nm')
+        self.driver = driver_factory.get_driver('agent_ipmitool_nm')
+        self.node = obj_utils.create_test_node(self.context,
+                                               driver='agent_ipmitool_nm')
+
+    def test_periodic_tasks_collected(self):
+        # The conductor only collects the periodic tasks of the vendor
+        # interface, not the ones of nm_vendor
+        vendor = self.driver.vendor
+        self.assertIsInstance(vendor, nm_vendor.IntelNMMixinVendorInterface)
+        self.assertTrue(periodics.is_periodic(vendor._discover_nm_addresses))
+        self.assertTrue(periodics.is_periodic(vendor._sample_nm_telemetry))
+        self.assertTrue(vendor._handles('agent_ipmitool_nm'))
+        self.assertFalse(self.driver.nm_vendor._handles('agent_ipmitool_nm'))
+
+    @mock.patch.object(nm_vendor, '_discover_node', spec_set=True,
+                       autospec=True)
+    def test__discover_nm_addresses(self, discover_mock):
+        manager = mock.Mock(spec=['iter_nodes'])
+        manager.iter_nodes.return_value = [
+            (self.node.uuid, self.node.driver, {})]
+        self.driver.vendor._discover_nm_addresses(manager, self.context)
+        discover_mock.assert_called_once_with(self.context, self.node.uuid)
+
+    @mock.patch.object(nm_vendor, 'sample_nm_telemetry', spec_set=True,
+                       autospec=True)
+    def test__sample_nm_telemetry(self, sample_mock):
+        detected = obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(),
+            driver='agent_ipmitool_nm',
+            driver_internal_info={'intel_nm_channel': '0x06',
+                                  'intel_nm_address': '0x2c'})
+        manager = mock.Mock(spec=['iter_nodes'])
+        manager.iter_nodes.return_value = [
+            (node.uuid, node.driver, node.driver_internal_info)
+            for node in (self.node, detected)]
+        self.driver.vendor._sample_nm_telemetry(manager, self.context)
+        sample_mock.assert_called_once_with(self.context, [detected.uuid])
+
+    @mock.patch.object(nm_vendor, '_detect_nm_address', spec_set=True,
+                       autospec=True)
+    def test__get_nm_address_default(self, detect_mock):
+        # Without background detection, the first use detects Intel NM
+        detect_mock.return_value = ('0x06', '0x2c')
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            self.assertEqual(('0x06', '0x2c'),
+                             nm_vendor._get_nm_address(task))
+            detect_mock.assert_called_once_with(task)
 
 
 class IntelNMPassthruTestCase(db_base.DbTestCase):
@@ -70,6 +143,7 @@ class IntelNMPassthruTestCase(db_base.DbTestCase):
         self.node = obj_utils.create_test_node(self.context, driver='fake_nm')
         self.temp_filename = os.path.join(CONF.tempdir, self.node.uuid +
                                           '.sdr')
+        telemetry.HISTORY.clear()
 
     @mock.patch.object(ironic_utils, 'unlink_without_raise', spec_set=True,
                        autospec=True)
@@ -137,6 +211,50 @@ class IntelNMPassthruTestCase(db_base.DbTestCase):
             unlink_mock.assert_called_once_with(self.temp_filename)
             self.assertFalse(raw_mock.called)
 
+    @mock.patch.object(ironic_utils, 'unlink_without_raise', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(ipmitool, 'dump_sdr', spec_set=True, autospec=True)
+    def test__get_nm_address_sdr_fail(self, dump_mock, unlink_mock):
+        dump_mock.side_effect = exception.IPMIFailure('unreachable')
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            self.assertRaises(exception.IPMIFailure, nm_vendor._get_nm_address,
+                              task)
+        # The failure is recorded, so that the retry is delayed
+        self.node.refresh()
+        internal_info = self.node.driver_internal_info
+        self.assertIs(False, internal_info['intel_nm_address'])
+        self.assertIs(False, internal_info['intel_nm_channel'])
+        self.assertEqual(1, internal_info['intel_nm_failures'])
+        self.assertIn('intel_nm_retry_after', internal_info)
+        unlink_mock.assert_called_once_with(self.temp_filename)
+
+    @mock.patch.object(ironic_utils, 'unlink_without_raise', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(ipmitool, 'dump_sdr', spec_set=True, autospec=True)
+    def test__discover_node_refresh_sdr_fail(self, dump_mock, unlink_mock):
+        CONF.set_override('discovery_refresh_interval', 100,
+                          'intel_nm_driver')
+        dump_mock.side_effect = exception.IPMIFailure('unreachable')
+        internal_info = self.node.driver_internal_info
+        internal_info['intel_nm_channel'] = '0x06'
+        internal_info['intel_nm_address'] = '0x2c'
+        internal_info['intel_nm_detected_at'] = time.time() - 101
+        self.node.driver_internal_info = internal_info
+        self.node.save()
+        nm_vendor._discover_node(self.context, self.node.uuid)
+        dump_mock.assert_called_once_with(mock.ANY, self.temp_filename)
+        # The previous result is kept
+        self.node.refresh()
+        internal_info = self.node.driver_internal_info
+        self.assertEqual('0x06', internal_info['intel_nm_channel'])
+        self.assertEqual('0x2c', internal_info['intel_nm_address'])
+        self.assertNotIn('intel_nm_failures', internal_info)
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertEqual(('0x06', '0x2c'),
+                             nm_vendor._get_nm_address(task))
+
     @mock.patch.object(ironic_utils, 'unlink_without_raise', spec_set=True,
                        autospec=True)
     @mock.patch.object(ipmitool, 'send_raw', spec_set=True, autospec=True)
@@ -171,6 +289,7 @@ class IntelNMPassthruTestCase(db_base.DbTestCase):
         internal_info = self.node.driver_internal_info
         internal_info['intel_nm_channel'] = False
         internal_info['intel_nm_address'] = False
+        internal_info['intel_nm_retry_after'] = time.time() + 600
         self.node.driver_internal_info = internal_info
         self.node.save()
         with task_manager.acquire(self.context, self.node.uuid,
@@ -182,6 +301,160 @@ class IntelNMPassthruTestCase(db_base.DbTestCase):
         self.assertFalse(raw_mock.called)
         self.assertFalse(unlink_mock.called)
 
+    @mock.patch.object(ironic_utils, 'unlink_without_raise', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(ipmitool, 'send_raw', spec_set=True, autospec=True)
+    @mock.patch.object(ipmitool, 'dump_sdr', spec_set=True, autospec=True)
+    @mock.patch.object(nm_commands, 'parse_slave_and_channel', spec_set=True,
+                       autospec=True)
+    def test__get_nm_address_not_detected_expired(self, parse_mock,
+                                                  dump_mock, raw_mock,
+                                                  unlink_mock):
+        parse_mock.return_value = ('0x0A', '0x0B')
+        raw_mock.return_value = ('0x57 0x01 0x00', '')
+        internal_info = self.node.driver_internal_info
+        internal_info['intel_nm_channel'] = False
+        internal_info['intel_nm_address'] = False
+        internal_info['intel_nm_failures'] = 2
+        internal_info['intel_nm_retry_after'] = time.time() - 1
+        self.node.driver_internal_info = internal_info
+        self.node.save()
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            ret = nm_vendor._get_nm_address(task)
+            self.assertEqual(('0x0B', '0x0A'), ret)
+        self.node.refresh()
+        internal_info = self.node.driver_internal_info
+        self.assertEqual('0x0B', internal_info['intel_nm_channel'])
+        self.assertNotIn('intel_nm_failures', internal_info)
+        self.assertNotIn('intel_nm_retry_after', internal_info)
+
+    @mock.patch.object(nm_vendor.time, 'time', autospec=True)
+    @mock.patch.object(ironic_utils, 'unlink_without_raise', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(ipmitool, 'dump_sdr', spec_set=True, autospec=True)
+    @mock.patch.object(nm_commands, 'parse_slave_and_channel', spec_set=True,
+                       autospec=True)
+    def test__get_nm_address_retry_backoff(self, parse_mock, dump_mock,
+                                           unlink_mock, time_mock):
+        CONF.set_override('discovery_retry_interval', 100, 'intel_nm_driver')
+        CONF.set_override('discovery_max_retry_interval', 300,
+                          'intel_nm_driver')
+        parse_mock.return_value = None
+        retries = []
+        for now in (1000, 1100, 1300, 1700):
+            time_mock.return_value = now
+            with task_manager.acquire(self.context, self.node.uuid,
+                                      shared=False) as task:
+                self.assertRaises(exception.IPMIFailure,
+                                  nm_vendor._get_nm_address, task)
+            self.node.refresh()
+            retries.append(
+                self.node.driver_internal_info['intel_nm_retry_after'])
+        self.assertEqual([1100, 1300, 1600, 2000], retries)
+        internal_info = self.node.driver_internal_info
+        self.assertEqual(4, internal_info['intel_nm_failures'])
+        self.assertEqual(4, dump_mock.call_count)
+
+    @mock.patch.object(ipmi_lan, 'send_raw', spec_set=True, autospec=True)
+    @mock.patch.object(ipmi_lan, 'iter_sdr', spec_set=True, autospec=True)
+    @mock.patch.object(ipmitool, 'dump_sdr', spec_set=True, autospec=True)
+    def test__get_nm_address_detected_lan(self, dump_mock, iter_mock,
+                                          raw_mock):
+        CONF.set_override('transport', 'lan', 'intel_nm_driver')
+        iter_mock.return_value = iter([
+            b'\x01\x00\x51\xc0\x07\x57\x01\x00\x0c\x02\x00\x00',
+            b'\x02\x00\x51\xc0\x0b\x57\x01\x00\x0d\x01\x2c\x60\xb2'
+            b'\xb3\xb4\xb5',
+            b'\x03\x00\x51\x12\x00'])
+        raw_mock.return_value = b'\x57\x01\x00\x05\x03\x02\x04\x07\x00'
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            ret = nm_vendor._get_nm_address(task)
+            self.assertEqual(('0x06', '0x2c'), ret)
+            iter_mock.assert_called_once_with(task)
+        # The SDR is read until the Intel NM discovery record only
+        self.assertEqual(1, len(list(iter_mock.return_value)))
+        self.assertFalse(dump_mock.called)
+
+    @mock.patch.object(ipmitool, 'dump_sdr', spec_set=True, autospec=True)
+    def test__get_nm_address_background(self, dump_mock):
+        CONF.set_override('discovery_interval', 300, 'intel_nm_driver')
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            self.assertRaises(exception.IPMIFailure, nm_vendor._get_nm_address,
+                              task)
+        self.assertFalse(dump_mock.called)
+
+    def test__needs_detection(self):
+        CONF.set_override('discovery_refresh_interval', 100,
+                          'intel_nm_driver')
+        detected = {'intel_nm_channel': '0x06', 'intel_nm_address': '0x2c',
+                    'intel_nm_detected_at': 1000}
+        failed = {'intel_nm_channel': False, 'intel_nm_address': False,
+                  'intel_nm_retry_after': 1100}
+        self.assertTrue(nm_vendor._needs_detection({}, 1000))
+        self.assertFalse(nm_vendor._needs_detection(detected, 1100))
+        self.assertTrue(nm_vendor._needs_detection(detected, 1101))
+        self.assertFalse(nm_vendor._needs_detection(failed, 1099))
+        self.assertTrue(nm_vendor._needs_detection(failed, 1100))
+        CONF.set_override('discovery_refresh_interval', 0, 'intel_nm_driver')
+        self.assertFalse(nm_vendor._needs_detection(detected, 10 ** 9))
+
+    @mock.patch.object(nm_vendor, '_detect_nm_address', spec_set=True,
+                       autospec=True)
+    def test__discover_nm_addresses(self, detect_mock):
+        CONF.set_override('node_locked_retry_attempts', 1, 'conductor')
+        detected = obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(), driver='fake_nm',
+            driver_internal_info={'intel_nm_channel': '0x06',
+                                  'intel_nm_address': '0x2c',
+                                  'intel_nm_detected_at': time.time()})
+        locked = obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(), driver='fake_nm',
+            reservation='other-conductor')
+        manager = mock.Mock(spec=['iter_nodes'])
+        manager.iter_nodes.return_value = [
+            (node.uuid, node.driver, node.driver_internal_info)
+            for node in (self.node, detected, locked)]
+        vendor = nm_vendor.IntelNMVendorPassthru()
+        with mock.patch.object(vendor, '_handles', return_value=True):
+            vendor._discover_nm_addresses(manager, self.context)
+
+        manager.iter_nodes.assert_called_once_with(
+            fields=['driver_internal_info'], filters={'maintenance': False})
+        detect_mock.assert_called_once_with(mock.ANY)
+        self.assertEqual(self.node.uuid, detect_mock.call_args[0][0].node.uuid)
+
+    @mock.patch.object(nm_vendor, '_discover_node', spec_set=True,
+                       autospec=True)
+    def test__discover_nm_addresses_other_driver(self, discover_mock):
+        manager = mock.Mock(spec=['iter_nodes'])
+        manager.iter_nodes.return_value = [(self.node.uuid, 'other', {})]
+        vendor = nm_vendor.IntelNMVendorPassthru()
+        vendor._discover_nm_addresses(manager, self.context)
+        self.assertFalse(discover_mock.called)
+
+    def test__handles(self):
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertTrue(task.driver.vendor._handles('fake_nm'))
+            self.assertFalse(task.driver.vendor._handles('fake'))
+            self.assertFalse(task.driver.vendor._handles('nonexistent'))
+            # Another instance of the same class handles the same nodes
+            vendor = nm_vendor.IntelNMVendorPassthru()
+            self.assertTrue(vendor._handles('fake_nm'))
+
+    @mock.patch.object(nm_vendor, '_detect_nm_address', spec_set=True,
+                       autospec=True)
+    def test_discover_nm_addresses_failure(self, detect_mock):
+        detect_mock.side_effect = exception.IPMIFailure('not detected')
+        other = obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(), driver='fake_nm')
+        nm_vendor.discover_nm_addresses(self.context,
+                                        [self.node.uuid, other.uuid])
+        self.assertEqual(2, detect_mock.call_count)
+
     @mock.patch.object(ipmitool, 'send_raw', spec_set=True, autospec=True)
     @mock.patch.object(nm_vendor, '_get_nm_address', spec_set=True,
                        autospec=True)
@@ -224,12 +497,180 @@ class IntelNMPassthruTestCase(db_base.DbTestCase):
             fake_command.assert_called_once_with(fake_data)
             raw_mock.assert_called_once_with(task, '0x01 0x02')
 
+    @mock.patch.object(nm_vendor, '_execute_nm_command', spec_set=True,
+                       autospec=True)
+    def test__sample_nm_telemetry(self, execute_mock):
+        CONF.set_override('telemetry_domains', ['platform', 'cpu'],
+                          'intel_nm_driver')
+        execute_mock.return_value = {'current_value': 120}
+        detected = obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(), driver='fake_nm',
+            driver_internal_info={'intel_nm_channel': '0x06',
+                                  'intel_nm_address': '0x2c'})
+        manager = mock.Mock(spec=['iter_nodes'])
+        manager.iter_nodes.return_value = [
+            (node.uuid, node.driver, node.driver_internal_info)
+            for node in (self.node, detected)]
+        vendor = nm_vendor.IntelNMVendorPassthru()
+        with mock.patch.object(vendor, '_handles', return_value=True):
+            vendor._sample_nm_telemetry(manager, self.context)
+
+        self.assertEqual(6, execute_mock.call_count)
+        execute_mock.assert_any_call(
+            mock.ANY, {'scope': 'global', 'domain_id': 'cpu',
+                       'parameter_name': 'chassis_power'},
+            nm_commands.get_statistics, nm_commands.parse_statistics)
+        for domain in ('platform', 'cpu'):
+            for parameter in telemetry.PARAMETERS:
+                self.assertEqual([120], telemetry.HISTORY.values(
+                    detected.uuid, domain, parameter))
+        self.assertEqual([], telemetry.HISTORY.values(
+            self.node.uuid, 'platform', 'power'))
+
+    @mock.patch.object(nm_vendor, '_execute_nm_command', spec_set=True,
+                       autospec=True)
+    def test_sample_nm_telemetry_failure(self, execute_mock):
+        def _execute(task, data, command_func, parse_func):
+            if data['parameter_name'] == 'temperature':
+                raise exception.IPMIFailure('not supported')
+            return {'current_value': 120}
+
+        execute_mock.side_effect = _execute
+        nm_vendor.sample_nm_telemetry(self.context, [self.node.uuid])
+        self.assertEqual([120], telemetry.HISTORY.values(
+            self.node.uuid, 'platform', 'power'))
+        self.assertEqual([], telemetry.HISTORY.values(
+            self.node.uuid, 'platform', 'temperature'))
+        self.assertEqual([120], telemetry.HISTORY.values(
+            self.node.uuid, 'platform', 'chassis_power'))
+
+    @mock.patch.object(nm_vendor.time, 'time', autospec=True)
+    def test_get_nm_telemetry(self, time_mock):
+        time_mock.return_value = 1000
+        for timestamp, value in ((100, 300), (500, 100), (900, 200)):
+            telemetry.HISTORY.record(self.node.uuid, 'platform', 'power',
+                                     timestamp, value)
+        telemetry.HISTORY.record(self.node.uuid, 'cpu', 'power', 900, 50)
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            result = task.driver.vendor.get_nm_telemetry(
+                task, parameter_name='power', window=600, percentiles=[50])
+        self.assertEqual({'power': {'samples': 2, 'current_value': 200,
+                                    'minimum_value': 100,
+                                    'maximum_value': 200,
+                                    'average_value': 150,
+                                    'percentiles': {'50': 150}}}, result)
+
+    def test_get_nm_telemetry_all_parameters(self):
+        telemetry.HISTORY.record(self.node.uuid, 'cpu', 'power', 900, 50)
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            result = task.driver.vendor.get_nm_telemetry(task,
+                                                         domain_id='cpu')
+        self.assertEqual(set(telemetry.PARAMETERS), set(result))
+        self.assertEqual(1, result['power']['samples'])
+        self.assertEqual(0, result['temperature']['samples'])
+
+    def test_validate_telemetry_invalid_percentile(self):
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertRaises(exception.InvalidParameterValue,
+                              task.driver.vendor.validate, task,
+                              'get_nm_telemetry', 'fake', percentiles=[101])
+
+    @mock.patch.object(ipmi_shell, 'send_raw_batch', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(nm_vendor, '_get_nm_address', spec_set=True,
+                       autospec=True)
+    def test_get_nm_statistics_bulk(self, addr_mock, batch_mock):
+        addr_mock.return_value = ('0x06', '0x2c')
+        batch_mock.return_value = [_RAW_STATISTICS] * 6
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            result = task.driver.vendor.get_nm_statistics_bulk(
+                task, scope='global', domain_id='cpu')
+            self.assertEqual('0x2c',
+                             task.node.driver_info['ipmi_target_address'])
+            addr_mock.assert_called_once_with(task)
+            batch_mock.assert_called_once_with(task, [
+                '0x2E 0xC8 0x57 0x01 0x00 0x%02X 0x01 0x00' % mode
+                for mode in range(1, 7)])
+        self.assertEqual({'power', 'temperature', 'throttling', 'airflow',
+                          'airflow_temperature', 'chassis_power'},
+                         set(result))
+        self.assertEqual(128, result['power']['current_value'])
+        self.assertEqual('platform', result['power']['domain_id'])
+
+    @mock.patch.object(ipmi_lan, 'send_raw', spec_set=True, autospec=True)
+    @mock.patch.object(nm_vendor, '_get_nm_address', spec_set=True,
+                       autospec=True)
+    def test_get_nm_statistics_bulk_lan(self, addr_mock, raw_mock):
+        CONF.set_override('transport', 'lan', 'intel_nm_driver')
+        addr_mock.return_value = ('0x06', '0x2c')
+        raw_mock.return_value = bytearray(
+            int(x, 16) for x in _RAW_STATISTICS.split())
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            result = task.driver.vendor.get_nm_statistics_bulk(
+                task, scope='global', domain_id='cpu',
+                parameter_names=['power', 'response_time'])
+            # response_time is not related to a domain
+            raw_mock.assert_has_calls([
+                mock.call(task, '0x2E 0xC8 0x57 0x01 0x00 0x01 0x01 0x00'),
+                mock.call(task, '0x2E 0xC8 0x57 0x01 0x00 0x1C 0x00 0x00')])
+        self.assertEqual({'power', 'response_time'}, set(result))
+        addr_mock.assert_called_once_with(mock.ANY)
+
+    @mock.patch.object(ipmi_shell, 'send_raw_batch', spec_set=True,
+                       autospec=True)
+    @mock.patch.object(nm_vendor, '_get_nm_address', spec_set=True,
+                       autospec=True)
+    def test_get_nm_statistics_bulk_policy(self, addr_mock, batch_mock):
+        addr_mock.return_value = ('0x06', '0x2c')
+        batch_mock.return_value = [_RAW_STATISTICS] * 3
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=False) as task:
+            result = task.driver.vendor.get_nm_statistics_bulk(
+                task, scope='policy', domain_id='platform', policy_id=111)
+            batch_mock.assert_called_once_with(task, [
+                '0x2E 0xC8 0x57 0x01 0x00 0x%02X 0x00 0x6F' % mode
+                for mode in (0x11, 0x12, 0x13)])
+        self.assertEqual({'power', 'trigger', 'throttling'}, set(result))
+
+    def test_validate_statistics_bulk_no_policy(self):
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertRaises(exception.MissingParameterValue,
+                              task.driver.vendor.validate, task,
+                              'get_nm_statistics_bulk', 'fake',
+                              scope='policy', domain_id='platform')
+
+    def test_validate_statistics_bulk_invalid_parameter(self):
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertRaises(exception.InvalidParameterValue,
+                              task.driver.vendor.validate, task,
+                              'get_nm_statistics_bulk', 'fake',
+                              scope='policy', domain_id='platform',
+                              policy_id=111, parameter_names=['airflow'])
+
     def test_validate_json(self):
         with task_manager.acquire(self.context, self.node.uuid,
                                   shared=False) as task:
             for method, data in _VENDOR_METHODS_DATA.items():
                 task.driver.vendor.validate(task, method, 'fake', **data)
 
+    @mock.patch.object(nm_vendor, '_VALIDATORS', {})
+    @mock.patch.object(nm_vendor.jsonschema, 'Draft4Validator', autospec=True)
+    def test_validators_shared(self, validator_mock):
+        first = nm_vendor.IntelNMVendorPassthru()
+        second = nm_vendor.IntelNMVendorPassthru()
+        self.assertIs(first._validators, second._validators)
+        self.assertEqual(set(nm_vendor.SCHEMAS), set(first._validators))
+        self.assertEqual(len(nm_vendor.SCHEMAS), validator_mock.call_count)
+        self.assertEqual(len(nm_vendor.SCHEMAS),
+                         validator_mock.check_schema.call_count)
+
     def test_validate_json_error(self):
         fake_data = {'foo': 'bar'}
         with task_manager.acquire(self.context, self.node.uuid,
@@ -19,6 +19,8 @@
 import tempfile
 
 import mock
+from oslo_config import cfg
+from oslo_utils import uuidutils
 
 from ironic.common import boot_devices
 from ironic.common import driver_factory
@@ -29,10 +31,13 @@ from ironic.drivers import utils as driver_utils
 from ironic_staging_drivers.common import exception as isd_exc
 from ironic_staging_drivers.libvirt import power
 
+from ironic.tests import base
 from ironic.tests.unit.conductor import mgr_utils
 from ironic.tests.unit.db import base as db_base
 from ironic.tests.unit.objects import utils as obj_utils
 
+CONF = cfg.CONF
+
 
 def _get_test_libvirt_driver_info(auth_type='ssh_key'):
     if auth_type == 'ssh_key':
@@ -61,12 +66,26 @@ def _get_test_libvirt_driver_info(auth_type='ssh_key'):
 
 
 class FakeLibvirtDomain(object):
-    def __init__(self, uuid=None):
-        self.uuid = uuid
+    def __init__(self, uuid=None, state=power.libvirt.VIR_DOMAIN_RUNNING):
+        self.uuid = uuid or '1be26c0b-03f2-4d2e-ae87-c02d7f33c123'
+        self._state = state
 
     def name(self):
         return 'test_libvirt_domain'
 
+    def UUIDString(self):
+        return self.uuid
+
+    def state(self):
+        return [self._state, 1]
+
+    def _is_active(self):
+        return self._state not in (power.libvirt.VIR_DOMAIN_SHUTOFF,
+                                   power.libvirt.VIR_DOMAIN_CRASHED)
+
+    def isActive(self):
+        return self._is_active()
+
     def XMLDesc(self, boot_dev=power._BOOT_DEVICES_MAP[boot_devices.PXE]):
         return(
             """<domain type='qemu' id='4'>
@@ -103,13 +122,37 @@ class FakeLibvirtDomain(object):
             </domain>""") % {'boot_dev': boot_dev}
 
 
+def _get_no_domain_error():
+    error = power.libvirt.libvirtError('Domain not found')
+    error.err = (power.libvirt.VIR_ERR_NO_DOMAIN,)
+    return error
+
+
 class FakeConnection(object):
-    def listAllDomains(self):
-        return [FakeLibvirtDomain()]
+    def __init__(self, domains=None):
+        self.domains = domains or [FakeLibvirtDomain()]
+
+    def listAllDomains(self, flags=0):
+        if flags == power.libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE:
+            return [domain for domain in self.domains if domain._is_active()]
+        if flags == power.libvirt.VIR_CONNECT_LIST_DOMAINS_INACTIVE:
+            return [domain for domain in self.domains
+                    if not domain._is_active()]
+        return self.domains
+
+    def lookupByUUIDString(self, uuid):
+        for domain in self.domains:
+            if domain.UUIDString() == uuid:
+                return domain
+        raise _get_no_domain_error()
 
 
 class LibvirtValidateParametersTestCase(db_base.DbTestCase):
 
+    def setUp(self):
+        super(LibvirtValidateParametersTestCase, self).setUp()
+        power._parse_driver_info.cache_clear()
+
     def test__parse_driver_info_good_ssh_key(self):
         d_info = _get_test_libvirt_driver_info('ssh_key')
         key_path = tempfile.mkdtemp() + '/test.key'
@@ -163,6 +206,11 @@ class LibvirtValidateParametersTestCase(db_base.DbTestCase):
 
 class LibvirtPrivateMethodsTestCase(db_base.DbTestCase):
 
+    def setUp(self):
+        super(LibvirtPrivateMethodsTestCase, self).setUp()
+        power._CONNECTION_POOL.clear()
+        power._DOMAIN_INDEX.invalidate()
+
     @mock.patch.object(power.libvirt, 'openAuth', autospec=True)
     def test__get_libvirt_connection_sasl_auth(self, libvirt_open_mock):
         node = obj_utils.get_test_node(
@@ -241,6 +289,30 @@ class LibvirtPrivateMethodsTestCase(db_base.DbTestCase):
 
         self.assertEqual('test_libvirt_domain', domain.name())
 
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test__get_domain_by_macs_reconnect(self, libvirt_conn_mock):
+        dead_conn = mock.Mock(spec_set=['listAllDomains', 'isAlive'])
+        dead_conn.listAllDomains.side_effect = power.libvirt.libvirtError(
+            'Error')
+        dead_conn.isAlive.return_value = False
+        libvirt_conn_mock.side_effect = [dead_conn, FakeConnection()]
+        mgr_utils.mock_the_extension_manager(driver="fake_libvirt_fake")
+        driver_factory.get_driver("fake_libvirt_fake")
+        node = obj_utils.create_test_node(
+            self.context,
+            driver='fake_libvirt_fake',
+            driver_info=_get_test_libvirt_driver_info('socket'))
+        obj_utils.create_test_port(self.context,
+                                   node_id=node.id,
+                                   address='00:16:3e:49:1d:11')
+
+        with task_manager.acquire(self.context, node.uuid,
+                                  shared=True) as task:
+            domain = power._get_domain_by_macs(task)
+
+        self.assertEqual('test_libvirt_domain', domain.name())
+        self.assertEqual(2, libvirt_conn_mock.call_count)
+
     @mock.patch.object(power, '_get_libvirt_connection',
                        return_value=FakeConnection())
     def test__get_domain_by_macs_not_found(self, libvirt_conn_mock):
@@ -260,6 +332,90 @@ class LibvirtPrivateMethodsTestCase(db_base.DbTestCase):
             self.assertRaises(exception.NodeNotFound,
                               power._get_domain_by_macs, task)
 
+    def _create_node_with_port(self, address='00:16:3e:49:1d:11'):
+        mgr_utils.mock_the_extension_manager(driver="fake_libvirt_fake")
+        driver_factory.get_driver("fake_libvirt_fake")
+        node = obj_utils.create_test_node(
+            self.context,
+            driver='fake_libvirt_fake',
+            driver_info=_get_test_libvirt_driver_info('socket'))
+        obj_utils.create_test_port(self.context,
+                                   node_id=node.id,
+                                   address=address)
+        return node
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test__get_domain_by_macs_uses_index(self, libvirt_conn_mock):
+        conn = FakeConnection()
+        conn.listAllDomains = mock.Mock(wraps=conn.listAllDomains)
+        libvirt_conn_mock.return_value = conn
+        node = self._create_node_with_port()
+
+        with task_manager.acquire(self.context, node.uuid,
+                                  shared=True) as task:
+            power._get_domain_by_macs(task)
+            domain = power._get_domain_by_macs(task)
+
+        self.assertEqual('test_libvirt_domain', domain.name())
+        conn.listAllDomains.assert_called_once_with()
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test__get_domain_by_macs_stale_index(self, libvirt_conn_mock):
+        libvirt_conn_mock.return_value = FakeConnection()
+        node = self._create_node_with_port()
+        uri = _get_test_libvirt_driver_info('socket')['libvirt_uri']
+        power._DOMAIN_INDEX.build(
+            uri, [FakeLibvirtDomain(uuid='gone-domain-uuid')])
+
+        with task_manager.acquire(self.context, node.uuid,
+                                  shared=True) as task:
+            domain = power._get_domain_by_macs(task)
+
+        self.assertEqual('1be26c0b-03f2-4d2e-ae87-c02d7f33c123',
+                         domain.UUIDString())
+        self.assertEqual({'00:16:3e:49:1d:11': domain.UUIDString(),
+                          '52:54:00:5c:b7:df': domain.UUIDString()},
+                         power._DOMAIN_INDEX.get(uri))
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test__get_domain_by_macs_changed_macs(self, libvirt_conn_mock):
+        domain = FakeLibvirtDomain()
+        other_domain = FakeLibvirtDomain(uuid='other-domain-uuid')
+        other_domain.XMLDesc = mock.Mock(
+            return_value='<domain><mac address="00:16:3e:49:1d:11"/>'
+                         '</domain>')
+        libvirt_conn_mock.return_value = FakeConnection(
+            [domain, other_domain])
+        node = self._create_node_with_port()
+        uri = _get_test_libvirt_driver_info('socket')['libvirt_uri']
+        # The index says that the MAC belongs to the first domain, but it
+        # was moved to the other one since then
+        power._DOMAIN_INDEX.build(uri, [domain])
+        domain.XMLDesc = mock.Mock(return_value='<domain/>')
+
+        with task_manager.acquire(self.context, node.uuid,
+                                  shared=True) as task:
+            found = power._get_domain_by_macs(task)
+
+        self.assertIs(other_domain, found)
+
+    def test__domain_index_build_skips_undefined(self):
+        domain = FakeLibvirtDomain()
+        gone_domain = mock.Mock()
+        gone_domain.XMLDesc.side_effect = _get_no_domain_error()
+
+        index = power._DOMAIN_INDEX.build('fake uri', [gone_domain, domain])
+
+        self.assertEqual({'00:16:3e:49:1d:11': domain.UUIDString(),
+                          '52:54:00:5c:b7:df': domain.UUIDString()}, index)
+
+    def test__domain_index_invalidate(self):
+        power._DOMAIN_INDEX.build('fake uri', [FakeLibvirtDomain()])
+
+        power._DOMAIN_INDEX.invalidate('fake uri')
+
+        self.assertIsNone(power._DOMAIN_INDEX.get('fake uri'))
+
     def test__get_power_state_on(self):
         domain_mock = mock.Mock()
         domain_mock.isActive = mock.MagicMock(return_value=True)
@@ -485,6 +641,73 @@ class LibvirtPowerTestCase(db_base.DbTestCase):
             get_domain_mock.assert_called_once_with(task)
             get_power_state.assert_called_once_with(domain)
 
+    @mock.patch.object(power, '_get_cached_power_state', autospec=True)
+    @mock.patch.object(power, '_get_domain_by_macs', autospec=True)
+    def test_get_power_state_events_cached(self, get_domain_mock,
+                                           get_cached_mock):
+        CONF.set_override('power_state_events', True, 'libvirt_driver')
+        get_cached_mock.return_value = states.POWER_ON
+
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertEqual(states.POWER_ON,
+                             task.driver.power.get_power_state(task))
+
+            get_cached_mock.assert_called_once_with(task)
+            self.assertFalse(get_domain_mock.called)
+
+    @mock.patch.object(power._POWER_STATE_CACHE, 'record', autospec=True)
+    @mock.patch.object(power, '_get_power_state', autospec=True)
+    @mock.patch.object(power, '_get_cached_power_state', autospec=True)
+    @mock.patch.object(power, '_get_domain_by_macs', autospec=True)
+    def test_get_power_state_events_not_cached(self, get_domain_mock,
+                                               get_cached_mock,
+                                               get_power_state_mock,
+                                               record_mock):
+        CONF.set_override('power_state_events', True, 'libvirt_driver')
+        domain = FakeLibvirtDomain()
+        get_domain_mock.return_value = domain
+        get_cached_mock.return_value = None
+        get_power_state_mock.return_value = states.POWER_OFF
+
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertEqual(states.POWER_OFF,
+                             task.driver.power.get_power_state(task))
+
+            get_domain_mock.assert_called_once_with(task)
+            record_mock.assert_called_once_with(
+                'test+tcp://localhost:5000/test', domain.UUIDString(),
+                states.POWER_OFF)
+
+    @mock.patch.object(power._POWER_STATE_CACHE, 'is_watched', autospec=True)
+    def test__get_cached_power_state(self, is_watched_mock):
+        is_watched_mock.return_value = True
+        uri = 'test+tcp://localhost:5000/test'
+        domain = FakeLibvirtDomain()
+        power._DOMAIN_INDEX.build(uri, [domain])
+        power._POWER_STATE_CACHE.record(uri, domain.UUIDString(),
+                                        states.POWER_ON)
+        self.addCleanup(power._POWER_STATE_CACHE.forget, uri,
+                        domain.UUIDString())
+        self.addCleanup(power._DOMAIN_INDEX.invalidate, uri)
+
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertEqual(states.POWER_ON,
+                             power._get_cached_power_state(task))
+
+    @mock.patch.object(power._POWER_STATE_CACHE, 'is_watched', autospec=True)
+    def test__get_cached_power_state_not_watched(self, is_watched_mock):
+        is_watched_mock.return_value = False
+        uri = 'test+tcp://localhost:5000/test'
+        power._DOMAIN_INDEX.build(uri, [FakeLibvirtDomain()])
+        self.addCleanup(power._DOMAIN_INDEX.invalidate, uri)
+
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertIsNone(power._get_cached_power_state(task))
+
     @mock.patch.object(power, '_power_on', autospec=True)
     @mock.patch.object(power, '_get_domain_by_macs', autospec=True)
     def test_set_power_state_on(self, get_domain_mock, power_on_mock):
@@ -649,3 +872,429 @@ class LibvirtManagementTestCase(db_base.DbTestCase):
                  'sasl_password': 'admin',
                  'sasl_username': 'admin',
                  'ssh_key_filename': None})
+
+
+class LibvirtBulkPowerStateTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(LibvirtBulkPowerStateTestCase, self).setUp()
+        mgr_utils.mock_the_extension_manager(driver="fake_libvirt_fake")
+        driver_factory.get_driver("fake_libvirt_fake")
+        power._DOMAIN_INDEX.invalidate()
+        self.nodes = []
+        for address in ('00:16:3e:49:1d:11', '00:16:3e:49:1d:22'):
+            node = obj_utils.create_test_node(
+                self.context,
+                uuid=uuidutils.generate_uuid(),
+                driver='fake_libvirt_fake',
+                driver_info=_get_test_libvirt_driver_info('sasl'))
+            obj_utils.create_test_port(self.context,
+                                       uuid=uuidutils.generate_uuid(),
+                                       node_id=node.id,
+                                       address=address)
+            self.nodes.append(node)
+
+    def _get_domain(self, uuid, address, state):
+        domain = FakeLibvirtDomain(uuid=uuid, state=state)
+        domain.XMLDesc = mock.Mock(
+            return_value='<domain><mac address="%s"/></domain>' % address)
+        return domain
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states(self, libvirt_conn_mock):
+        conn = FakeConnection([
+            self._get_domain('uuid-on', '00:16:3e:49:1d:11',
+                             power.libvirt.VIR_DOMAIN_RUNNING),
+            self._get_domain('uuid-off', '00:16:3e:49:1d:22',
+                             power.libvirt.VIR_DOMAIN_SHUTOFF)])
+        conn.listAllDomains = mock.Mock(wraps=conn.listAllDomains)
+        libvirt_conn_mock.return_value = conn
+
+        result = power.get_power_states(self.nodes,
+                                        context=self.context)
+
+        self.assertEqual({self.nodes[0].uuid: states.POWER_ON,
+                          self.nodes[1].uuid: states.POWER_OFF}, result)
+        libvirt_conn_mock.assert_called_once_with(mock.ANY)
+        self.assertEqual(
+            [mock.call(power.libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE),
+             mock.call(power.libvirt.VIR_CONNECT_LIST_DOMAINS_INACTIVE)],
+            conn.listAllDomains.call_args_list)
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states_no_domain_calls(self, libvirt_conn_mock):
+        domains = [
+            self._get_domain('uuid-on', '00:16:3e:49:1d:11',
+                             power.libvirt.VIR_DOMAIN_RUNNING),
+            self._get_domain('uuid-off', '00:16:3e:49:1d:22',
+                             power.libvirt.VIR_DOMAIN_SHUTOFF)]
+        for domain in domains:
+            domain.isActive = mock.Mock()
+        libvirt_conn_mock.return_value = FakeConnection(domains)
+
+        result = power.get_power_states(self.nodes,
+                                        context=self.context)
+        # The index is reused by the next query
+        self.assertEqual(result, power.get_power_states(self.nodes,
+                                                        context=self.context))
+
+        self.assertEqual({self.nodes[0].uuid: states.POWER_ON,
+                          self.nodes[1].uuid: states.POWER_OFF}, result)
+        for domain in domains:
+            self.assertFalse(domain.isActive.called)
+            domain.XMLDesc.assert_called_once_with()
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states_stale_index(self, libvirt_conn_mock):
+        power._DOMAIN_INDEX.build(
+            'test+tcp://localhost:5000/test',
+            [self._get_domain('uuid-gone', '00:16:3e:49:1d:11',
+                              power.libvirt.VIR_DOMAIN_RUNNING)])
+        libvirt_conn_mock.return_value = FakeConnection([
+            self._get_domain('uuid-on', '00:16:3e:49:1d:11',
+                             power.libvirt.VIR_DOMAIN_RUNNING)])
+
+        result = power.get_power_states(self.nodes[:1],
+                                        context=self.context)
+
+        self.assertEqual({self.nodes[0].uuid: states.POWER_ON}, result)
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states_tasks(self, libvirt_conn_mock):
+        libvirt_conn_mock.return_value = FakeConnection([
+            self._get_domain('uuid-on', '00:16:3e:49:1d:11',
+                             power.libvirt.VIR_DOMAIN_PAUSED)])
+
+        with task_manager.acquire(self.context, self.nodes[0].uuid,
+                                  shared=True) as task:
+            result = power.get_power_states([task])
+
+        self.assertEqual({self.nodes[0].uuid: states.POWER_ON}, result)
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states_nodes_without_context(self, libvirt_conn_mock):
+        self.assertRaises(exception.InvalidParameterValue,
+                          power.get_power_states, self.nodes)
+        self.assertFalse(libvirt_conn_mock.called)
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states_match_single_node(self, libvirt_conn_mock):
+        for state in (power.libvirt.VIR_DOMAIN_CRASHED,
+                      power.libvirt.VIR_DOMAIN_PMSUSPENDED):
+            domain = self._get_domain('uuid', '00:16:3e:49:1d:11', state)
+            libvirt_conn_mock.return_value = FakeConnection([domain])
+            power._DOMAIN_INDEX.invalidate()
+
+            result = power.get_power_states(self.nodes[:1],
+                                            context=self.context)
+
+            self.assertEqual(power._get_power_state(domain),
+                             result[self.nodes[0].uuid])
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states_domain_not_found(self, libvirt_conn_mock):
+        libvirt_conn_mock.return_value = FakeConnection([
+            self._get_domain('uuid-on', '00:16:3e:49:1d:11',
+                             power.libvirt.VIR_DOMAIN_RUNNING)])
+
+        result = power.get_power_states(self.nodes,
+                                        context=self.context)
+
+        self.assertEqual({self.nodes[0].uuid: states.POWER_ON,
+                          self.nodes[1].uuid: states.ERROR}, result)
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states_connection_error(self, libvirt_conn_mock):
+        libvirt_conn_mock.side_effect = isd_exc.LibvirtError(err='boom')
+
+        result = power.get_power_states(self.nodes,
+                                        context=self.context)
+
+        self.assertEqual({self.nodes[0].uuid: states.ERROR,
+                          self.nodes[1].uuid: states.ERROR}, result)
+
+    @mock.patch.object(power, '_get_libvirt_connection', autospec=True)
+    def test_get_power_states_invalid_driver_info(self, libvirt_conn_mock):
+        self.nodes[0].driver_info = _get_test_libvirt_driver_info('ssh_sasl')
+        libvirt_conn_mock.return_value = FakeConnection([
+            self._get_domain('uuid-off', '00:16:3e:49:1d:22',
+                             power.libvirt.VIR_DOMAIN_SHUTOFF)])
+
+        result = power.get_power_states(self.nodes,
+                                        context=self.context)
+
+        self.assertEqual({self.nodes[0].uuid: states.ERROR,
+                          self.nodes[1].uuid: states.POWER_OFF}, result)
+
+
+@mock.patch.object(power.libvirt, 'open', autospec=True)
+class LibvirtConnectionPoolTestCase(base.TestCase):
+
+    def setUp(self):
+        super(LibvirtConnectionPoolTestCase, self).setUp()
+        self.pool = power._ConnectionPool()
+        self.info = _get_test_libvirt_driver_info('socket')
+
+    def test_get_reuses_connection(self, libvirt_open_mock):
+        conn = self.pool.get(self.info)
+
+        self.assertIs(conn, self.pool.get(self.info))
+        libvirt_open_mock.assert_called_once_with(self.info['libvirt_uri'])
+
+    def test_get_different_uri(self, libvirt_open_mock):
+        libvirt_open_mock.side_effect = [mock.Mock(), mock.Mock()]
+        other_info = {'libvirt_uri': 'qemu+tcp://other/system'}
+
+        self.assertIsNot(self.pool.get(self.info),
+                         self.pool.get(other_info))
+        self.assertEqual(2, libvirt_open_mock.call_count)
+
+    def test_get_dead_connection(self, libvirt_open_mock):
+        dead_conn = mock.Mock()
+        dead_conn.isAlive.return_value = False
+        new_conn = mock.Mock()
+        libvirt_open_mock.side_effect = [dead_conn, new_conn]
+
+        self.pool.get(self.info)
+
+        self.assertIs(new_conn, self.pool.get(self.info))
+        dead_conn.close.assert_called_once_with()
+
+    def test_get_idle_timeout(self, libvirt_open_mock):
+        CONF.set_override('connection_idle_timeout', 10, 'libvirt_driver')
+        old_conn = mock.Mock()
+        libvirt_open_mock.side_effect = [old_conn, mock.Mock()]
+
+        with mock.patch.object(power.time, 'time', return_value=100):
+            self.pool.get(self.info)
+        with mock.patch.object(power.time, 'time', return_value=111):
+            self.assertIsNot(old_conn, self.pool.get(self.info))
+
+        old_conn.close.assert_called_once_with()
+
+    def test_get_pool_size(self, libvirt_open_mock):
+        CONF.set_override('connection_pool_size', 1, 'libvirt_driver')
+        first_conn = mock.Mock()
+        libvirt_open_mock.side_effect = [first_conn, mock.Mock()]
+
+        self.pool.get(self.info)
+        self.pool.get({'libvirt_uri': 'qemu+tcp://other/system'})
+
+        first_conn.close.assert_called_once_with()
+
+    def test_get_idle_timeout_leased(self, libvirt_open_mock):
+        CONF.set_override('connection_idle_timeout', 10, 'libvirt_driver')
+        other_info = {'libvirt_uri': 'qemu+tcp://other/system'}
+        conn = mock.Mock()
+        libvirt_open_mock.side_effect = [conn, mock.Mock()]
+
+        with self.pool.lease(self.info):
+            with mock.patch.object(power.time, 'time', return_value=100):
+                self.pool.get(self.info)
+            with mock.patch.object(power.time, 'time', return_value=111):
+                self.pool.get(other_info)
+
+            self.assertFalse(conn.close.called)
+        with mock.patch.object(power.time, 'time', return_value=112):
+            self.assertIs(conn, self.pool.get(self.info))
+
+    def test_get_pool_size_leased(self, libvirt_open_mock):
+        CONF.set_override('connection_pool_size', 1, 'libvirt_driver')
+        other_info = {'libvirt_uri': 'qemu+tcp://other/system'}
+        first_conn = mock.Mock()
+        other_conn = mock.Mock()
+        libvirt_open_mock.side_effect = [first_conn, other_conn, mock.Mock()]
+
+        with self.pool.lease(self.info):
+            self.pool.get(self.info)
+            # Both connections are kept, the new one being in use too
+            self.assertIs(other_conn, self.pool.get(other_info))
+            self.assertFalse(first_conn.close.called)
+            self.assertFalse(other_conn.close.called)
+
+        self.pool.get({'libvirt_uri': 'qemu+tcp://third/system'})
+        first_conn.close.assert_called_once_with()
+        other_conn.close.assert_called_once_with()
+
+    def test_discard(self, libvirt_open_mock):
+        conn = self.pool.get(self.info)
+
+        self.pool.discard(self.info, conn)
+
+        conn.close.assert_called_once_with()
+        self.pool.get(self.info)
+        self.assertEqual(2, libvirt_open_mock.call_count)
+
+    @mock.patch.object(power._POWER_STATE_CACHE, 'watch', autospec=True)
+    @mock.patch.object(power._EVENT_LOOP, 'start', autospec=True)
+    def test_get_power_state_events(self, start_mock, watch_mock,
+                                    libvirt_open_mock):
+        CONF.set_override('power_state_events', True, 'libvirt_driver')
+
+        conn = self.pool.get(self.info)
+
+        start_mock.assert_called_once_with()
+        watch_mock.assert_called_once_with(
+            power._connection_key(self.info), conn)
+
+    @mock.patch.object(power._POWER_STATE_CACHE, 'watch', autospec=True)
+    @mock.patch.object(power._EVENT_LOOP, 'start', autospec=True)
+    def test_get_default_options(self, start_mock, watch_mock,
+                                 libvirt_open_mock):
+        self.assertFalse(CONF.libvirt_driver.power_state_events)
+        self.assertEqual(60, CONF.libvirt_driver.power_state_cache_ttl)
+
+        conn = self.pool.get(self.info)
+
+        self.assertIs(libvirt_open_mock.return_value, conn)
+        self.assertFalse(start_mock.called)
+        self.assertFalse(watch_mock.called)
+
+    def test_discard_other_connection(self, libvirt_open_mock):
+        conn = self.pool.get(self.info)
+
+        self.pool.discard(self.info, mock.Mock())
+
+        self.assertFalse(conn.close.called)
+        self.assertIs(conn, self.pool.get(self.info))
+
+
+@mock.patch.object(power._EVENT_LOOP, 'is_alive', lambda *_: True)
+class LibvirtPowerStateCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(LibvirtPowerStateCacheTestCase, self).setUp()
+        self.cache = power._PowerStateCache()
+        self.domain = FakeLibvirtDomain()
+        self.uuid = self.domain.UUIDString()
+        self.conn = mock.Mock()
+        self.key = ('fake uri', 'admin', None)
+
+    def test_watch(self):
+        self.cache.watch(self.key, self.conn)
+
+        self.conn.domainEventRegisterAny.assert_called_once_with(
+            None, power.libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+            self.cache._lifecycle_callback, self.key)
+        self.assertTrue(self.cache.is_watched('fake uri'))
+
+    def test_watch_not_supported(self):
+        self.conn.domainEventRegisterAny.side_effect = (
+            power.libvirt.libvirtError('Not supported'))
+
+        self.cache.watch(self.key, self.conn)
+
+        self.assertFalse(self.cache.is_watched('fake uri'))
+
+    def test_unwatch(self):
+        self.cache.watch(self.key, self.conn)
+        self.cache.record('fake uri', self.uuid, states.POWER_ON)
+
+        self.cache.unwatch(self.conn)
+
+        self.assertFalse(self.cache.is_watched('fake uri'))
+        self.assertIsNone(self.cache.get('fake uri', self.uuid))
+        self.conn.domainEventDeregisterAny.assert_called_once_with(
+            self.conn.domainEventRegisterAny.return_value)
+
+    def test_close_callback(self):
+        self.cache.watch(self.key, self.conn)
+        self.cache.record('fake uri', self.uuid, states.POWER_ON)
+
+        self.cache._close_callback(self.conn, 0, self.key)
+
+        self.assertFalse(self.cache.is_watched('fake uri'))
+        self.assertIsNone(self.cache.get('fake uri', self.uuid))
+
+    def test_unwatch_other_credentials(self):
+        other_conn = mock.Mock()
+        self.cache.watch(self.key, self.conn)
+        self.cache.watch(('fake uri', 'other', None), other_conn)
+        self.cache.record('fake uri', self.uuid, states.POWER_ON)
+
+        self.cache.unwatch(other_conn)
+
+        self.assertTrue(self.cache.is_watched('fake uri'))
+        self.assertEqual(states.POWER_ON,
+                         self.cache.get('fake uri', self.uuid))
+
+        self.cache.unwatch(self.conn)
+
+        self.assertFalse(self.cache.is_watched('fake uri'))
+        self.assertIsNone(self.cache.get('fake uri', self.uuid))
+
+    def test_lifecycle_started(self):
+        self.cache._lifecycle_callback(
+            self.conn, self.domain, power.libvirt.VIR_DOMAIN_EVENT_STARTED,
+            0, self.key)
+
+        self.assertEqual(states.POWER_ON,
+                         self.cache.get('fake uri', self.uuid))
+
+    def test_lifecycle_stopped(self):
+        self.cache.record('fake uri', self.uuid, states.POWER_ON)
+
+        self.cache._lifecycle_callback(
+            self.conn, self.domain, power.libvirt.VIR_DOMAIN_EVENT_STOPPED,
+            0, self.key)
+
+        self.assertEqual(states.POWER_OFF,
+                         self.cache.get('fake uri', self.uuid))
+
+    @mock.patch.object(power._DOMAIN_INDEX, 'invalidate', autospec=True)
+    def test_lifecycle_undefined(self, invalidate_mock):
+        self.cache.record('fake uri', self.uuid, states.POWER_OFF)
+
+        self.cache._lifecycle_callback(
+            self.conn, self.domain,
+            power.libvirt.VIR_DOMAIN_EVENT_UNDEFINED, 0, self.key)
+
+        invalidate_mock.assert_called_once_with('fake uri')
+        self.assertIsNone(self.cache.get('fake uri', self.uuid))
+
+    @mock.patch.object(power, 'LOG', autospec=True)
+    def test_lifecycle_native_thread(self, log_mock):
+        self.cache.record('fake uri', self.uuid, states.POWER_ON)
+        power._DOMAIN_INDEX.build('fake uri', [])
+        self.addCleanup(power._DOMAIN_INDEX.invalidate)
+
+        thread = power._native_threading.Thread(
+            target=self.cache._lifecycle_callback,
+            args=(self.conn, self.domain,
+                  power.libvirt.VIR_DOMAIN_EVENT_UNDEFINED, 0, self.key))
+        thread.start()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(power._DOMAIN_INDEX.get('fake uri'))
+        self.assertIsNone(self.cache.get('fake uri', self.uuid))
+        self.assertFalse(log_mock.method_calls)
+
+    def test_get_expired(self):
+        CONF.set_override('power_state_cache_ttl', 10, 'libvirt_driver')
+        with mock.patch.object(power.time, 'time', return_value=100):
+            self.cache.record('fake uri', self.uuid, states.POWER_ON)
+
+        with mock.patch.object(power.time, 'time', return_value=105):
+            self.assertEqual(states.POWER_ON,
+                             self.cache.get('fake uri', self.uuid))
+        with mock.patch.object(power.time, 'time', return_value=111):
+            self.assertIsNone(self.cache.get('fake uri', self.uuid))
+
+
+class LibvirtEventLoopTestCase(base.TestCase):
+
+    @mock.patch.object(power, 'LOG', autospec=True)
+    @mock.patch.object(power.libvirt, 'virEventRunDefaultImpl',
+                       autospec=True)
+    def test_failure_logged_later(self, run_mock, log_mock):
+        run_mock.side_effect = RuntimeError('boom')
+        loop = power._EventLoop()
+
+        loop._run()
+
+        self.assertFalse(log_mock.error.called)
+        self.assertFalse(loop.is_alive())
+        self.assertEqual(1, log_mock.error.call_count)
+        self.assertFalse(loop.is_alive())
+        self.assertEqual(1, log_mock.error.call_count)
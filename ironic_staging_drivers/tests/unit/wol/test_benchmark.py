@@ -0,0 +1,59 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Microbenchmarks of the Wake-On-Lan magic packet building, per packet,
+with and without the packet cache
+"""
+
+import timeit
+
+from ironic.tests import base
+from testtools import content
+
+from ironic_staging_drivers.wol import power as wol_power
+
+ADDRESSES = ['52:54:00:%02x:%02x:%02x' % (i >> 16, (i >> 8) & 0xff, i & 0xff)
+             for i in range(256)]
+ROUNDS = 100
+
+
+def _legacy_magic_packet(address):
+    """Magic packet building before packets were cached."""
+    address = address.replace(':', '')
+    data = 'FFFFFFFFFFFF' + (address * 16)
+    return bytearray.fromhex(data)
+
+
+class MagicPacketBenchmarkTestCase(base.TestCase):
+
+    def _time(self, name, func):
+        def run():
+            for address in ADDRESSES:
+                func(address)
+
+        elapsed = min(timeit.repeat(run, number=ROUNDS, repeat=3))
+        per_packet = elapsed / (ROUNDS * len(ADDRESSES)) * 1e6
+        self.addDetail(name, content.text_content(
+            '%.3f us per packet' % per_packet))
+
+    def test_magic_packet_build(self):
+        cache = wol_power._PacketCache()
+        for address in ADDRESSES:
+            self.assertEqual(bytes(_legacy_magic_packet(address)),
+                             cache.get(address))
+
+        self._time('legacy', _legacy_magic_packet)
+        self._time('cached', cache.get)
+        cache.clear()
+        self._time('uncached',
+                   lambda address: (cache.get(address), cache.clear()))
@@ -22,15 +22,19 @@ from ironic.common import driver_factory
 from ironic.common import exception as ironic_exception
 from ironic.common import states
 from ironic.conductor import task_manager
+from ironic.tests import base
 from ironic.tests.unit.conductor import mgr_utils
 from ironic.tests.unit.db import base as db_base
 from ironic.tests.unit.objects import utils as obj_utils
 import mock
+from oslo_config import cfg
 from oslo_utils import uuidutils
 
 from ironic_staging_drivers.common import exception
 from ironic_staging_drivers.wol import power as wol_power
 
+CONF = cfg.CONF
+
 
 @mock.patch.object(time, 'sleep', lambda *_: None)
 class WakeOnLanPrivateMethodTestCase(db_base.DbTestCase):
@@ -43,6 +47,10 @@ class WakeOnLanPrivateMethodTestCase(db_base.DbTestCase):
                                                driver='fake_wol_fake')
         self.port = obj_utils.create_test_port(self.context,
                                                node_id=self.node.id)
+        sender_patcher = mock.patch.object(wol_power, '_SENDER',
+                                           wol_power._MagicPacketSender())
+        sender_patcher.start()
+        self.addCleanup(sender_patcher.stop)
 
     def test__parse_parameters(self):
         with task_manager.acquire(
@@ -87,11 +95,24 @@ class WakeOnLanPrivateMethodTestCase(db_base.DbTestCase):
                 mock.call().setsockopt(socket.SOL_SOCKET,
                                        socket.SO_BROADCAST, 1),
                 mock.call().sendto(mock.ANY, ('255.255.255.255', 9)),
-                mock.call().sendto(mock.ANY, ('255.255.255.255', 9)),
-                mock.call().close()]
+                mock.call().sendto(mock.ANY, ('255.255.255.255', 9))]
 
             fake_socket.assert_has_calls(expected_calls)
             self.assertEqual(1, mock_socket.call_count)
+            self.assertFalse(fake_socket.return_value.close.called)
+
+    @mock.patch.object(socket, 'socket', autospec=True, spec_set=True)
+    def test_send_magic_packets_reuses_socket(self, mock_socket):
+        fake_socket = mock.Mock(spec=socket, spec_set=True)
+        mock_socket.return_value = fake_socket()
+        with task_manager.acquire(
+                self.context, self.node.uuid, shared=True) as task:
+            wol_power._send_magic_packets(task, '255.255.255.255', 9)
+            wol_power._send_magic_packets(task, '255.255.255.255', 9)
+            wol_power._send_magic_packets(task, '10.0.0.255', 9)
+
+        self.assertEqual(2, mock_socket.call_count)
+        self.assertEqual(3, fake_socket.return_value.sendto.call_count)
 
     @mock.patch.object(socket, 'socket', autospec=True, spec_set=True)
     def test_send_magic_packets_network_sendto_error(self, mock_socket):
@@ -107,6 +128,9 @@ class WakeOnLanPrivateMethodTestCase(db_base.DbTestCase):
             # assert sendt0() was invoked
             fake_socket.return_value.sendto.assert_called_once_with(
                 mock.ANY, ('255.255.255.255', 9))
+            # the broken socket is closed and not reused
+            fake_socket.return_value.close.assert_called_once_with()
+            self.assertEqual({}, wol_power._SENDER._sockets)
 
     @mock.patch.object(socket, 'socket', autospec=True, spec_set=True)
     def test_magic_packet_format(self, mock_socket):
@@ -126,6 +150,148 @@ class WakeOnLanPrivateMethodTestCase(db_base.DbTestCase):
                 expected_packet, ('255.255.255.255', 9))
 
 
+class WakeOnLanPacketCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(WakeOnLanPacketCacheTestCase, self).setUp()
+        self.cache = wol_power._PacketCache(size=2)
+
+    def test_get(self):
+        packet = self.cache.get('52:54:00:cf:2d:31')
+        self.assertIsInstance(packet, bytes)
+        self.assertEqual(b'\xff' * 6 + b'RT\x00\xcf-1' * 16, packet)
+
+    def test_get_normalizes(self):
+        packet = self.cache.get('52:54:00:CF:2D:31')
+        self.assertIs(packet, self.cache.get('52-54-00-cf-2d-31'))
+        self.assertEqual(['525400cf2d31'], list(self.cache._packets))
+
+    def test_get_evicts_least_recently_used(self):
+        self.cache.get('52:54:00:cf:2d:31')
+        self.cache.get('52:54:00:cf:2d:32')
+        self.cache.get('52:54:00:cf:2d:31')
+        self.cache.get('52:54:00:cf:2d:33')
+        self.assertEqual(['525400cf2d31', '525400cf2d33'],
+                         list(self.cache._packets))
+
+    def test_clear(self):
+        self.cache.get('52:54:00:cf:2d:31')
+        self.cache.clear()
+        self.assertEqual({}, self.cache._packets)
+
+
+@mock.patch.object(wol_power._MagicPacketSender, 'send', autospec=True)
+class WakeOnLanBatchTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(WakeOnLanBatchTestCase, self).setUp()
+        mgr_utils.mock_the_extension_manager(driver='fake_wol_fake')
+        self.node1 = obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(),
+            driver='fake_wol_fake')
+        obj_utils.create_test_port(self.context, node_id=self.node1.id,
+                                   uuid=uuidutils.generate_uuid(),
+                                   address='52:54:00:cf:2d:31')
+        obj_utils.create_test_port(self.context, node_id=self.node1.id,
+                                   uuid=uuidutils.generate_uuid(),
+                                   address='52:54:00:cf:2d:32')
+        self.node2 = obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(),
+            driver='fake_wol_fake',
+            driver_info={'wol_host': '10.0.0.255', 'wol_port': 7})
+        obj_utils.create_test_port(self.context, node_id=self.node2.id,
+                                   uuid=uuidutils.generate_uuid(),
+                                   address='52:54:00:cf:2d:33')
+
+    def test_send_magic_packets_interleaved(self, mock_send):
+        failures = wol_power.send_magic_packets([self.node1, self.node2],
+                                                context=self.context)
+
+        self.assertEqual({}, failures)
+        dests = [c[0][2] for c in mock_send.call_args_list]
+        self.assertEqual([('255.255.255.255', 9), ('10.0.0.255', 7),
+                          ('255.255.255.255', 9)], dests)
+        packets = set(bytes(c[0][1]) for c in mock_send.call_args_list)
+        self.assertEqual(
+            set(bytes(wol_power._build_magic_packet(address))
+                for address in ('52:54:00:cf:2d:31', '52:54:00:cf:2d:32',
+                                '52:54:00:cf:2d:33')),
+            packets)
+
+    def test_send_magic_packets_tasks(self, mock_send):
+        with task_manager.acquire(self.context, self.node2.uuid,
+                                  shared=True) as task:
+            failures = wol_power.send_magic_packets([task])
+
+        self.assertEqual({}, failures)
+        mock_send.assert_called_once_with(
+            mock.ANY, wol_power._build_magic_packet('52:54:00:cf:2d:33'),
+            ('10.0.0.255', 7))
+
+    def test_send_magic_packets_nodes_without_context(self, mock_send):
+        self.assertRaises(ironic_exception.InvalidParameterValue,
+                          wol_power.send_magic_packets,
+                          [self.node1, self.node2])
+        self.assertFalse(mock_send.called)
+
+    def test_send_magic_packets_send_failure(self, mock_send):
+        mock_send.side_effect = [socket.error('boom'), None, None]
+
+        failures = wol_power.send_magic_packets([self.node1, self.node2],
+                                                context=self.context)
+
+        self.assertEqual([self.node1.uuid], list(failures))
+        self.assertEqual(1, len(failures[self.node1.uuid]))
+        self.assertIn('boom', failures[self.node1.uuid][0])
+        self.assertEqual(3, mock_send.call_count)
+
+    def test_send_magic_packets_invalid_node(self, mock_send):
+        node3 = obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(),
+            driver='fake_wol_fake')
+
+        failures = wol_power.send_magic_packets([node3, self.node2],
+                                                context=self.context)
+
+        self.assertEqual([node3.uuid], list(failures))
+        mock_send.assert_called_once_with(mock.ANY, mock.ANY,
+                                          ('10.0.0.255', 7))
+
+
+@mock.patch.object(time, 'sleep', autospec=True)
+@mock.patch.object(time, 'time', autospec=True)
+class WakeOnLanTokenBucketTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(WakeOnLanTokenBucketTestCase, self).setUp()
+        CONF.set_override('packets_per_second', 2, 'wol_driver')
+        CONF.set_override('packets_burst', 1, 'wol_driver')
+        self.bucket = wol_power._TokenBucket()
+
+    def test_consume_paced(self, mock_time, mock_sleep):
+        mock_time.return_value = 100.0
+        for i in range(3):
+            self.bucket.consume()
+        mock_sleep.assert_has_calls([mock.call(0.5), mock.call(1.0)])
+        self.assertEqual(2, mock_sleep.call_count)
+
+    def test_consume_refills(self, mock_time, mock_sleep):
+        mock_time.side_effect = [100.0, 101.0, 101.1]
+        for i in range(3):
+            self.bucket.consume()
+        # the token spent at 100.0 was refilled by 101.0, the next one
+        # is only available at 101.5
+        mock_sleep.assert_called_once_with(mock.ANY)
+        self.assertAlmostEqual(0.4, mock_sleep.call_args[0][0])
+
+    def test_consume_burst(self, mock_time, mock_sleep):
+        CONF.set_override('packets_burst', 3, 'wol_driver')
+        mock_time.return_value = 100.0
+        for i in range(4):
+            self.bucket.consume()
+        mock_sleep.assert_called_once_with(0.5)
+
+
 @mock.patch.object(time, 'sleep', lambda *_: None)
 class WakeOnLanDriverTestCase(db_base.DbTestCase):
 
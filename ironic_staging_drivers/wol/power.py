@@ -17,22 +17,50 @@
 Ironic Wake-On-Lan power manager.
 """
 
-import contextlib
+import binascii
+import collections
 import socket
+import threading
 import time
 
 from ironic.common import exception as ironic_exception
 from ironic.common import states
 from ironic.conductor import task_manager
 from ironic.drivers import base
+from ironic.drivers import utils as driver_utils
+from ironic import objects
+from oslo_config import cfg
 from oslo_log import log
+import six
 
 from ironic_staging_drivers.common import exception
 from ironic_staging_drivers.common.i18n import _
 from ironic_staging_drivers.common.i18n import _LI
+from ironic_staging_drivers.common.i18n import _LW
 from ironic_staging_drivers.common import utils
 
 
+opts = [
+    cfg.IntOpt('packets_per_second',
+               default=100,
+               min=1,
+               help=_('Maximum number of Wake-On-Lan magic packets sent per '
+                      'second by the conductor, shared by all nodes. Keeps '
+                      'mass power on from flooding the network with '
+                      'broadcast packets.')),
+    cfg.IntOpt('packets_burst',
+               default=10,
+               min=1,
+               help=_('Number of magic packets which can be sent at once, '
+                      'before the packets_per_second limit applies.')),
+]
+
+CONF = cfg.CONF
+opt_group = cfg.OptGroup(name='wol_driver',
+                         title='Options for the Wake-On-Lan power driver')
+CONF.register_group(opt_group)
+CONF.register_opts(opts, opt_group)
+
 LOG = log.getLogger(__name__)
 
 REQUIRED_PROPERTIES = {}
@@ -44,6 +72,135 @@ OPTIONAL_PROPERTIES = {
 COMMON_PROPERTIES = REQUIRED_PROPERTIES.copy()
 COMMON_PROPERTIES.update(OPTIONAL_PROPERTIES)
 
+MAGIC_PACKET_HEADER = b'\xff' * 6
+# Maximum number of magic packets kept in memory
+MAGIC_PACKET_CACHE_SIZE = 4096
+
+
+class _TokenBucket(object):
+    """Token bucket limiting the rate of sent magic packets."""
+
+    def __init__(self):
+        self._tokens = None
+        self._last = None
+        self._lock = threading.Lock()
+
+    def consume(self):
+        """Take a token, sleeping until one is available."""
+        rate = CONF.wol_driver.packets_per_second
+        burst = CONF.wol_driver.packets_burst
+        with self._lock:
+            now = time.time()
+            if self._last is None:
+                tokens = burst
+            else:
+                tokens = min(burst, self._tokens + (now - self._last) * rate)
+            # The balance goes negative when tokens are reserved for
+            # callers which are waiting for them
+            self._tokens = tokens - 1
+            self._last = now
+            delay = -self._tokens / float(rate)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _MagicPacketSender(object):
+    """Rate-limited sender of magic packets.
+
+    Keeps one broadcast socket per destination, reused by all nodes.
+    """
+
+    def __init__(self):
+        self._sockets = {}
+        self._lock = threading.Lock()
+        self._bucket = _TokenBucket()
+
+    def _get_socket(self, dest):
+        with self._lock:
+            sock = self._sockets.get(dest)
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                self._sockets[dest] = sock
+            return sock
+
+    def _discard_socket(self, dest, sock):
+        with self._lock:
+            if self._sockets.get(dest) is sock:
+                del self._sockets[dest]
+        sock.close()
+
+    def send(self, packet, dest):
+        """Send the magic packet.
+
+        :param packet: the magic packet bytes.
+        :param dest: a tuple with the destination host and port.
+        :raises: socket.error if sending failed.
+        """
+        self._bucket.consume()
+        sock = self._get_socket(dest)
+        try:
+            sock.sendto(packet, dest)
+        except socket.error:
+            self._discard_socket(dest, sock)
+            raise
+
+    def close(self):
+        """Close all sockets."""
+        with self._lock:
+            sockets = list(self._sockets.values())
+            self._sockets.clear()
+        for sock in sockets:
+            sock.close()
+
+
+_SENDER = _MagicPacketSender()
+
+
+class _PacketCache(object):
+    """LRU cache of magic packets, keyed by normalized MAC address."""
+
+    def __init__(self, size=MAGIC_PACKET_CACHE_SIZE):
+        self._size = size
+        self._packets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, address):
+        """Get the magic packet of a MAC address, building it if needed.
+
+        :param address: the MAC address, in any format normalized by
+            ironic.drivers.utils.normalize_mac.
+        :returns: the magic packet bytes.
+        """
+        mac = driver_utils.normalize_mac(address)
+        with self._lock:
+            packet = self._packets.pop(mac, None)
+            if packet is not None:
+                self._packets[mac] = packet
+                return packet
+
+        # TODO(lucasagomes): Implement sending the magic packets with
+        # SecureON password feature. If your NIC is capable of, you can
+        # set the password of your SecureON using the ethtool utility.
+        packet = MAGIC_PACKET_HEADER + binascii.unhexlify(mac) * 16
+        with self._lock:
+            self._packets[mac] = packet
+            while len(self._packets) > self._size:
+                self._packets.popitem(last=False)
+        return packet
+
+    def clear(self):
+        with self._lock:
+            self._packets.clear()
+
+
+_PACKET_CACHE = _PacketCache()
+
+
+def _build_magic_packet(address):
+    """Get the magic packet waking the NIC with the given MAC address."""
+    return _PACKET_CACHE.get(address)
+
 
 def _send_magic_packets(task, dest_host, dest_port):
     """Create and send magic packets.
@@ -58,44 +215,109 @@ def _send_magic_packets(task, dest_host, dest_port):
         host or sending the magic packets
 
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    with contextlib.closing(s) as sock:
-        for port in task.ports:
-            address = port.address.replace(':', '')
-
-            # TODO(lucasagomes): Implement sending the magic packets with
-            # SecureON password feature. If your NIC is capable of, you can
-            # set the password of your SecureON using the ethtool utility.
-            data = 'FFFFFFFFFFFF' + (address * 16)
-            packet = bytearray.fromhex(data)
-
-            try:
-                sock.sendto(packet, (dest_host, dest_port))
-            except socket.error as e:
-                msg = (_("Failed to send Wake-On-Lan magic packets to "
-                         "node %(node)s port %(port)s. Error: %(error)s") %
-                       {'node': task.node.uuid, 'port': port.address,
-                        'error': e})
-                LOG.exception(msg)
-                raise exception.WOLOperationError(msg)
-
-            # let's not flood the network with broadcast packets
-            time.sleep(0.5)
-
-
-def _parse_parameters(task):
-    driver_info = task.node.driver_info
+    for port in task.ports:
+        packet = _build_magic_packet(port.address)
+        try:
+            _SENDER.send(packet, (dest_host, dest_port))
+        except socket.error as e:
+            msg = (_("Failed to send Wake-On-Lan magic packets to "
+                     "node %(node)s port %(port)s. Error: %(error)s") %
+                   {'node': task.node.uuid, 'port': port.address,
+                    'error': e})
+            LOG.exception(msg)
+            raise exception.WOLOperationError(msg)
+
+
+@utils.cache_driver_info()
+def _parse_driver_info(node):
+    driver_info = node.driver_info
     host = driver_info.get('wol_host', '255.255.255.255')
     port = driver_info.get('wol_port', 9)
     port = utils.validate_network_port(port, 'wol_port')
+    return {'host': host, 'port': port}
 
-    if len(task.ports) < 1:
+
+def _check_ports(ports):
+    if len(ports) < 1:
         raise ironic_exception.MissingParameterValue(_(
             'Wake-On-Lan needs at least one port resource to be '
             'registered in the node'))
 
-    return {'host': host, 'port': port}
+
+def _parse_parameters(task):
+    params = _parse_driver_info(task.node)
+    _check_ports(task.ports)
+    return params
+
+
+def _get_ports(task_or_node, context):
+    """Get the node and the ports of a task or a node."""
+    if hasattr(task_or_node, 'node'):
+        return task_or_node.node, task_or_node.ports
+    node = task_or_node
+    return node, objects.Port.list_by_node_id(context, node.id)
+
+
+def send_magic_packets(tasks_or_nodes, context=None):
+    """Wake many nodes at once.
+
+    The magic packets of all the nodes are built first, grouped by
+    destination, and then sent interleaved across destinations, paced by
+    the same limit as the single node power on. A failure to send a packet
+    does not abort the sending of the others.
+
+    This only sends the packets: the caller is responsible for locking the
+    nodes and for updating their power state.
+
+    :param tasks_or_nodes: a list of TaskManager instances or Node objects.
+    :param context: the request context used to list the ports of the Node
+        objects. Required when Node objects are given.
+    :returns: a dict mapping the UUIDs of the nodes which could not be
+        fully woken to lists of error messages. It is empty if all the
+        packets were sent.
+    :raises: InvalidParameterValue if Node objects are given without a
+        context.
+    """
+    tasks_or_nodes = list(tasks_or_nodes)
+    if context is None and not all(hasattr(t, 'node')
+                                   for t in tasks_or_nodes):
+        raise ironic_exception.InvalidParameterValue(_(
+            'A context is required to wake Node objects'))
+    failures = {}
+    # (wol_host, wol_port) -> [(node uuid, port address, packet)]
+    destinations = collections.OrderedDict()
+    for task_or_node in tasks_or_nodes:
+        node, ports = _get_ports(task_or_node, context)
+        try:
+            params = _parse_driver_info(node)
+            _check_ports(ports)
+        except (ironic_exception.InvalidParameterValue,
+                ironic_exception.MissingParameterValue) as e:
+            LOG.warning(_LW("Can't wake node %(node)s: %(err)s"),
+                        {'node': node.uuid, 'err': e})
+            failures.setdefault(node.uuid, []).append(six.text_type(e))
+            continue
+        dest = (params['host'], params['port'])
+        packets = destinations.setdefault(dest, [])
+        for port in ports:
+            packets.append((node.uuid, port.address,
+                            _build_magic_packet(port.address)))
+
+    for batch in six.moves.zip_longest(*destinations.values()):
+        for dest, item in zip(destinations, batch):
+            if item is None:
+                continue
+            uuid, address, packet = item
+            try:
+                _SENDER.send(packet, dest)
+            except socket.error as e:
+                msg = (_("Failed to send Wake-On-Lan magic packet to "
+                         "node %(node)s port %(port)s. Error: %(error)s") %
+                       {'node': uuid, 'port': address, 'error': e})
+                LOG.warning(msg)
+                failures.setdefault(uuid, []).append(msg)
+
+    return failures
 
 
 class WakeOnLanPower(base.PowerInterface):